@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the converter's hot paths.
+
+Usage:
+    python benchmark.py parse [saved_result_page.html ...]
+    python benchmark.py markdown [trip.md ...]
+    python benchmark.py html [days] [rows]
+    python benchmark.py sections [count ...] [--workers N]
+
+parse: Google Images result page parsing, the single-pass parser against
+the previous two-regex implementation. Without arguments a synthetic
+multi-megabyte result page is used; its URLs carry their result number,
+so mispaired thumbnails can be counted.
+
+markdown: utils.markdown_to_html against the previous line-by-line
+renderer, on whole documents (default: aus_mel.md and aus_nz.md) and on
+every paragraph and list item as an inline span, with the inline LRU
+empty (cold) and filled (warm).
+
+html: styles.render_itinerary_full and styles.render_table, which append
+to a shared list of parts, against the previous string-concatenating
+versions, on a synthetic itinerary (default 500 days) and table (1000 rows).
+
+sections: generator.render_document serially against the process pool,
+pool start-up included, on synthetic documents of 25 to 300 sections
+(generator.parallel_min_sections() is where parallel starts by default).
+"""
+
+import html as html_module
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / 'travel_md_converter'))
+
+from scraper import parse_image_results, MAX_IMAGES
+from utils import markdown_to_html, process_inline_markdown
+from mdrender import clear_inline_cache
+from styles import render_itinerary_full, render_table, safe_img_url
+import generator
+
+ROOT = Path(__file__).parent
+
+
+def best_time(fn, *args, repeat=5):
+    """Best wall time of `repeat` calls, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def legacy_parse_image_results(html, max_images=MAX_IMAGES):
+    """The two-regex parser scrape_google_images used before, for comparison."""
+    decode_url = lambda url: url.encode().decode('unicode_escape')
+
+    thumb_pattern = r'(https://encrypted-tbn\d*\.gstatic\.com/images\?q[^"\'>\s]+)'
+    thumbnails = []
+    seen = set()
+    for t in re.findall(thumb_pattern, html):
+        decoded = decode_url(t)
+        if decoded not in seen:
+            seen.add(decoded)
+            thumbnails.append(decoded)
+
+    orig_pattern = r'\["(https://[^"]+)",\s*(\d+),\s*(\d+)\]'
+    originals = []
+    for raw_url, w, h in re.findall(orig_pattern, html):
+        url = decode_url(raw_url)
+        if 'google.com' in url or 'gstatic.com' in url:
+            continue
+        if int(w) < 200 or int(h) < 200:
+            continue
+        if not any(url.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp']):
+            continue
+        originals.append((url, int(w), int(h)))
+
+    results = []
+    for i, (orig_url, w, h) in enumerate(originals[:max_images]):
+        result = {'original_url': orig_url, 'width': w, 'height': h}
+        if i < len(thumbnails):
+            result['thumbnail_url'] = thumbnails[i]
+        results.append(result)
+
+    if not results and thumbnails:
+        for thumb in thumbnails[:max_images]:
+            results.append({'original_url': thumb, 'thumbnail_url': thumb})
+    return results
+
+
+def legacy_process_inline_markdown(text):
+    """The four-substitution inline renderer, for comparison."""
+    text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', text)
+    text = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', text)
+    text = re.sub(r'_([^_]+)_', r'<em>\1</em>', text)
+    text = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', text)
+    return text
+
+
+def legacy_parse_table(lines, start_idx):
+    table_lines = []
+    i = start_idx
+    while i < len(lines) and '|' in lines[i]:
+        table_lines.append(lines[i].strip())
+        i += 1
+    if len(table_lines) < 2:
+        return '', start_idx
+
+    html = '<div class="table-wrapper"><table>\n'
+    header_cells = [cell.strip() for cell in table_lines[0].split('|') if cell.strip()]
+    html += '<thead><tr>\n'
+    for cell in header_cells:
+        html += f'<th>{legacy_process_inline_markdown(cell)}</th>\n'
+    html += '</tr></thead>\n'
+    data_start = 1
+    if len(table_lines) > 1 and re.match(r'^[\s|:\-]+$', table_lines[1]):
+        data_start = 2
+    if data_start < len(table_lines):
+        html += '<tbody>\n'
+        for row in table_lines[data_start:]:
+            cells = [cell.strip() for cell in row.split('|') if cell.strip()]
+            html += '<tr>\n'
+            for cell in cells:
+                html += f'<td>{legacy_process_inline_markdown(cell)}</td>\n'
+            html += '</tr>\n'
+        html += '</tbody>\n'
+    html += '</table></div>\n'
+    return html, i
+
+
+def legacy_markdown_to_html(md_text):
+    """The line-by-line renderer utils.markdown_to_html used before, for comparison."""
+    lines = md_text.split('\n')
+    html_parts = []
+    i = 0
+    in_list = False
+    list_type = None
+
+    while i < len(lines):
+        line = lines[i]
+        if in_list and not (line.strip().startswith('- ') or line.strip().startswith('* ') or re.match(r'^\d+\.', line.strip())):
+            html_parts.append(f'</{list_type}>')
+            in_list = False
+            list_type = None
+        if line.startswith('#'):
+            i += 1
+            continue
+        if line.strip() == '---':
+            html_parts.append('<hr>')
+            i += 1
+            continue
+        if '|' in line and line.strip().startswith('|'):
+            table_html, next_i = legacy_parse_table(lines, i)
+            if table_html:
+                html_parts.append(table_html)
+                i = next_i
+                continue
+        if line.strip().startswith('- ') or line.strip().startswith('* '):
+            if not in_list:
+                html_parts.append('<ul>')
+                in_list = True
+                list_type = 'ul'
+            content = line.strip()[2:]
+            html_parts.append(f'<li>{legacy_process_inline_markdown(content)}</li>')
+        elif re.match(r'^\d+\.', line.strip()):
+            if not in_list:
+                html_parts.append('<ol>')
+                in_list = True
+                list_type = 'ol'
+            content = re.sub(r'^\d+\.\s*', '', line.strip())
+            html_parts.append(f'<li>{legacy_process_inline_markdown(content)}</li>')
+        elif line.strip():
+            html_parts.append(f'<p>{legacy_process_inline_markdown(line)}</p>')
+        i += 1
+
+    if in_list:
+        html_parts.append(f'</{list_type}>')
+    return '\n'.join(html_parts)
+
+
+def legacy_render_table(table_data):
+    """styles.render_table before it wrote into a list of parts, for comparison."""
+    headers = table_data.get('headers', [])
+    rows = table_data.get('rows', [])
+    html = '<div class="table-wrapper"><table>\n'
+    if headers:
+        html += '<thead><tr>\n'
+        for h in headers:
+            html += f'<th>{h}</th>\n'
+        html += '</tr></thead>\n'
+    if rows:
+        html += '<tbody>\n'
+        for row in rows:
+            html += '<tr>\n'
+            for cell in row:
+                html += f'<td>{cell}</td>\n'
+            html += '</tr>\n'
+        html += '</tbody>\n'
+    html += '</table></div>\n'
+    return html
+
+
+def legacy_render_itinerary_full(itinerary, cache=None):
+    """styles.render_itinerary_full before it wrote into a list of parts, for comparison."""
+    html = '<div class="cards-grid itinerary-cards">\n'
+    for item in itinerary:
+        day = item.get('day', '')
+        item_title = item.get('title', '')
+        location = item.get('location', '')
+        distance = item.get('distance', '')
+        terrain = item.get('terrain', '')
+        item_content = item.get('content', '')
+        list_items = item.get('activities', []) or item.get('details', []) or item.get('highlights', [])
+        dietary_note = item.get('dietary_note', '')
+        queries = item.get('queries', [])
+
+        card_img = ''
+        if queries and cache:
+            for q in queries:
+                if q in cache:
+                    urls = cache[q].get('urls', [])
+                    if urls:
+                        card_img = f'<img src="{safe_img_url(urls[0])}" alt="{html_module.escape(item_title)}" onerror="this.style.display=\'none\'">'
+                        break
+
+        content_html = ''
+        meta_items = []
+        if location:
+            meta_items.append(f'📍 {location}')
+        if distance:
+            meta_items.append(f'🚴 {distance}')
+        if terrain:
+            meta_items.append(f'🛤️ {terrain}')
+        if meta_items:
+            content_html += f'<div class="card-meta">{" · ".join(meta_items)}</div>\n'
+        if item_content:
+            truncated = item_content[:250] + '...' if len(item_content) > 250 else item_content
+            content_html += f'<p>{process_inline_markdown(truncated)}</p>\n'
+        if list_items:
+            content_html += '<ul class="card-highlights">\n'
+            for li in list_items[:4]:
+                content_html += f'<li>{process_inline_markdown(li)}</li>\n'
+            if len(list_items) > 4:
+                content_html += f'<li class="more-items">+{len(list_items) - 4} more...</li>\n'
+            content_html += '</ul>\n'
+        if dietary_note:
+            truncated_note = dietary_note[:150] + '...' if len(dietary_note) > 150 else dietary_note
+            content_html += f'<div class="card-dietary-note">🍽️ {process_inline_markdown(truncated_note)}</div>\n'
+
+        html += f'''<div class="card day-card">
+    <div class="day-badge-inline">Day {day}</div>
+    {card_img}
+    <div class="card-content">
+        <h4>{process_inline_markdown(item_title)}</h4>
+        {content_html}
+    </div>
+</div>
+'''
+    html += '</div>\n'
+    return html
+
+
+def synthetic_result_page(results=100, noise_bytes=3 * 1024 * 1024, seed=1):
+    """
+    A result page shaped like Google's: script noise around result arrays.
+
+    Result i has thumbnail ...tbn:r{i}... and original .../r{i}.jpg. Some
+    results have no usable original (too small, or not an image file), as on
+    real pages, which is what throws index pairing off.
+    """
+    rng = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+/'
+    filler_size = noise_bytes // (results + 1)
+
+    def filler():
+        return 'var _d="' + ''.join(rng.choice(alphabet) for _ in range(filler_size)) + '";'
+
+    parts = ['<html><head><script>', filler()]
+    for i in range(results):
+        thumb = f'https://encrypted-tbn0.gstatic.com/images?q\\u003dtbn:r{i}ANd9Gc\\u0026usqp\\u003dCAU'
+        if i % 4 == 1:
+            original = f'https://site{i}.example.com/photos/r{i}.jpg", 120, 160'
+        elif i % 7 == 3:
+            original = f'https://site{i}.example.com/gallery?id\\u003dr{i}", 900, 1200'
+        else:
+            original = f'https://site{i}.example.com/photos/r{i}.jpg", {rng.randint(400, 2000)}, {rng.randint(400, 2000)}'
+        parts.append(
+            f'AF_initDataCallback({{key:"ds:{i}",data:[1,[0,"r{i}",'
+            f'["{thumb}",194,259],["{original}],null,0,'
+            f'["https://www.google.com/logos/r{i}.png",300,300]]]}});'
+        )
+        parts.append(filler())
+    parts.append('</script></head><body></body></html>')
+    return ''.join(parts)
+
+
+def result_number(url):
+    match = re.search(r'r(\d+)', url or '')
+    return match.group(1) if match else None
+
+
+def count_mispaired(results):
+    """Results whose thumbnail belongs to a different result (synthetic page only)."""
+    return sum(
+        1 for r in results
+        if 'thumbnail_url' in r and result_number(r['thumbnail_url']) != result_number(r['original_url'])
+    )
+
+
+def bench_parse(paths):
+    if paths:
+        pages = [(p, Path(p).read_text(encoding='utf-8', errors='replace')) for p in paths]
+        synthetic = False
+    else:
+        pages = [('synthetic', synthetic_result_page())]
+        synthetic = True
+
+    for name, html in pages:
+        print(f"\n{name} ({len(html) / 1024 / 1024:.1f} MB)")
+        legacy = legacy_parse_image_results(html)
+        current = parse_image_results(html)
+        for label, limit in ((f'first {MAX_IMAGES}', MAX_IMAGES), ('whole page', sys.maxsize)):
+            legacy_time = best_time(legacy_parse_image_results, html, limit)
+            current_time = best_time(parse_image_results, html, limit)
+            print(f"  {label}:")
+            print(f"    two-regex:   {legacy_time * 1000:8.1f} ms  ({len(legacy_parse_image_results(html, limit))} results)")
+            print(f"    single-pass: {current_time * 1000:8.1f} ms  ({len(parse_image_results(html, limit))} results)")
+            print(f"    speedup:     {legacy_time / current_time:8.1f}x")
+
+        if synthetic:
+            print(f"  mispaired thumbnails: two-regex {count_mispaired(legacy)}, single-pass {count_mispaired(current)}")
+        else:
+            differ = sum(
+                1 for a, b in zip(legacy, current)
+                if a['original_url'] != b['original_url'] or a.get('thumbnail_url') != b.get('thumbnail_url')
+            )
+            print(f"  results that differ: {differ + abs(len(legacy) - len(current))}")
+
+
+def render_all(fn, items):
+    for item in items:
+        fn(item)
+
+
+def bench_markdown(paths):
+    paths = paths or [ROOT / 'aus_mel.md', ROOT / 'aus_nz.md']
+    for path in paths:
+        text = Path(path).read_text(encoding='utf-8')
+        spans = [line.strip().lstrip('-*').strip() for line in text.split('\n') if line.strip()]
+        print(f"\n{Path(path).name} ({len(text) / 1024:.0f} KB, {len(spans)} spans)")
+        for label, legacy, current, arg in (
+            ('document', legacy_markdown_to_html, markdown_to_html, text),
+            ('inline', lambda s: render_all(legacy_process_inline_markdown, s),
+                       lambda s: render_all(process_inline_markdown, s), spans),
+        ):
+            legacy_time = best_time(legacy, arg, repeat=20)
+            # Cold: empty inline LRU, as on a first render; warm: a rebuild
+            # or another document reusing the same strings
+            cold_time = best_time(lambda a: (clear_inline_cache(), current(a)), arg, repeat=20)
+            warm_time = best_time(current, arg, repeat=20)
+            print(f"  {label}:")
+            print(f"    previous:     {legacy_time * 1000:8.2f} ms")
+            print(f"    current/cold: {cold_time * 1000:8.2f} ms  ({legacy_time / cold_time:.1f}x)")
+            print(f"    current/warm: {warm_time * 1000:8.2f} ms  ({legacy_time / warm_time:.1f}x)")
+        differ = sum(1 for s in spans if legacy_process_inline_markdown(s) != process_inline_markdown(s))
+        same = legacy_markdown_to_html(text) == markdown_to_html(text)
+        print(f"  output: document {'identical' if same else 'differs (nested lists)'}, "
+              f"{differ} inline spans differ")
+
+
+def synthetic_itinerary(days):
+    return [{
+        'day': day,
+        'title': f'Day {day}: **Stage {day}** to Town {day % 40}',
+        'location': f'Town {day % 40}',
+        'distance': f'{40 + day % 30} km',
+        'terrain': 'Rolling hills',
+        'content': f'Ride from Town {day % 40} along the *coast road*, with a stop at the lookout. ' * 4,
+        'activities': [f'Visit **site {day}-{i}**' for i in range(6)],
+        'dietary_note': 'Ask for the low-carb option; the bakery on the square does _gluten-free_ bread.',
+        'queries': [f'town {day % 40} view'],
+    } for day in range(1, days + 1)]
+
+
+def synthetic_table(rows):
+    return {
+        'headers': ['Day', 'From', 'To', 'Distance', 'Climb', 'Notes'],
+        'rows': [[str(r), f'Town {r}', f'Town {r + 1}', f'{r % 90} km', f'{r * 7 % 900} m', 'Coffee stop at the halfway village']
+                 for r in range(rows)],
+    }
+
+
+def bench_html(args):
+    days = int(args[0]) if args else 500
+    rows = int(args[1]) if len(args) > 1 else 1000
+    cache = {f'town {i} view': {'urls': [f'https://example.com/town{i}.jpg']} for i in range(40)}
+    itinerary = synthetic_itinerary(days)
+    table = synthetic_table(rows)
+
+    for label, legacy, current, args in (
+        (f'itinerary ({days} days)', legacy_render_itinerary_full, render_itinerary_full, (itinerary, cache)),
+        (f'table ({rows} rows)', legacy_render_table, render_table, (table,)),
+    ):
+        same = legacy(*args) == current(*args)
+        legacy_time = best_time(legacy, *args, repeat=10)
+        current_time = best_time(current, *args, repeat=10)
+        print(f"\n{label}: output {'identical' if same else 'DIFFERS'}")
+        print(f"  concatenation: {legacy_time * 1000:8.2f} ms")
+        print(f"  parts list:    {current_time * 1000:8.2f} ms")
+        print(f"  speedup:       {legacy_time / current_time:8.1f}x")
+
+
+def synthetic_document(count):
+    """An analysis of `count` top-level sections of mixed styles (like a season guide)."""
+    def markdown(i):
+        # Distinct text per section, so the inline LRU doesn't flatter the serial path
+        return ''.join(
+            f'The route from **Town {i}-{j}** follows the coast road, with a [map](https://example.com/map_{i}_{j}).\n\n'
+            f'- Morning: *easy* ride to harbour {i}-{j}\n  - Coffee at the _pier {j}_\n- Afternoon: walk headland {i}\n\n'
+            f'| Stop | Distance |\n|---|---|\n| Harbour {i} | {j + 12} km |\n| Headland {i} | {j + 8} km |\n'
+            for j in range(3)
+        )
+
+    sections = [{'id': 'hero', 'title': 'Season Guide (2026)', 'style': 'hero', 'content': markdown(0)}]
+    for i in range(count):
+        style = ('content', 'day-section', 'cards', 'highlight')[i % 4]
+        section = {'id': f's{i}', 'title': f'{i}. Region {i}', 'style': style, 'content': markdown(i),
+                   'queries': [f'town {i % 40} view']}
+        if style == 'day-section':
+            section['itinerary'] = synthetic_itinerary(10)
+        elif style == 'cards':
+            section['content'] = 'Where to stay.'
+            section['cards'] = [{'title': f'Lodge {j}', 'content': 'Quiet rooms near the trail.',
+                                 'bullets': ['Bike storage', '**Early** breakfast'], 'queries': [f'town {j} view']}
+                                for j in range(6)]
+        sections.append(section)
+    return {'metadata': {'title': 'Season Guide'}, 'sections': sections}
+
+
+def bench_sections(args):
+    workers = os.cpu_count() or 1
+    counts = []
+    argv = iter(args)
+    for a in argv:
+        if a == '--workers':
+            workers = int(next(argv, workers))
+        else:
+            counts.append(int(a))
+    counts = counts or [25, 50, 100, 300]
+    cache = {f'town {i} view': {'urls': [f'https://example.com/town{i}.jpg']} for i in range(40)}
+    quiet = lambda *args: None
+
+    threshold = generator.parallel_min_sections()
+    pool = generator.pool_workers(max(2, workers))
+    print(f"Parallel: {f'{pool} workers' if pool > 1 else 'serial (no pool on one CPU)'} ({os.cpu_count()} CPUs); "
+          f"automatic {f'from {threshold} sections' if threshold else 'off (one CPU)'}")
+    for count in counts:
+        analysis = synthetic_document(count)
+        serial = lambda: (clear_inline_cache(), generator.render_document(analysis, cache, log=quiet, workers=1))[1]
+        # Forked workers inherit the parent's LRU: start both paths cold
+        parallel = lambda: (clear_inline_cache(),
+                            generator.render_document(analysis, cache, log=quiet, workers=max(2, workers)))[1]
+        same = serial() == parallel()
+        serial_time = best_time(serial, repeat=3)
+        parallel_time = best_time(parallel, repeat=3)
+        print(f"\n{count} sections: output {'identical' if same else 'DIFFERS'}")
+        print(f"  serial:   {serial_time * 1000:8.1f} ms")
+        print(f"  parallel: {parallel_time * 1000:8.1f} ms  (serial/parallel {serial_time / parallel_time:.2f})")
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'markdown': bench_markdown,
+    'html': bench_html,
+    'sections': bench_sections,
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: python benchmark.py {'|'.join(BENCHMARKS)} [args...]")
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](sys.argv[2:])
+
+
+if __name__ == '__main__':
+    main()
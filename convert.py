@@ -4,6 +4,8 @@ All-in-one script: Analyze → Scrape → Select → Generate
 
 Usage:
     python convert.py travel.md
+    python convert.py trips/              (every *.md in a directory)
+    python convert.py "trips/*.md" a.md   (globs and several files)
     
 This runs all steps automatically:
     1. Analyze (with Gemini API) - converts markdown to YAML with all content
@@ -12,47 +14,91 @@ This runs all steps automatically:
     4. Generate HTML from YAML
 
 Output: travel.html
+
+All steps run in this process (see travel_md_converter/pipeline.py), passing
+the analysis and image cache between them in memory. With several input
+files the batch is converted together: queries shared between documents
+are scraped once and selection requests share one worker pool.
 """
 
+import glob
 import sys
-import subprocess
 from pathlib import Path
 
+# The step modules import each other by name, as when run as scripts
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'travel_md_converter'))
+
+import pipeline
+
+
+def is_glob(arg):
+    return any(c in arg for c in '*?[')
+
+
+def expand_inputs(args):
+    """Expand directories (to their *.md files) and glob patterns into markdown paths."""
+    md_files = []
+    for a in args:
+        path = Path(a)
+        if path.is_dir():
+            md_files.extend(sorted(path.glob('*.md')))
+        elif is_glob(a):
+            md_files.extend(Path(p) for p in sorted(glob.glob(a)) if p.endswith('.md'))
+        else:
+            md_files.append(path)
+    # Drop duplicates, keeping order
+    return list(dict.fromkeys(md_files))
+
+
+def convert_batch(md_files, workers, batch):
+    """Convert several files together and print a per-file summary."""
+    print("\n" + "🚀 "*35)
+    print(f"Converting {len(md_files)} files")
+    print("🚀 "*35)
 
-def run_step(step_name, command, description):
-    """Run a step and handle errors."""
-    print("\n" + "="*70)
-    print(f"STEP {step_name}: {description}")
-    print("="*70 + "\n")
-    
     try:
-        result = subprocess.run(
-            command,
-            check=True,
-            capture_output=False,
-            text=True
-        )
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"\n✗ Error in {description}")
-        return False
+        results = pipeline.convert_many(md_files, workers=workers, batch=batch)
     except KeyboardInterrupt:
         print(f"\n\n⚠ Cancelled by user")
-        return False
+        sys.exit(1)
+
+    print("\n" + "="*70)
+    print("SUMMARY")
+    print("="*70)
+    for md_file, status in results.items():
+        print(f"  {md_file}: {status}")
+
+    failed = sum(1 for status in results.values() if status.startswith('✗'))
+    print(f"\n✓ {len(results) - failed} converted, {failed} failed")
+    if failed:
+        sys.exit(1)
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python convert.py travel.md")
+    batch = '--batch' in sys.argv
+    workers = None
+    args = []
+    argv = iter(sys.argv[1:])
+    for a in argv:
+        if a == '--workers':
+            workers = int(next(argv, 0)) or None
+        elif a.startswith('--workers='):
+            workers = int(a.split('=', 1)[1]) or None
+        elif not a.startswith('--'):
+            args.append(a)
+    
+    if len(args) < 1:
+        print("Usage: python convert.py travel.md|DIR|GLOB... [--workers N] [--batch]")
         print("\nThis will:")
-        print("  1. Analyze markdown with AI (skipped if .analysis.yaml exists)")
-        print("  2. Scrape images + thumbnails (cached in query_cache.yaml)")
+        print("  1. Analyze markdown with AI (skipped if the markdown is unchanged)")
+        print("  2. Scrape images + thumbnails (cached in query_cache.db)")
         print("  3. Select best images with AI (cached in .analysis.yaml)")
         print("  4. Generate HTML")
         print("\nRequired: Set GEMINI_API_KEY for analysis & selection")
         print("\nTips:")
-        print("  • Delete .analysis.yaml to force re-analysis")
+        print("  • Unchanged steps are skipped (see .manifest.yaml); delete .analysis.yaml to force re-analysis")
         print("  • Use selector.py --force to re-select images")
+        print("  • --workers N sets scraping/selection concurrency, --batch batches selection")
         print("\nAlternatively, run steps manually:")
         print("  python travel_md_converter/analyze.py travel.md")
         print("  python travel_md_converter/scraper.py travel.analysis.yaml")
@@ -60,11 +106,21 @@ def main():
         print("  python travel_md_converter/generator.py travel.analysis.yaml")
         sys.exit(1)
     
-    md_file = Path(sys.argv[1])
-    if not md_file.exists():
-        print(f"✗ Error: {md_file} not found")
+    md_files = expand_inputs(args)
+    missing = [f for f in md_files if not f.exists()]
+    if missing or not md_files:
+        for f in missing:
+            print(f"✗ Error: {f} not found")
+        if not md_files:
+            print("✗ Error: no markdown files matched")
         sys.exit(1)
     
+    if len(md_files) > 1 or Path(args[0]).is_dir() or is_glob(args[0]):
+        convert_batch(md_files, workers, batch)
+        return
+    
+    md_file = md_files[0]
+    
     # Derived file names
     analysis_file = md_file.with_suffix('.analysis.yaml')
     html_file = md_file.with_suffix('.html')
@@ -73,50 +129,14 @@ def main():
     print(f"Converting: {md_file.name} → {html_file.name}")
     print("🚀 "*35)
     
-    # Step 1: Analyze (converts MD → YAML with all content)
-    # Skip if analysis file already exists
-    if analysis_file.exists():
-        print("\n" + "="*70)
-        print(f"STEP 1/4: AI Analysis - SKIPPED (using existing {analysis_file.name})")
-        print("="*70)
-        print(f"\n✓ Found existing analysis: {analysis_file}")
-        print("  Delete it to force re-analysis.")
-    else:
-        if not run_step(
-            "1/4",
-            [sys.executable, "travel_md_converter/analyze.py", str(md_file)],
-            "AI Analysis (MD → YAML)"
-        ):
-            print("\n✗ Analysis failed. Exiting.")
-            sys.exit(1)
-        
-        if not analysis_file.exists():
-            print(f"\n✗ Expected {analysis_file} but not found")
-            sys.exit(1)
-    
-    # Step 2: Scrape images + download thumbnails
-    if not run_step(
-        "2/4",
-        [sys.executable, "travel_md_converter/scraper.py", str(analysis_file)],
-        "Image Scraping + Thumbnails"
-    ):
-        print("\n⚠ Scraping had issues, but continuing...")
-    
-    # Step 3: Select best images with Gemini Vision
-    if not run_step(
-        "3/4",
-        [sys.executable, "travel_md_converter/selector.py", str(analysis_file)],
-        "AI Image Selection"
-    ):
-        print("\n⚠ Selection had issues, will use fallback images...")
+    try:
+        result = pipeline.convert(md_file, workers=workers, batch=batch)
+    except KeyboardInterrupt:
+        print(f"\n\n⚠ Cancelled by user")
+        sys.exit(1)
     
-    # Step 4: Generate HTML from YAML
-    if not run_step(
-        "4/4",
-        [sys.executable, "travel_md_converter/generator.py", str(analysis_file)],
-        "HTML Generation (YAML → HTML)"
-    ):
-        print("\n✗ HTML generation failed. Exiting.")
+    if result is None:
+        print("\n✗ Conversion failed. Exiting.")
         sys.exit(1)
     
     # Success!
@@ -12,21 +12,65 @@ Usage:
     Manual mode (no API key):
         python travel_md_converter/analyze.py travel.md
     
+    Re-analyze the whole document even if an analysis exists:
+        python travel_md_converter/analyze.py travel.md --full
+    
+    Force or disable chunked analysis of long documents:
+        python travel_md_converter/analyze.py travel.md --chunked
+        python travel_md_converter/analyze.py travel.md --no-chunk
+    
+    Check the streaming parser against a recorded response (no API call,
+    nothing saved):
+        python travel_md_converter/analyze.py travel.md --replay response.yaml
+    
 This will:
 1. Parse sections from markdown
 2. Generate prompt for AI
 3. Call Gemini API (if key available) OR wait for manual paste
 4. Save to travel.analysis.yaml
+
+Incremental mode: the analysis records a hash of each ## section of the
+markdown (metadata.source_chunks). When travel.analysis.yaml already
+exists, only the ## sections whose text changed are sent to the model, and
+the results are merged into the existing analysis, keeping the unchanged
+sections as they were (ids, selected_images and any hand edits).
+
+Chunked mode: long documents are split on ## boundaries into chunks of
+about CHUNK_TOKEN_BUDGET tokens, which are analyzed concurrently (each with
+the whole document's outline for context) and stitched back together in
+order, keeping the hero first, the footer last and ids unique.
+
+Streaming mode: given an on_section callback (the pipeline passes one), the
+Gemini response is streamed and each top-level section is parsed and handed
+over as soon as it is complete, so image scraping starts while the rest of
+the analysis is still being generated. The full response is still parsed
+at the end and is what gets saved.
 """
 
 import yaml
 import sys
 import os
+import hashlib
+import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
 from pathlib import Path
 import re
 
+import gemini
 # Import the prompt from the dedicated prompt file
-from prompt import get_analysis_prompt
+from prompt import get_analysis_prompt, get_excerpt_prompt, split_prompt
+
+MODEL = "gemini-3-pro-preview"
+
+# Above this fraction of changed chunks, re-analyze the whole document
+MAX_INCREMENTAL_FRACTION = 0.5
+
+# Documents longer than this (estimated tokens) are analyzed in chunks of
+# at most this size, concurrently, in automatic mode
+CHUNK_TOKEN_BUDGET = 4000
+MAX_CHUNK_WORKERS = 4
 
 
 def slugify(text):
@@ -68,6 +112,19 @@ def generate_prompt(md_content):
     return get_analysis_prompt(md_content)
 
 
+def send_prompt(client, prompt, stream=False):
+    """
+    Send an analysis prompt. The static instructions go as a cached system
+    instruction (see gemini.generate_with_prefix), the document as contents.
+    """
+    instructions, request = split_prompt(prompt)
+    if instructions:
+        return gemini.generate_with_prefix(client, MODEL, instructions, request, stream=stream)
+    if stream:
+        return gemini.stream_with_retry(client.models.generate_content_stream, model=MODEL, contents=prompt)
+    return gemini.call_with_retry(client.models.generate_content, model=MODEL, contents=prompt)
+
+
 def call_gemini_api(prompt, api_key):
     """
     Call Gemini API to get analysis.
@@ -77,15 +134,144 @@ def call_gemini_api(prompt, api_key):
         from google import genai
         
         print("✓ Calling Gemini API...")
-        client = genai.Client(api_key=api_key)
+        # Shared client with retry: chunked analysis calls this from several threads
+        client = gemini.get_client() or genai.Client(api_key=api_key)
+        
+        start = time.perf_counter()
+        response = send_prompt(client, prompt)
+        text = response.text or ''
+        entry = gemini.usage.record('analysis', len(prompt), len(text), time.perf_counter() - start,
+                                    getattr(response, 'usage_metadata', None))
+        
+        print(f"✓ Received response from Gemini ({gemini.describe_call(entry)})")
+        return text
+        
+    except ImportError:
+        print("✗ Error: google-genai package not installed")
+        print("  Install with: pip install google-genai")
+        return None
+    except Exception as e:
+        print(f"✗ Error calling Gemini API: {e}")
+        return None
+
+
+class SectionStream:
+    """
+    Incremental parser for a streamed analysis response.
+    
+    feed() takes the next piece of response text and returns the top-level
+    sections it completed, each parsed on its own. A section is complete
+    once the next `sections:` item (or anything less indented) starts;
+    close() flushes the last one. Text outside the `sections:` list,
+    including ```yaml fences, is ignored; a fence ends the list only at
+    the `sections:` key's indent (column 0). Items that don't parse are
+    skipped - the final parse of the whole response is authoritative.
+    """
+    
+    def __init__(self):
+        self.pending = ''
+        self.in_sections = False
+        self.item_indent = None
+        self.item_lines = []
+    
+    def feed(self, text):
+        self.pending += text
+        *lines, self.pending = self.pending.split('\n')
+        done = []
+        for line in lines:
+            self._line(line, done)
+        return done
+    
+    def close(self):
+        done = []
+        if self.pending:
+            self._line(self.pending, done)
+            self.pending = ''
+        self._finish(done)
+        return done
+    
+    def _line(self, line, done):
+        stripped = line.strip()
+        if not self.in_sections:
+            if re.match(r'^sections:\s*$', line):
+                self.in_sections = True
+            return
+        indent = len(line) - len(line.lstrip())
+        # Only an unindented fence closes the block: an indented one is
+        # part of a section's text (e.g. a code block in `content: |`)
+        if stripped.startswith('```') and indent == 0:
+            self._finish(done)
+            self.in_sections = False
+            return
+        if not stripped or stripped.startswith('#'):
+            if self.item_lines:
+                self.item_lines.append(line)
+            return
+        
+        is_item = stripped == '-' or stripped.startswith('- ')
+        if self.item_indent is None:
+            if is_item:
+                self.item_indent = indent
+                self.item_lines = [line]
+            return
+        if indent == self.item_indent and is_item:
+            self._finish(done)
+            self.item_lines = [line]
+        elif indent <= self.item_indent:
+            # A key outside the sections list: the list is over
+            self._finish(done)
+            self.in_sections = False
+        else:
+            self.item_lines.append(line)
+    
+    def _finish(self, done):
+        if not self.item_lines:
+            return
+        # Trailing newline, so a block scalar ending the item keeps its own
+        text = textwrap.dedent('\n'.join(self.item_lines) + '\n')
+        self.item_lines = []
+        try:
+            items = yaml.safe_load(text)
+        except yaml.YAMLError:
+            return
+        if isinstance(items, list) and items and isinstance(items[0], dict):
+            done.append(items[0])
+
+
+def stream_gemini_api(prompt, on_section, client=None):
+    """
+    Stream the Gemini response, calling on_section(section) for each
+    top-level section as soon as it is complete.
+    
+    `client` defaults to the shared Gemini client; anything with a
+    models.generate_content_stream() works (see gemini.ReplayClient).
+    Returns the full response text or None on error.
+    """
+    try:
+        if client is None:
+            client = gemini.get_client()
         
-        response = client.models.generate_content(
-            model="gemini-3-pro-preview",            
-            contents=prompt,
-        )
+        print("✓ Streaming from Gemini API...")
+        start = time.perf_counter()
+        stream = send_prompt(client, prompt, stream=True)
+        parser = SectionStream()
+        parts = []
+        metadata = None
+        for chunk in stream:
+            text = chunk.text or ''
+            parts.append(text)
+            # Token counts arrive with the final chunk
+            metadata = getattr(chunk, 'usage_metadata', None) or metadata
+            for section in parser.feed(text):
+                on_section(section)
+        for section in parser.close():
+            on_section(section)
         
-        print("✓ Received response from Gemini")
-        return response.text
+        response = ''.join(parts)
+        entry = gemini.usage.record('analysis', len(prompt), len(response),
+                                    time.perf_counter() - start, metadata)
+        print(f"✓ Received response from Gemini ({gemini.describe_call(entry)})")
+        return response
         
     except ImportError:
         print("✗ Error: google-genai package not installed")
@@ -128,36 +314,33 @@ def manual_input_mode(prompt):
         return None
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python analyze.py travel.md")
-        print("\nOptional: Set GEMINI_API_KEY environment variable for automatic mode")
-        sys.exit(1)
-    
-    md_file = Path(sys.argv[1])
-    if not md_file.exists():
-        print(f"Error: {md_file} not found")
-        sys.exit(1)
-    
-    md_content = md_file.read_text()
-    
-    # Show detected sections
-    sections = extract_sections(md_content)
-    print(f"\n✓ Detected {len(sections)} sections:")
-    for s in sections:
-        indent = "  " * (s['level'] - 2)
-        print(f"  {indent}{'#' * s['level']} {s['title']}")
-    
-    # Generate prompt
-    prompt = generate_prompt(md_content)
+def get_model_response(prompt, on_section=None, manual_fallback=True):
+    """
+    Get the analysis response from Gemini, or from the user in manual mode.
     
-    # Check for API key
+    With on_section, the Gemini response is streamed and on_section is
+    called with each top-level section as it completes. A stream that fails
+    after handing over sections returns None rather than asking for a
+    manual response, as does any failed call with manual_fallback=False
+    (unattended runs, or callers off the main thread).
+    """
     api_key = os.environ.get('GEMINI_API_KEY')
     
     if api_key:
         print("\n✓ GEMINI_API_KEY found - using automatic mode")
-        response = call_gemini_api(prompt, api_key)
-        if response is None:
+        emitted = []
+        if on_section:
+            def emit(section):
+                emitted.append(section)
+                on_section(section)
+            response = stream_gemini_api(prompt, emit)
+        else:
+            response = call_gemini_api(prompt, api_key)
+        if response is None and emitted:
+            print(f"\n✗ Stream failed after {len(emitted)} sections - not falling back to manual mode")
+        elif response is None and not manual_fallback:
+            print("\n✗ No response from Gemini - not falling back to manual mode")
+        elif response is None:
             print("\n⚠ Falling back to manual mode...")
             response = manual_input_mode(prompt)
     else:
@@ -165,50 +348,565 @@ def main():
         print("  (Set GEMINI_API_KEY to enable automatic analysis)")
         response = manual_input_mode(prompt)
     
+    return response
+
+
+def parse_analysis(response):
+    """
+    Parse the model's YAML analysis (bare or in a ```yaml block).
+    
+    Raises ValueError if it has no 'sections' key.
+    """
+    # Extract YAML block if wrapped in ```yaml
+    if '```yaml' in response:
+        yaml_match = re.search(r'```yaml\n(.*?)\n```', response, re.DOTALL)
+        if yaml_match:
+            response = yaml_match.group(1)
+    
+    analysis = yaml.safe_load(response)
+    
+    # Validate structure
+    if not isinstance(analysis, dict) or 'sections' not in analysis:
+        raise ValueError("Response missing 'sections' key")
+    return analysis
+
+
+def chunk_hash(text):
+    return hashlib.sha1(text.strip().encode()).hexdigest()[:16]
+
+
+def split_chunks(md_content):
+    """
+    Split markdown into re-analysis units: the preamble before the first ##
+    header, then one chunk per ## section including its ### subsections
+    (the model nests those under their ## section, so they re-analyze together).
+    
+    Returns a list of dicts with title, text and hash.
+    """
+    lines = md_content.split('\n')
+    starts = [s['line'] for s in extract_sections(md_content) if s['level'] == 2]
+    bounds = [0] + starts + [len(lines)]
+    chunks = []
+    for start, end in zip(bounds, bounds[1:]):
+        text = '\n'.join(lines[start:end])
+        if not text.strip():
+            continue
+        chunks.append({
+            'title': lines[start].lstrip('#').strip(),
+            'text': text,
+            'hash': chunk_hash(text),
+        })
+    return chunks
+
+
+def chunk_headers(chunk):
+    return [slugify(h) for h in re.findall(r'^#{1,6}\s+(.+)$', chunk['text'], re.M)]
+
+
+def assign_sections(sections, chunks):
+    """
+    Map each top-level section to the chunk it was made from.
+    
+    Sections and chunks are both in document order, so each section is
+    matched against the headers of the current chunk onwards (exact slug
+    first, then containment); sections with no match stay with the current
+    chunk. Returns one chunk index per section.
+    """
+    headers = [chunk_headers(c) for c in chunks]
+    assigned = []
+    pos = 0
+    for section in sections:
+        slug = slugify(section.get('title', ''))
+        if slug:
+            match = next((i for i in range(pos, len(chunks)) if slug in headers[i]), None)
+            if match is None:
+                match = next((i for i in range(pos, len(chunks))
+                              if any(h and (slug in h or h in slug) for h in headers[i])), None)
+            if match is not None:
+                pos = match
+        assigned.append(pos)
+    return assigned
+
+
+def group_chunks(sections, chunks):
+    """
+    Group chunks with the sections made from them.
+    
+    A chunk that produced no section of its own (the model merged it into a
+    neighbour) joins the previous group, so the two are always re-analyzed
+    together. Returns a list of (chunk list, section list) pairs.
+    """
+    assigned = assign_sections(sections, chunks)
+    groups = []
+    for i, chunk in enumerate(chunks):
+        owned = [s for s, c in zip(sections, assigned) if c == i]
+        if owned or not groups:
+            groups.append(([chunk], owned))
+        else:
+            groups[-1][0].append(chunk)
+    # A leading chunk without sections belongs with the next group
+    if len(groups) > 1 and not groups[0][1]:
+        groups[1] = (groups[0][0] + groups[1][0], groups[1][1])
+        groups.pop(0)
+    return groups
+
+
+def group_records(groups):
+    """metadata.source_chunks entries for a list of groups."""
+    return [
+        {'chunks': [c['hash'] for c in chunks], 'sections': [s.get('id') for s in sections]}
+        for chunks, sections in groups
+    ]
+
+
+def plan_reanalysis(records, chunks):
+    """
+    Compare the recorded chunk groups with the current chunks.
+    
+    Returns a list of steps in document order: ('keep', record index) for
+    groups whose chunks are all unchanged, or ('analyze', [chunks]) for runs
+    of new or changed chunks. A group with any changed chunk is re-analyzed
+    whole.
+    """
+    old_hashes = []
+    owner = []
+    for g, record in enumerate(records):
+        old_hashes.extend(record['chunks'])
+        owner.extend([g] * len(record['chunks']))
+    
+    matcher = SequenceMatcher(None, old_hashes, [c['hash'] for c in chunks], autojunk=False)
+    new_to_old = {}
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for k in range(i2 - i1):
+                new_to_old[j1 + k] = i1 + k
+    
+    # Old chunk index of each group's first chunk
+    first_chunk = {}
+    for i, g in enumerate(owner):
+        first_chunk.setdefault(g, i)
+    
+    steps = []
+    j = 0
+    while j < len(chunks):
+        o = new_to_old.get(j)
+        if o is not None and first_chunk[owner[o]] == o:
+            size = len(records[owner[o]]['chunks'])
+            if all(new_to_old.get(j + k) == o + k for k in range(size)):
+                steps.append(('keep', owner[o]))
+                j += size
+                continue
+        if steps and steps[-1][0] == 'analyze':
+            steps[-1][1].append(chunks[j])
+        else:
+            steps.append(('analyze', [chunks[j]]))
+        j += 1
+    return steps
+
+
+def carry_over(section, old):
+    """
+    Keep a re-analyzed section's identity: reuse the old id, and the old
+    selected_images when its queries are unchanged. Applied to subsections
+    by title and to itinerary items by queries.
+    """
+    if old.get('id'):
+        section['id'] = old['id']
+    if old.get('selected_images') and section.get('queries') == old.get('queries'):
+        section['selected_images'] = old['selected_images']
+    
+    old_subsections = {slugify(s.get('title', '')): s for s in old.get('subsections', [])}
+    for sub in section.get('subsections', []):
+        match = old_subsections.pop(slugify(sub.get('title', '')), None)
+        if match:
+            carry_over(sub, match)
+    
+    old_items = [i for i in old.get('itinerary', []) if i.get('selected_images')]
+    for item in section.get('itinerary', []):
+        match = next((i for i in old_items if i.get('queries') == item.get('queries')), None)
+        if match and item.get('queries'):
+            item['selected_images'] = match['selected_images']
+            old_items.remove(match)
+
+
+def carry_over_sections(sections, old_sections):
+    """Apply carry_over() to new sections whose titles match old ones (removed from old_sections)."""
+    old_by_title = {}
+    for old in old_sections:
+        old_by_title.setdefault(slugify(old.get('title', '')), old)
+    for section in sections:
+        old = old_by_title.pop(slugify(section.get('title', '')), None)
+        if old:
+            carry_over(section, old)
+            # Each old section is carried over at most once
+            old_sections.remove(old)
+
+
+def make_ids_unique(sections, taken):
+    """Suffix ids already in `taken` (-2, -3, ...), recursing into subsections."""
+    for section in sections:
+        base = section.get('id')
+        if base:
+            new_id = base
+            n = 2
+            while new_id in taken:
+                new_id = f"{base}-{n}"
+                n += 1
+            section['id'] = new_id
+            taken.add(new_id)
+        make_ids_unique(section.get('subsections', []), taken)
+
+
+def collect_ids(sections, ids=None):
+    if ids is None:
+        ids = set()
+    for section in sections:
+        if section.get('id'):
+            ids.add(section['id'])
+        collect_ids(section.get('subsections', []), ids)
+    return ids
+
+
+def print_detected_sections(md_content):
+    sections = extract_sections(md_content)
+    print(f"\n✓ Detected {len(sections)} sections:")
+    for s in sections:
+        indent = "  " * (s['level'] - 2)
+        print(f"  {indent}{'#' * s['level']} {s['title']}")
+
+
+def document_outline(md_content):
+    """The document's header lines, as context for excerpt prompts."""
+    return '\n'.join(re.findall(r'^#{1,3}\s+.+$', md_content, re.M))
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token)."""
+    return len(text) // 4
+
+
+def pack_chunks(chunks, budget=CHUNK_TOKEN_BUDGET):
+    """Pack consecutive chunks into batches of at most `budget` tokens (a larger chunk goes alone)."""
+    batches = []
+    size = 0
+    for chunk in chunks:
+        tokens = estimate_tokens(chunk['text'])
+        if batches and size + tokens <= budget:
+            batches[-1].append(chunk)
+            size += tokens
+        else:
+            batches.append([chunk])
+            size = tokens
+    return batches
+
+
+def request_analysis(prompt, on_section=None):
+    """Get a response from Gemini (streamed with on_section), without the manual fallback. None on error."""
+    if on_section:
+        return stream_gemini_api(prompt, on_section)
+    return call_gemini_api(prompt, os.environ.get('GEMINI_API_KEY'))
+
+
+def analyze_excerpts(runs, outline, on_section=None):
+    """
+    Analyze excerpts (lists of chunks) of one document.
+    
+    Requests run concurrently in automatic mode and go to Gemini only: a
+    failed request leaves its response missing instead of prompting, so
+    workers never share stdin. Manual mode asks for each response in turn.
+    Returns one parsed analysis per run, or None if a response was missing.
+    """
+    prompts = [get_excerpt_prompt('\n'.join(c['text'] for c in run), outline) for run in runs]
+    if os.environ.get('GEMINI_API_KEY'):
+        with ThreadPoolExecutor(max_workers=max(min(MAX_CHUNK_WORKERS, len(prompts)), 1)) as pool:
+            responses = list(pool.map(lambda prompt: request_analysis(prompt, on_section), prompts))
+    else:
+        responses = [get_model_response(prompt) for prompt in prompts]
+    if any(r is None for r in responses):
+        return None
+    return [parse_analysis(r) for r in responses]
+
+
+def analyze_after_failed_excerpts(md_content, previous=None, on_section=None, manual_fallback=True):
+    """
+    Fall back to analyzing the whole document in one request (which may ask
+    for a manual response, unless manual_fallback is False) after an
+    excerpt request failed. Returns None in manual mode, where a missing
+    response means the user gave up.
+    """
+    if not os.environ.get('GEMINI_API_KEY'):
+        return None
+    print("\n⚠ An excerpt request failed - analyzing the whole document in one request")
+    return analyze_full(md_content, previous, chunked=False, on_section=on_section,
+                        manual_fallback=manual_fallback)
+
+
+def restrict_style(sections, style, allowed):
+    """Turn `style` sections into content sections where that style isn't allowed."""
+    if allowed:
+        return
+    for section in sections:
+        if section.get('style') == style:
+            section['style'] = 'content'
+
+
+def analyze_chunked(md_content, previous=None, on_section=None, manual_fallback=True):
+    """
+    Analyze a long document as concurrent chunks and stitch the results.
+    
+    Only the first chunk may produce the hero and only the last the footer;
+    ids are made unique across chunks.
+    """
+    batches = pack_chunks(split_chunks(md_content))
+    print(f"\n✓ Analyzing in {len(batches)} chunks of up to ~{CHUNK_TOKEN_BUDGET} tokens")
+    results = analyze_excerpts(batches, document_outline(md_content), on_section)
+    if results is None:
+        return analyze_after_failed_excerpts(md_content, previous, on_section, manual_fallback)
+    
+    old_sections = list(previous.get('sections', [])) if previous else []
+    metadata = {}
+    sections = []
+    records = []
+    taken = set()
+    for i, (run, result) in enumerate(zip(batches, results)):
+        for key, value in (result.get('metadata') or {}).items():
+            metadata.setdefault(key, value)
+        run_sections = result['sections']
+        restrict_style(run_sections, 'hero', i == 0)
+        restrict_style(run_sections, 'footer', i == len(batches) - 1)
+        carry_over_sections(run_sections, old_sections)
+        make_ids_unique(run_sections, taken)
+        records.extend(group_records(group_chunks(run_sections, run)))
+        sections.extend(run_sections)
+    
+    metadata['source_chunks'] = records
+    return {'metadata': metadata, 'sections': sections}
+
+
+def use_chunks(md_content, chunked):
+    """Whether to analyze in chunks: forced on/off, or by size in automatic mode."""
+    if chunked is not None:
+        return chunked
+    return bool(os.environ.get('GEMINI_API_KEY')) and estimate_tokens(md_content) > CHUNK_TOKEN_BUDGET
+
+
+def analyze_full(md_content, previous=None, chunked=None, on_section=None, manual_fallback=True):
+    """Analyze the whole document. Sections matching `previous` keep their ids/selections."""
+    if use_chunks(md_content, chunked) and len(pack_chunks(split_chunks(md_content))) > 1:
+        return analyze_chunked(md_content, previous, on_section, manual_fallback)
+    
+    prompt = generate_prompt(md_content)
+    response = get_model_response(prompt, on_section, manual_fallback)
     if response is None:
-        print("\n✗ No response received")
-        sys.exit(1)
+        return None
+    analysis = parse_analysis(response)
+    if previous:
+        carry_over_sections(analysis['sections'], list(previous.get('sections', [])))
+        make_ids_unique(analysis['sections'], set())
     
-    # Parse YAML from response
-    try:
-        # Extract YAML block if wrapped in ```yaml
-        if '```yaml' in response:
-            yaml_match = re.search(r'```yaml\n(.*?)\n```', response, re.DOTALL)
-            if yaml_match:
-                response = yaml_match.group(1)
+    groups = group_chunks(analysis['sections'], split_chunks(md_content))
+    analysis.setdefault('metadata', {})['source_chunks'] = group_records(groups)
+    return analysis
+
+
+def analyze_incremental(md_content, previous, chunked=None, on_section=None, manual_fallback=True):
+    """
+    Re-analyze only the changed ## sections of a document and merge them
+    into the previous analysis.
+    
+    Returns the merged analysis, or None if a response was missing. Falls
+    back to a full analysis when the previous analysis has no chunk hashes
+    or most of the document changed.
+    """
+    metadata = previous.get('metadata') or {}
+    records = metadata.get('source_chunks')
+    old_by_id = {s.get('id'): s for s in previous.get('sections', [])}
+    chunks = split_chunks(md_content)
+    
+    if not records or any(i not in old_by_id for r in records for i in r['sections']):
+        print("\n⚠ No section hashes in the existing analysis - analyzing the whole document")
+        return analyze_full(md_content, previous, chunked, on_section, manual_fallback)
+    
+    steps = plan_reanalysis(records, chunks)
+    changed = [c for step in steps if step[0] == 'analyze' for c in step[1]]
+    if not changed and len(steps) == len(records):
+        print("\n✓ No sections changed")
+        return previous
+    if len(changed) > MAX_INCREMENTAL_FRACTION * len(chunks):
+        print(f"\n⚠ {len(changed)} of {len(chunks)} sections changed - analyzing the whole document")
+        return analyze_full(md_content, previous, chunked, on_section, manual_fallback)
+    
+    print(f"\n✓ Re-analyzing {len(changed)} of {len(chunks)} sections:")
+    for chunk in changed:
+        print(f"  ## {chunk['title']}")
+    
+    kept_groups = {step[1] for step in steps if step[0] == 'keep'}
+    # Sections of changed or removed groups: candidates for carry_over()
+    replaced = [
+        old_by_id[i] for g, r in enumerate(records) if g not in kept_groups for i in r['sections']
+    ]
+    taken = collect_ids(old_by_id[i] for g in kept_groups for i in records[g]['sections'])
+    
+    runs = [step[1] for step in steps if step[0] == 'analyze']
+    results = analyze_excerpts(runs, document_outline(md_content), on_section)
+    if results is None:
+        return analyze_after_failed_excerpts(md_content, previous, on_section, manual_fallback)
+    results = iter(results)
+    
+    sections = []
+    new_records = []
+    for step in steps:
+        if step[0] == 'keep':
+            record = records[step[1]]
+            sections.extend(old_by_id[i] for i in record['sections'])
+            new_records.append(record)
+            continue
         
-        analysis = yaml.safe_load(response)
+        run = step[1]
+        result = next(results)
+        run_sections = result['sections']
+        carry_over_sections(run_sections, replaced)
+        make_ids_unique(run_sections, taken)
+        if result.get('metadata') and run[0] is chunks[0]:
+            metadata = {**metadata, **result['metadata']}
         
-        # Validate structure
-        if 'sections' not in analysis:
-            print("\n✗ Error: Response missing 'sections' key")
+        groups = group_chunks(run_sections, run)
+        sections.extend(run_sections)
+        new_records.extend(group_records(groups))
+    
+    metadata = dict(metadata, source_chunks=new_records)
+    return {**previous, 'metadata': metadata, 'sections': sections}
+
+
+def analyze_markdown(md_content, previous=None, chunked=None, on_section=None, manual_fallback=True):
+    """
+    Run the analysis step on markdown text.
+    
+    With `previous` (the existing analysis of an earlier version of the
+    document), only changed sections are re-analyzed. `chunked` forces
+    chunked analysis on or off (default: by document size). on_section is
+    called with each section as soon as its part of the response has
+    streamed in (automatic mode only). With manual_fallback=False, a failed
+    Gemini call never falls back to reading a response from stdin.
+    
+    Returns the parsed analysis dict, or None if no response was received.
+    Raises ValueError if the response can't be parsed.
+    """
+    print_detected_sections(md_content)
+    first_call = len(gemini.usage.calls)
+    if previous:
+        analysis = analyze_incremental(md_content, previous, chunked, on_section, manual_fallback)
+    else:
+        analysis = analyze_full(md_content, chunked=chunked, on_section=on_section,
+                                manual_fallback=manual_fallback)
+    if len(gemini.usage.calls) > first_call:
+        print(f"\n✓ Gemini usage: {gemini.usage.summary(first_call)}")
+    return analysis
+
+
+def replay_analysis(md_content, response, chunk_size=200):
+    """
+    Stream a recorded response through stream_gemini_api with a
+    gemini.ReplayClient and compare the sections handed over on the way
+    with the final parse of the whole response.
+    
+    Returns (streamed sections, parsed analysis).
+    """
+    # Only the document part of the prompt: the replay ignores it, and the
+    # cached system instruction would need the real API
+    _, request = split_prompt(generate_prompt(md_content))
+    streamed = []
+    def emit(section):
+        streamed.append(section)
+        print(f"  streamed: {section.get('title', section.get('id', '?'))} ({section.get('style', 'content')})")
+    text = stream_gemini_api(request, emit, client=gemini.ReplayClient(response, chunk_size=chunk_size))
+    if text is None:
+        return streamed, None
+    return streamed, parse_analysis(text)
+
+
+def save_analysis(analysis, output_file):
+    """Write the analysis YAML."""
+    with open(output_file, 'w') as f:
+        yaml.dump(analysis, f, default_flow_style=False, sort_keys=False)
+
+
+def print_summary(analysis):
+    """Print section, style and query counts for an analysis."""
+    print(f"  Found {len(analysis.get('sections', []))} sections with styles")
+    
+    styles_count = {}
+    queries_count = 0
+    for section in analysis['sections']:
+        style = section.get('style', 'unknown')
+        styles_count[style] = styles_count.get(style, 0) + 1
+        queries_count += len(section.get('queries', []))
+    
+    print(f"  Styles used: {dict(styles_count)}")
+    print(f"  Total queries: {queries_count}")
+
+
+def main():
+    full = '--full' in sys.argv
+    chunked = True if '--chunked' in sys.argv else False if '--no-chunk' in sys.argv else None
+    replay = None
+    args = []
+    argv = iter(sys.argv[1:])
+    for a in argv:
+        if a == '--replay':
+            replay = next(argv, None)
+        elif not a.startswith('--'):
+            args.append(a)
+    
+    if len(args) < 1:
+        print("Usage: python analyze.py travel.md [--full] [--chunked|--no-chunk] [--replay response.yaml]")
+        print("\nOptional: Set GEMINI_API_KEY environment variable for automatic mode")
+        print("An existing travel.analysis.yaml is updated incrementally unless --full is given")
+        sys.exit(1)
+    
+    md_file = Path(args[0])
+    if not md_file.exists():
+        print(f"Error: {md_file} not found")
+        sys.exit(1)
+    
+    md_content = md_file.read_text()
+    output_file = md_file.parent / f"{md_file.stem}.analysis.yaml"
+    
+    if replay:
+        try:
+            streamed, analysis = replay_analysis(md_content, Path(replay).read_text())
+        except Exception as e:
+            print(f"\n✗ Error parsing response: {e}")
             sys.exit(1)
-        
-        # Save to file
-        output_file = md_file.parent / f"{md_file.stem}.analysis.yaml"
-        with open(output_file, 'w') as f:
-            yaml.dump(analysis, f, default_flow_style=False, sort_keys=False)
-        
-        print(f"\n✓ Saved analysis to: {output_file}")
-        print(f"  Found {len(analysis.get('sections', []))} sections with styles")
-        
-        # Show summary
-        styles_count = {}
-        queries_count = 0
-        for section in analysis['sections']:
-            style = section.get('style', 'unknown')
-            styles_count[style] = styles_count.get(style, 0) + 1
-            queries_count += len(section.get('queries', []))
-        
-        print(f"  Styles used: {dict(styles_count)}")
-        print(f"  Total queries: {queries_count}")
-        
+        if analysis is None:
+            sys.exit(1)
+        parsed = analysis['sections']
+        print(f"\n{'✓' if streamed == parsed else '✗'} Streamed {len(streamed)} of {len(parsed)} sections"
+              f"{'' if streamed == parsed else ' - differs from the full parse'}")
+        sys.exit(0 if streamed == parsed else 1)
+    
+    previous = None
+    if output_file.exists() and not full:
+        with open(output_file, 'r') as f:
+            previous = yaml.safe_load(f)
+    
+    try:
+        analysis = analyze_markdown(md_content, previous=previous, chunked=chunked)
     except Exception as e:
         print(f"\n✗ Error parsing response: {e}")
         print("Please check the YAML format")
         sys.exit(1)
+    
+    if analysis is None:
+        print("\n✗ No response received")
+        sys.exit(1)
+    
+    # Save to file
+    save_analysis(analysis, output_file)
+    
+    print(f"\n✓ Saved analysis to: {output_file}")
+    print_summary(analysis)
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,598 @@
+#!/usr/bin/env python3
+"""
+Shared query cache used by the scraper, selector and generator.
+
+Usage:
+    python travel_md_converter/cache.py import [query_cache.yaml]
+    python travel_md_converter/cache.py export [query_cache.yaml]
+    python travel_md_converter/cache.py stats
+    python travel_md_converter/cache.py gc [--ttl-days N] [--max-size 2G] [--dry-run]
+
+Entries live in a SQLite database (query_cache.db), one row per query, so
+reading or writing a single query doesn't touch the rest of the cache.
+WAL mode plus a busy timeout lets several processes and threads write at
+once. The first time the database is opened, an existing query_cache.yaml
+is imported automatically; export writes the same YAML format back out.
+
+The same database holds the image selection cache (SelectionCache), which
+maps a content hash of a selection request to the URLs Gemini picked.
+
+Maintenance: entries older than CACHE_TTL_DAYS (by scraped_at) are
+re-scraped the next time a document uses them. Each run records when every
+query was last used and how many lookups hit, and `gc` drops entries that
+are expired and unused, deletes thumbnails in images/ that no entry
+references (plus leftover .part downloads), evicts least recently used
+queries until the thumbnails fit --max-size, and compacts the database.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import yaml
+
+from thumbnails import read_thumbnail
+
+CACHE_DB = 'query_cache.db'
+CACHE_YAML = 'query_cache.yaml'
+IMAGES_DIR = Path('images')
+
+# Entries older than this are re-scraped when next used (0 = never expire)
+CACHE_TTL_DAYS = float(os.environ.get('QUERY_CACHE_TTL_DAYS', 90))
+
+# Partial downloads older than this are abandoned and swept
+PART_MAX_AGE = 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT PRIMARY KEY,
+    entry TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS selections (
+    key TEXT PRIMARY KEY,
+    urls TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS usage (
+    query TEXT PRIMARY KEY,
+    last_used TEXT NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def is_expired(entry, ttl_days=CACHE_TTL_DAYS, now=None):
+    """True if an entry's scraped_at is older than ttl_days. Undated entries never expire."""
+    if not ttl_days or not entry or not entry.get('scraped_at'):
+        return False
+    try:
+        scraped_at = datetime.fromisoformat(str(entry['scraped_at']))
+    except ValueError:
+        return False
+    return (now or datetime.now()) - scraped_at > timedelta(days=ttl_days)
+
+
+class SQLiteStore:
+    """
+    Base for stores in the cache database: one connection per thread.
+
+    close() closes every thread's connection; it's also a context manager.
+    """
+
+    def __init__(self, path=CACHE_DB):
+        self.path = str(path)
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        """One connection per thread (sqlite3 connections can't be shared)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Only used by its own thread; close() may run on another
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self):
+        """Close every connection. Call once the store's threads are done with it."""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        # Threads that used the store get a fresh connection if they come back
+        self._local = threading.local()
+        for conn in conns:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class QueryCache(SQLiteStore):
+    """
+    Dict-like query cache backed by SQLite.
+
+    Supports `query in cache`, `cache[query]`, `cache.get(query)`,
+    `cache[query] = entry`, `len(cache)` and iteration, so code written
+    against the old YAML dict keeps working. Writes commit immediately.
+
+    The first lookup of each query in a run counts as a hit or a miss; the
+    counts and the queries used are written back by close() (record_usage).
+    """
+
+    def __init__(self, path=CACHE_DB, yaml_path=CACHE_YAML):
+        super().__init__(path)
+        # Decoded entries, so repeated lookups in one run skip JSON parsing
+        self._memo = {}
+        self.hits = 0
+        self.misses = 0
+        self._looked_up = set()
+        self._usage_lock = threading.Lock()
+        if yaml_path and len(self) == 0 and Path(yaml_path).exists():
+            count = self.import_yaml(yaml_path)
+            print(f"✓ Imported {count} queries from {yaml_path} into {self.path}")
+
+    def get(self, query, default=None):
+        if query in self._memo:
+            if query not in self._looked_up:
+                self._count_lookup(query, True)
+            return self._memo[query]
+        row = self._conn().execute(
+            'SELECT entry FROM queries WHERE query = ?', (query,)
+        ).fetchone()
+        self._count_lookup(query, row is not None)
+        if row is None:
+            return default
+        entry = self._memo[query] = json.loads(row[0])
+        return entry
+
+    def _count_lookup(self, query, hit):
+        with self._usage_lock:
+            if query in self._looked_up:
+                return
+            self._looked_up.add(query)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def needs_scrape(self, query):
+        """True if a query has no cached images or its entry has expired."""
+        entry = self.get(query)
+        return entry is None or 'images' not in entry or is_expired(entry)
+
+    def record_usage(self):
+        """Write this run's hit/miss counts and the queries it used."""
+        with self._usage_lock:
+            used = sorted(self._looked_up)
+            hits, misses = self.hits, self.misses
+            self._looked_up.clear()
+            self.hits = self.misses = 0
+        if not used:
+            return
+        now = datetime.now().isoformat()
+        conn = self._conn()
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT INTO usage (query, last_used, uses) VALUES (?, ?, 1) '
+                    'ON CONFLICT(query) DO UPDATE SET last_used = excluded.last_used, uses = uses + 1',
+                    [(q, now) for q in used],
+                )
+                conn.executemany(
+                    'INSERT INTO counters (name, value) VALUES (?, ?) '
+                    'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                    [('hits', hits), ('misses', misses)],
+                )
+        except sqlite3.Error as e:
+            print(f"⚠ Could not record cache usage: {e}")
+
+    def close(self):
+        """Record this run's usage, then close the connections."""
+        self.record_usage()
+        super().close()
+
+    def last_used(self):
+        """{query: last used timestamp} for every query with recorded usage."""
+        return dict(self._conn().execute('SELECT query, last_used FROM usage'))
+
+    def counters(self):
+        """Recorded totals (hits, misses), including this run's."""
+        totals = dict(self._conn().execute('SELECT name, value FROM counters'))
+        return totals.get('hits', 0) + self.hits, totals.get('misses', 0) + self.misses
+
+    def __getitem__(self, query):
+        entry = self.get(query)
+        if entry is None:
+            raise KeyError(query)
+        return entry
+
+    def __contains__(self, query):
+        return self.get(query) is not None
+
+    def __setitem__(self, query, entry):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO queries (query, entry) VALUES (?, ?)',
+                (query, json.dumps(entry, default=str)),
+            )
+        self._memo[query] = entry
+
+    def __delitem__(self, query):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM queries WHERE query = ?', (query,))
+            conn.execute('DELETE FROM usage WHERE query = ?', (query,))
+        self._memo.pop(query, None)
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM queries').fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [row[0] for row in self._conn().execute('SELECT query FROM queries')]
+
+    def items(self):
+        rows = self._conn().execute('SELECT query, entry FROM queries').fetchall()
+        return [(query, json.loads(entry)) for query, entry in rows]
+
+    def values(self):
+        return [entry for _, entry in self.items()]
+
+    def update(self, entries):
+        """Write many entries in one transaction."""
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO queries (query, entry) VALUES (?, ?)',
+                [(q, json.dumps(e, default=str)) for q, e in entries.items()],
+            )
+        self._memo.update(entries)
+
+    def import_yaml(self, yaml_path=CACHE_YAML):
+        """Merge entries from a query_cache.yaml file. Returns the count imported."""
+        with open(yaml_path, 'r') as f:
+            entries = yaml.safe_load(f) or {}
+        self.update(entries)
+        return len(entries)
+
+    def export_yaml(self, yaml_path=CACHE_YAML):
+        """Write the whole cache out in the query_cache.yaml format."""
+        with open(yaml_path, 'w') as f:
+            yaml.dump(dict(self.items()), f, default_flow_style=False, sort_keys=False)
+        return len(self)
+
+
+class SelectionCache(SQLiteStore):
+    """
+    Content-addressed cache of image selections.
+
+    Keys come from selection_key(), so a selection is reused whenever the
+    section title, style, number of images and candidate thumbnails are
+    unchanged, regardless of which document or run asked for it.
+    """
+
+    def get(self, key):
+        row = self._conn().execute(
+            'SELECT urls FROM selections WHERE key = ?', (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, urls):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO selections (key, urls) VALUES (?, ?)',
+                (key, json.dumps(urls)),
+            )
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM selections').fetchone()[0]
+
+
+_digests = {}
+
+
+def file_digest(path):
+    """SHA-1 of a thumbnail's bytes, memoized per (path, size, mtime). None if unreadable."""
+    try:
+        st = Path(path).stat()
+    except OSError:
+        return None
+    memo_key = (str(path), st.st_size, st.st_mtime_ns)
+    digest = _digests.get(memo_key)
+    if digest is None:
+        # Read through the thumbnail LRU so the selection request reuses the bytes
+        data = read_thumbnail(path)
+        if data is None:
+            return None
+        digest = _digests[memo_key] = hashlib.sha1(data).hexdigest()
+    return digest
+
+
+def selection_key(title, style, num_select, images, version):
+    """
+    Hash a selection request: title, style, num_select, prompt version and the
+    ordered candidates (original URL + thumbnail content digest).
+
+    Returns None if any thumbnail can't be read.
+    """
+    candidates = []
+    for img in images:
+        digest = file_digest(img['thumbnail'])
+        if digest is None:
+            return None
+        candidates.append([img['url'], digest])
+    payload = json.dumps([title, style, num_select, version, candidates])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def load_cache(path=CACHE_DB):
+    """Open the shared query cache."""
+    return QueryCache(path)
+
+
+def thumbnail_key(path):
+    return str(Path(path).resolve())
+
+
+def referenced_thumbnails(entries):
+    """{resolved thumbnail path: [queries]} for (query, entry) pairs."""
+    refs = {}
+    for query, entry in entries:
+        for img in entry.get('images', []):
+            if img.get('thumbnail'):
+                refs.setdefault(thumbnail_key(img['thumbnail']), []).append(query)
+    return refs
+
+
+def scan_images(images_dir=IMAGES_DIR):
+    """
+    Files in the thumbnail directory.
+
+    Returns ({resolved path: size} of thumbnails, [(path, size)] of
+    abandoned .part downloads older than PART_MAX_AGE).
+    """
+    files = {}
+    parts = []
+    if not Path(images_dir).is_dir():
+        return files, parts
+    cutoff = time.time() - PART_MAX_AGE
+    for path in Path(images_dir).iterdir():
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        if not path.is_file():
+            continue
+        if path.name.endswith('.part'):
+            if st.st_mtime < cutoff:
+                parts.append((path, st.st_size))
+        else:
+            files[thumbnail_key(path)] = st.st_size
+    return files, parts
+
+
+def cache_stats(cache, images_dir=IMAGES_DIR):
+    """Summary of the query cache and thumbnail directory."""
+    entries = cache.items()
+    files, parts = scan_images(images_dir)
+    refs = referenced_thumbnails(entries)
+    hits, misses = cache.counters()
+    with SelectionCache(cache.path) as selections:
+        selection_count = len(selections)
+    return {
+        'entries': len(entries),
+        'expired': sum(1 for _, e in entries if is_expired(e)),
+        'selections': selection_count,
+        'db_bytes': sum(Path(cache.path + suffix).stat().st_size
+                        for suffix in ('', '-wal') if Path(cache.path + suffix).exists()),
+        'thumbnails': len(files),
+        'thumbnail_bytes': sum(files.values()),
+        'orphans': sum(1 for path in files if path not in refs),
+        'orphan_bytes': sum(size for path, size in files.items() if path not in refs),
+        'missing': sum(1 for path in refs if path not in files),
+        'parts': len(parts),
+        'hits': hits,
+        'misses': misses,
+    }
+
+
+def expire_entries(cache, ttl_days=CACHE_TTL_DAYS, dry_run=False):
+    """
+    Delete entries that are expired and haven't been used within ttl_days.
+
+    Expired entries that are still in use are kept; they are refreshed the
+    next time a document needs them. Returns the queries removed.
+    """
+    if not ttl_days:
+        return []
+    last_used = cache.last_used()
+    cutoff = (datetime.now() - timedelta(days=ttl_days)).isoformat()
+    dead = [q for q, entry in cache.items()
+            if is_expired(entry, ttl_days) and last_used.get(q, '') < cutoff]
+    if not dry_run:
+        for query in dead:
+            del cache[query]
+    return dead
+
+
+def sweep_orphans(cache, images_dir=IMAGES_DIR, dry_run=False):
+    """
+    Delete thumbnails no cache entry references, and abandoned .part files.
+
+    Returns (files removed, bytes freed).
+    """
+    files, parts = scan_images(images_dir)
+    refs = referenced_thumbnails(cache.items())
+    doomed = [(Path(path), size) for path, size in files.items() if path not in refs] + parts
+    if not dry_run:
+        for path, _ in doomed:
+            path.unlink(missing_ok=True)
+    return len(doomed), sum(size for _, size in doomed)
+
+
+def evict_to_size(cache, max_bytes, images_dir=IMAGES_DIR, dry_run=False):
+    """
+    Evict least recently used queries until the thumbnails fit in max_bytes.
+
+    Recency is the query's last recorded use, or its scrape time if it was
+    never used. A thumbnail is deleted once no remaining entry references
+    it. Returns (queries evicted, bytes freed).
+    """
+    files, _ = scan_images(images_dir)
+    total = sum(files.values())
+    if total <= max_bytes:
+        return [], 0
+
+    entries = cache.items()
+    refs = referenced_thumbnails(entries)
+    last_used = cache.last_used()
+    order = sorted(entries, key=lambda qe: last_used.get(qe[0]) or str(qe[1].get('scraped_at', '')))
+
+    evicted = []
+    freed = 0
+    for query, entry in order:
+        if total <= max_bytes:
+            break
+        evicted.append(query)
+        for img in entry.get('images', []):
+            key = thumbnail_key(img['thumbnail']) if img.get('thumbnail') else None
+            if key not in refs:
+                continue
+            refs[key].remove(query)
+            if not refs[key] and key in files:
+                total -= files[key]
+                freed += files[key]
+                if not dry_run:
+                    Path(key).unlink(missing_ok=True)
+        if not dry_run:
+            del cache[query]
+    return evicted, freed
+
+
+def vacuum(cache):
+    """Compact the database after deletions."""
+    conn = cache._conn()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.execute('VACUUM')
+
+
+def parse_size(text):
+    """'500M', '2G', '1024' -> bytes."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def print_stats(cache):
+    stats = cache_stats(cache)
+    lookups = stats['hits'] + stats['misses']
+    hit_rate = f"{stats['hits'] / lookups:.0%}" if lookups else "n/a"
+    print(f"Cache: {cache.path} ({format_size(stats['db_bytes'])})")
+    print(f"  • {stats['entries']} queries ({stats['expired']} older than {CACHE_TTL_DAYS:g} days)")
+    print(f"  • {stats['selections']} cached selections")
+    print(f"  • Hit rate: {hit_rate} ({stats['hits']} hits, {stats['misses']} misses)")
+    print(f"Thumbnails: {IMAGES_DIR}/")
+    print(f"  • {stats['thumbnails']} files, {format_size(stats['thumbnail_bytes'])}")
+    print(f"  • {stats['orphans']} orphaned ({format_size(stats['orphan_bytes'])}), "
+          f"{stats['missing']} referenced but missing, {stats['parts']} abandoned .part files")
+
+
+def run_gc(cache, ttl_days=CACHE_TTL_DAYS, max_bytes=None, dry_run=False):
+    verb = "Would remove" if dry_run else "Removed"
+
+    dead = expire_entries(cache, ttl_days, dry_run=dry_run)
+    print(f"✓ {verb} {len(dead)} expired, unused queries")
+
+    # After expiry so the dead entries' thumbnails go too (a dry run
+    # still sees those entries, so it undercounts)
+    count, freed = sweep_orphans(cache, dry_run=dry_run)
+    print(f"✓ {verb} {count} orphaned files ({format_size(freed)})")
+
+    if max_bytes is not None:
+        evicted, freed = evict_to_size(cache, max_bytes, dry_run=dry_run)
+        print(f"✓ {verb} {len(evicted)} least recently used queries ({format_size(freed)})")
+
+    if not dry_run:
+        vacuum(cache)
+        print(f"✓ Compacted {cache.path}")
+
+
+def main():
+    commands = ('import', 'export', 'stats', 'gc')
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print("Usage: python cache.py import|export [query_cache.yaml]")
+        print("       python cache.py stats")
+        print("       python cache.py gc [--ttl-days N] [--max-size SIZE] [--dry-run]")
+        print("\nOptions (gc):")
+        print(f"  --ttl-days N     Drop entries older than N days and unused as long (default: {CACHE_TTL_DAYS:g})")
+        print("  --max-size SIZE  Evict least recently used queries until thumbnails fit (e.g. 2G)")
+        print("  --dry-run        Report what would be removed")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    with QueryCache(yaml_path=None) as cache:
+        if command == 'stats':
+            print_stats(cache)
+            return
+
+        if command == 'gc':
+            ttl_days = CACHE_TTL_DAYS
+            max_bytes = None
+            dry_run = False
+            argv = iter(sys.argv[2:])
+            for a in argv:
+                if a == '--ttl-days':
+                    ttl_days = float(next(argv, CACHE_TTL_DAYS))
+                elif a == '--max-size':
+                    max_bytes = parse_size(next(argv, '0'))
+                elif a == '--dry-run':
+                    dry_run = True
+            run_gc(cache, ttl_days, max_bytes, dry_run)
+            return
+
+        yaml_path = sys.argv[2] if len(sys.argv) > 2 else CACHE_YAML
+
+        if command == 'import':
+            if not Path(yaml_path).exists():
+                print(f"Error: {yaml_path} not found")
+                sys.exit(1)
+            count = cache.import_yaml(yaml_path)
+            print(f"✓ Imported {count} queries into {cache.path}")
+        else:
+            count = cache.export_yaml(yaml_path)
+            print(f"✓ Exported {count} queries to {yaml_path}")
+
+
+if __name__ == '__main__':
+    main()
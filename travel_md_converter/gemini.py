@@ -0,0 +1,275 @@
+"""
+Shared Gemini API helpers.
+
+One genai.Client per process (created on first use and reused by every
+request), plus retry with exponential backoff for rate limits and
+transient server errors.
+
+Large static instructions are sent as a system instruction held in an
+explicit context cache (client.caches), created once and reused by later
+calls and later runs; where caching isn't available they are sent inline
+as a system instruction instead. Every call's prompt/response size, token
+usage and time are recorded in `usage`. ReplayClient replays a recorded
+response, for exercising the streaming analysis without the API.
+"""
+
+import hashlib
+import itertools
+import os
+import random
+import threading
+import time
+
+# Retry 429/5xx and connection errors: 1s, 2s, 4s (+ jitter)
+RETRIES = 3
+BACKOFF = 1.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Lifetime of a prompt-prefix cache; refreshed whenever a run reuses it
+PREFIX_CACHE_TTL = '3600s'
+
+_client = None
+_client_lock = threading.Lock()
+
+_prefix_caches = {}  # (model, digest) -> cache name, or None if unavailable
+_prefix_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Get the shared Gemini client.
+
+    Raises ImportError if google-genai isn't installed; returns None if
+    GEMINI_API_KEY isn't set.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from google import genai
+
+            api_key = os.environ.get('GEMINI_API_KEY')
+            if not api_key:
+                return None
+            _client = genai.Client(api_key=api_key)
+        return _client
+
+
+def is_retryable(error):
+    """True for rate limits, server errors and network failures."""
+    try:
+        from google.genai import errors
+    except ImportError:
+        return False
+
+    if isinstance(error, errors.APIError):
+        return error.code in RETRY_STATUSES
+    # Anything else from the transport (timeouts, dropped connections)
+    return isinstance(error, (ConnectionError, TimeoutError, OSError)) or \
+        type(error).__module__.startswith(('httpx', 'httpcore'))
+
+
+def is_prefix_cache_error(error):
+    """
+    True if a request failed because of its cached content: the cache is
+    missing or expired (404), not accessible (403), or rejected (400 that
+    mentions it). Rate limits, server and network errors are not.
+    """
+    try:
+        from google.genai import errors
+    except ImportError:
+        return False
+
+    if not isinstance(error, errors.APIError):
+        return False
+    if error.code in (403, 404):
+        return True
+    return error.code == 400 and 'cache' in str(error).lower()
+
+
+def call_with_retry(fn, *args, retries=None, **kwargs):
+    """Call fn, retrying retryable errors with exponential backoff."""
+    retries = RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = BACKOFF * (2 ** attempt) * (1 + random.random() * 0.25)
+            time.sleep(delay)
+
+
+def stream_with_retry(fn, *args, retries=None, **kwargs):
+    """
+    Start a stream with fn and read its first chunk, with retry/backoff.
+    
+    Streams are lazy: the request is only sent, and a 429/5xx only raised,
+    when the first chunk is read, so that is what gets retried. Returns an
+    iterator over every chunk; errors after the first chunk are raised by
+    the iterator, unretried.
+    """
+    def start():
+        stream = iter(fn(*args, **kwargs))
+        return stream, next(stream, None)
+    
+    stream, first = call_with_retry(start, retries=retries)
+    if first is None:
+        return stream
+    return itertools.chain([first], stream)
+
+
+def generate_content(client, **kwargs):
+    """client.models.generate_content with retry/backoff."""
+    return call_with_retry(client.models.generate_content, **kwargs)
+
+
+def _prefix_key(model, instructions):
+    return model, hashlib.sha256(instructions.encode()).hexdigest()[:16]
+
+
+def prefix_cache(client, model, instructions):
+    """
+    Name of a context cache holding `instructions` as the system instruction.
+    
+    Looked up by display name (derived from a hash of the instructions), so
+    runs share one cache while the instructions are unchanged; its TTL is
+    extended on reuse. Returns None where context caching isn't supported
+    (model, prompt below the minimum size, or a client without caches).
+    """
+    key = _prefix_key(model, instructions)
+    with _prefix_lock:
+        if key in _prefix_caches:
+            return _prefix_caches[key]
+        
+        name = None
+        display_name = f"prefix-{key[1]}"
+        try:
+            from google.genai import types
+            
+            for cached in client.caches.list():
+                if cached.display_name == display_name and (cached.model or '').endswith(model):
+                    name = cached.name
+                    client.caches.update(
+                        name=name, config=types.UpdateCachedContentConfig(ttl=PREFIX_CACHE_TTL)
+                    )
+                    break
+            if name is None:
+                cached = client.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        display_name=display_name,
+                        system_instruction=instructions,
+                        ttl=PREFIX_CACHE_TTL,
+                    ),
+                )
+                name = cached.name
+        except Exception:
+            name = None
+        _prefix_caches[key] = name
+        return name
+
+
+def generate_with_prefix(client, model, instructions, contents, stream=False):
+    """
+    Generate with `instructions` as a cached (or inline) system instruction.
+    
+    If the cached prefix can't be used (it expired or was rejected, see
+    is_prefix_cache_error), it is dropped and the call is retried with the
+    instructions inline; other errors, including a 429/5xx that ran out of
+    retries, are raised as they are. Returns the response,
+    or the chunk iterator when stream=True; a stream's first chunk has
+    already been read, so a cache error surfaces here rather than later.
+    """
+    from google.genai import types
+    
+    call = client.models.generate_content_stream if stream else client.models.generate_content
+    retry = stream_with_retry if stream else call_with_retry
+    name = prefix_cache(client, model, instructions)
+    if name:
+        try:
+            return retry(
+                call, model=model, contents=contents,
+                config=types.GenerateContentConfig(cached_content=name),
+            )
+        except Exception as e:
+            if not is_prefix_cache_error(e):
+                raise
+            with _prefix_lock:
+                _prefix_caches.pop(_prefix_key(model, instructions), None)
+    return retry(
+        call, model=model, contents=contents,
+        config=types.GenerateContentConfig(system_instruction=instructions),
+    )
+
+
+class Usage:
+    """Per-call prompt/response sizes, token counts and timings."""
+    
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+    
+    def record(self, label, prompt_chars, response_chars, seconds, metadata=None):
+        """Record one call; `metadata` is the response's usage_metadata, if any. Returns the entry."""
+        entry = {
+            'label': label,
+            'prompt_chars': prompt_chars,
+            'response_chars': response_chars,
+            'seconds': seconds,
+            'prompt_tokens': getattr(metadata, 'prompt_token_count', None) or 0,
+            'cached_tokens': getattr(metadata, 'cached_content_token_count', None) or 0,
+            'response_tokens': getattr(metadata, 'candidates_token_count', None) or 0,
+        }
+        with self._lock:
+            self.calls.append(entry)
+        return entry
+    
+    def summary(self, start=0):
+        """One-line totals for calls[start:]."""
+        calls = self.calls[start:]
+        total = lambda key: sum(c[key] for c in calls)
+        return (f"{len(calls)} call{'s' if len(calls) != 1 else ''}, "
+                f"{total('prompt_tokens'):,} prompt tokens ({total('cached_tokens'):,} cached), "
+                f"{total('response_tokens'):,} response tokens, "
+                f"{total('prompt_chars'):,}/{total('response_chars'):,} chars in/out, "
+                f"{max((c['seconds'] for c in calls), default=0):.1f}s longest")
+
+
+def describe_call(entry):
+    """Short description of one recorded call."""
+    cached = f", {entry['cached_tokens']:,} cached" if entry['cached_tokens'] else ""
+    return (f"prompt {entry['prompt_chars']:,} chars / {entry['prompt_tokens']:,} tokens{cached}; "
+            f"response {entry['response_chars']:,} chars / {entry['response_tokens']:,} tokens; "
+            f"{entry['seconds']:.1f}s")
+
+
+usage = Usage()
+
+
+class ReplayClient:
+    """
+    Stand-in client that replays a recorded response (for testing streaming).
+
+    models.generate_content_stream() yields the text in pieces of
+    `chunk_size` characters, sleeping `delay` seconds between them;
+    models.generate_content() returns it whole.
+    """
+
+    class _Chunk:
+        def __init__(self, text):
+            self.text = text
+
+    def __init__(self, text, chunk_size=200, delay=0.0):
+        self.text = text
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.models = self
+
+    def generate_content_stream(self, model=None, contents=None, config=None):
+        for start in range(0, len(self.text), self.chunk_size):
+            if self.delay:
+                time.sleep(self.delay)
+            yield self._Chunk(self.text[start:start + self.chunk_size])
+
+    def generate_content(self, model=None, contents=None, config=None):
+        return self._Chunk(self.text)
@@ -3,17 +3,39 @@
 Step C: Generate HTML from YAML analysis file.
 
 Usage:
-    python travel_md_converter/generator.py travel.analysis.yaml
-    
+    python travel_md_converter/generator.py travel.analysis.yaml [--workers N]
+
 The YAML file contains ALL content - no markdown file needed.
 Creates travel.html with styled sections and images from cache.
+
+Documents with many top-level sections are rendered on a process pool and
+reassembled in order; each worker opens the query cache once.
 """
 
+import io
+import math
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
 import yaml
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from utils import get_images_for_section
-from styles import get_css, render_section, safe_img_url
+from styles import get_css, render_section, safe_img_url, emits
+from utils import get_images_for_section, markdown_to_html
+from cache import load_cache, QueryCache
+from mdrender import inline_cache_stats
+
+# Bump when a rendering change alters the HTML, so pipeline.py regenerates
+# pages whose analysis, images and styles.css haven't changed
+RENDERER_VERSION = 2
+
+# Rough costs behind the automatic serial/parallel choice, measured with
+# `python benchmark.py sections`: rendering one top-level section, and
+# starting a render pool
+SECTION_RENDER_MS = 0.2
+POOL_STARTUP_MS = 50
 
 
 HTML_TEMPLATE = """<!DOCTYPE html>
@@ -36,15 +58,6 @@ HTML_TEMPLATE = """<!DOCTYPE html>
 """
 
 
-def load_cache():
-    """Load image URL cache."""
-    cache_path = Path('query_cache.yaml')
-    if cache_path.exists():
-        with open(cache_path, 'r') as f:
-            return yaml.safe_load(f) or {}
-    return {}
-
-
 def get_images_for_queries(queries, cache):
     """Get image URLs for a list of queries from cache, deduped.
     
@@ -91,7 +104,8 @@ def get_section_images(section, cache):
     return []
 
 
-def render_section_from_yaml(section, cache, depth=0):
+@emits
+def render_section_from_yaml(section, cache, depth=0, out=None):
     """
     Render a section from YAML data with proper hierarchy.
     
@@ -106,6 +120,8 @@ def render_section_from_yaml(section, cache, depth=0):
     - cards: list of card items
     - table: tabular data
     - meta: section metadata (duration, location, theme)
+    
+    Writes into `out` when given, otherwise returns the HTML (see styles.emits).
     """
     section_id = section.get('id', '')
     title = section.get('title', '')
@@ -132,126 +148,296 @@ def render_section_from_yaml(section, cache, depth=0):
     # If this section has subsections, wrap everything in a section-group for hierarchy
     has_subsections = len(subsections) > 0
     
-    html_parts = []
-    
+    # Parts are written straight into `out`, newline-separated
     if has_subsections and depth == 0:
         # Start a section group for proper hierarchy
-        html_parts.append(f'<div class="section-group" id="{section_id}">')
-        html_parts.append(f'<div class="section-header"><h2>{title}</h2></div>')
+        out.append(f'<div class="section-group" id="{section_id}">')
+        out.append(f'\n<div class="section-header"><h2>{title}</h2></div>')
         
         # Add main section content if any
         if full_content.strip() or images:
-            html_parts.append('<div class="section-content">')
+            out.append('\n<div class="section-content">')
             if images:
-                html_parts.append('<div class="content-images">')
+                out.append('\n<div class="content-images">')
                 for url in images[:3]:
-                    html_parts.append(f'<img src="{safe_img_url(url)}" alt="" onerror="this.style.display=\'none\'">')
-                html_parts.append('</div>')
-            from utils import markdown_to_html
-            html_parts.append(markdown_to_html(full_content))
-            html_parts.append('</div>')
+                    out.append(f'\n<img src="{safe_img_url(url)}" alt="" onerror="this.style.display=\'none\'">')
+                out.append('\n</div>')
+            out.append('\n')
+            out.append(markdown_to_html(full_content))
+            out.append('\n</div>')
         
         # Render subsections inside the group
-        html_parts.append('<div class="subsections">')
+        out.append('\n<div class="subsections">')
         for subsection in subsections:
-            sub_html = render_section_from_yaml(subsection, cache, depth + 1)
-            html_parts.append(sub_html)
-        html_parts.append('</div>')
+            out.append('\n')
+            render_section_from_yaml(subsection, cache, depth + 1, out=out)
+        out.append('\n</div>')
         
-        html_parts.append('</div>')  # Close section-group
+        out.append('\n</div>')  # Close section-group
     else:
         # Regular rendering (no subsections or nested subsection)
-        html = render_section(
+        render_section(
             style=style,
             title=title,
             content=full_content,
             images=images,
             section_data=section,
-            cache=cache
+            cache=cache,
+            out=out
         )
-        html_parts.append(html)
         
         # Render any subsections (for deeply nested cases)
         for subsection in subsections:
-            sub_html = render_section_from_yaml(subsection, cache, depth + 1)
-            html_parts.append(sub_html)
+            out.append('\n')
+            render_section_from_yaml(subsection, cache, depth + 1, out=out)
+
+
+_worker_cache = None
+
+
+def _init_render_worker(cache_source):
+    """
+    Open the query cache once per render worker (a plain dict is used as
+    is), and close it when the worker exits so its lookups are recorded:
+    pool workers don't run atexit handlers, but do run multiprocessing
+    finalizers.
+    """
+    global _worker_cache
+    if isinstance(cache_source, str):
+        _worker_cache = load_cache(cache_source)
+        multiprocessing.util.Finalize(None, _worker_cache.close, exitpriority=10)
+    else:
+        _worker_cache = cache_source
+
+
+def _render_worker_section(section):
+    return render_section_from_yaml(section, _worker_cache)
+
+
+def parallel_min_sections(cpus=None):
+    """
+    Fewest top-level sections for which a pool of `cpus` processes should
+    beat serial rendering: the time it saves, sections × SECTION_RENDER_MS
+    × (1 - 1/cpus), has to exceed POOL_STARTUP_MS. None with a single CPU.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    if cpus < 2:
+        return None
+    saved_per_section = SECTION_RENDER_MS * (1 - 1 / cpus)
+    return math.floor(POOL_STARTUP_MS / saved_per_section) + 1
+
+
+def can_fork():
+    """
+    True if the render pool can fork its workers.
     
-    return '\n'.join(html_parts)
+    Forking is only safe while this is the only thread: another thread (a
+    scraper or selector pool in the pipeline, say) could hold a lock that
+    the child inherits locked. The parent's SQLite connections don't
+    matter, since workers open their own from the cache path.
+    """
+    return threading.active_count() == 1 and 'fork' in multiprocessing.get_all_start_methods()
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python generator.py travel.analysis.yaml")
-        print("\nThe YAML file contains all content - no markdown file needed.")
-        sys.exit(1)
+def pool_context():
+    """Start method for worker pools: fork when can_fork() allows it, spawn otherwise."""
+    return multiprocessing.get_context('fork' if can_fork() else 'spawn')
+
+
+def pool_workers(workers=None):
+    """
+    Processes worth starting for `workers` (default: one per CPU): never
+    more than the CPU count, since extra processes only add startup time.
+    """
+    cpus = os.cpu_count() or 1
+    return min(workers or cpus, cpus)
+
+
+def use_render_pool(section_count, workers=None):
+    """
+    True if sections should be rendered on a process pool.
     
-    analysis_file = Path(sys.argv[1])
+    workers=None decides automatically (parallel_min_sections() for this
+    machine's CPU count, and only when the pool can fork: spawning workers
+    costs far more than POOL_STARTUP_MS); workers=1 is always serial, as
+    is any count on a single CPU (see pool_workers).
+    """
+    if workers is None:
+        threshold = parallel_min_sections()
+        return threshold is not None and section_count >= threshold and can_fork()
+    return pool_workers(workers) > 1 and section_count > 1
+
+
+def render_sections(sections, cache, workers=None):
+    """
+    Yield each section's HTML in order, rendered serially or on a process pool.
     
-    # Check file exists
-    if not analysis_file.exists():
-        print(f"Error: {analysis_file} not found")
-        sys.exit(1)
+    Workers get the cache's database path (or a dict cache) once, through
+    the pool initializer, rather than with every section. They are forked
+    when can_fork() allows it and spawned otherwise, as in
+    thumbnails.make_pool.
+    """
+    if not use_render_pool(len(sections), workers):
+        for section in sections:
+            yield render_section_from_yaml(section, cache)
+        return
     
-    # Load analysis YAML
-    print(f"\n✓ Loading {analysis_file.name}...")
-    with open(analysis_file, 'r') as f:
-        analysis = yaml.safe_load(f)
+    workers = pool_workers(workers)
+    source = cache.path if isinstance(cache, QueryCache) else cache
+    chunksize = max(1, len(sections) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker,
+                             initargs=(source,), mp_context=pool_context()) as pool:
+        yield from pool.map(_render_worker_section, sections, chunksize=chunksize)
+
+
+def write_document(analysis, f, cache, default_title='', log=print, workers=None):
+    """
+    Render a whole analysis to a complete HTML page, streamed into file f.
     
-    print(f"✓ Loading image cache...")
-    cache = load_cache()
+    The template head and CSS are written first, then the hero section,
+    then every other section inside the page-wrapper in document order,
+    each written as soon as it is rendered, so only one section's HTML is
+    held at a time. The hero is hoisted out of document order (the last
+    hero wins, as before). Progress lines go to `log`.
     
+    Sections are rendered on a process pool when there are enough of them
+    (see use_render_pool); `workers` overrides the automatic choice.
+    """
     # Get metadata
     metadata = analysis.get('metadata', {})
-    title = metadata.get('title', analysis_file.stem)
+    title = metadata.get('title', default_title)
     
     # Generate HTML
-    print(f"✓ Generating HTML from YAML...")
-    print("="*70)
+    log(f"✓ Generating HTML from YAML...")
+    log("="*70)
+    start_hits, start_misses, _ = inline_cache_stats()
     
-    hero_html = ""
-    body_parts = []
+    head, rest = HTML_TEMPLATE.split('{css}')
+    middle, tail = rest.split('{content}')
+    f.write(head.format(title=title))
+    f.write(get_css())
+    f.write(middle)
     
-    # Render each section
     sections = analysis.get('sections', [])
+    heroes = [i for i, section in enumerate(sections) if section.get('style', 'content') == 'hero']
+    hero = heroes[-1] if heroes else None
+    if hero is not None:
+        f.write(render_section_from_yaml(sections[hero], cache))
+    f.write('\n<div class="page-wrapper">\n')
+    
+    # Render each section
+    body = [section for section in sections if section.get('style', 'content') != 'hero']
+    # Decide once: render_sections only starts when the first section is needed
+    pooled = use_render_pool(len(body), workers)
+    rendered = render_sections(body, cache, (workers or os.cpu_count()) if pooled else 1)
+    if pooled:
+        log(f"  Rendering {len(body)} sections in parallel")
+    first = True
     for i, section in enumerate(sections, 1):
         section_title = section.get('title', 'Untitled')
         section_style = section.get('style', 'content')
         
-        print(f"  [{i}/{len(sections)}] {section_title} ({section_style})")
+        log(f"  [{i}/{len(sections)}] {section_title} ({section_style})")
         
         # Count images
         image_count = 0
         if section.get('needs_images', True):
             queries = section.get('queries', [])
             image_count = len(get_images_for_queries(queries, cache))
-        print(f"      → {image_count} images")
-        
-        # Render section
-        html = render_section_from_yaml(section, cache)
+        log(f"      → {image_count} images")
         
-        # Hero stays outside the page-wrapper
+        # Hero was written above, outside the page-wrapper
         if section_style == 'hero':
-            hero_html = html
+            continue
+        if not first:
+            f.write('\n')
+        first = False
+        f.write(next(rendered))
+    
+    # Pool workers keep their own inline caches: the parent's counts only
+    # cover serial rendering (and the hero)
+    hits, misses, _ = inline_cache_stats()
+    hits, misses = hits - start_hits, misses - start_misses
+    if hits + misses and not pooled:
+        log(f"✓ Inline markdown: {hits}/{hits + misses} spans reused ({hits / (hits + misses):.0%})")
+    
+    f.write('\n</div>')
+    f.write(tail)
+
+
+def render_document(analysis, cache, default_title='', log=print, workers=None):
+    """Render a whole analysis to a complete HTML page, as a string."""
+    buf = io.StringIO()
+    write_document(analysis, buf, cache, default_title=default_title, log=log, workers=workers)
+    return buf.getvalue()
+
+
+def write_html(analysis, cache, html_file, default_title='', log=print, workers=None):
+    """
+    Stream the page for an analysis to html_file.
+    
+    Written to a temporary file next to it and renamed into place, so a
+    failed render never leaves a truncated page behind.
+    """
+    tmp_path = f"{html_file}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, 'w') as f:
+            write_document(analysis, f, cache, default_title=default_title, log=log, workers=workers)
+        os.replace(tmp_path, html_file)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def output_file_for(analysis_file):
+    """trip.analysis.yaml -> trip.html, next to the analysis file."""
+    analysis_file = Path(analysis_file)
+    output_name = analysis_file.stem.replace('.analysis', '')
+    return analysis_file.parent / f"{output_name}.html"
+
+
+def main():
+    workers = None
+    args = []
+    argv = iter(sys.argv[1:])
+    for a in argv:
+        if a == '--workers':
+            workers = int(next(argv, 1))
+        elif a.startswith('--workers='):
+            workers = int(a.split('=', 1)[1])
         else:
-            body_parts.append(html)
+            args.append(a)
+    
+    if len(args) < 1:
+        print("Usage: python generator.py travel.analysis.yaml [--workers N]")
+        print("\nThe YAML file contains all content - no markdown file needed.")
+        print("\nOptions:")
+        threshold = parallel_min_sections()
+        default = f"parallel from {threshold} sections" if threshold else "serial on one CPU"
+        print(f"  --workers N    Render processes (default: {default}, 1 = serial)")
+        sys.exit(1)
+    
+    analysis_file = Path(args[0])
     
-    # Combine: hero + page-wrapper containing rest of content
-    content = hero_html + '\n<div class="page-wrapper">\n' + '\n'.join(body_parts) + '\n</div>'
-    full_html = HTML_TEMPLATE.format(
-        title=title,
-        css=get_css(),
-        content=content
-    )
+    # Check file exists
+    if not analysis_file.exists():
+        print(f"Error: {analysis_file} not found")
+        sys.exit(1)
     
+    # Load analysis YAML
+    print(f"\n✓ Loading {analysis_file.name}...")
+    with open(analysis_file, 'r') as f:
+        analysis = yaml.safe_load(f)
+    
+    print(f"✓ Loading image cache...")
     # Write output - use stem from analysis file name
-    output_name = analysis_file.stem.replace('.analysis', '')
-    output_file = analysis_file.parent / f"{output_name}.html"
-    with open(output_file, 'w') as f:
-        f.write(full_html)
+    output_file = output_file_for(analysis_file)
+    with load_cache() as cache:
+        write_html(analysis, cache, output_file, default_title=analysis_file.stem, workers=workers)
     
     print("="*70)
     print(f"\n✓ Generated: {output_file}")
-    print(f"  Sections: {len(sections)}")
+    print(f"  Sections: {len(analysis.get('sections', []))}")
 
 
 if __name__ == '__main__':
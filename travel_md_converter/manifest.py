@@ -0,0 +1,86 @@
+"""
+Build manifest: content hashes of each pipeline stage's inputs and outputs.
+
+Stored next to the markdown as <name>.manifest.yaml. A stage is up to date
+when every input hash matches what was recorded when it last ran and its
+output files still have the hashes it wrote, so re-running convert.py on
+an unchanged document does no work, and an edit re-runs only the stages
+whose inputs it touched.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import yaml
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text):
+    return hash_bytes(text.encode())
+
+
+def hash_json(value):
+    """Hash a JSON-serializable value (key order independent)."""
+    return hash_text(json.dumps(value, sort_keys=True, default=str))
+
+
+def hash_file(path):
+    """SHA-256 of a file's contents, or None if it doesn't exist."""
+    try:
+        return hash_bytes(Path(path).read_bytes())
+    except OSError:
+        return None
+
+
+def hash_cache_entries(cache, queries):
+    """Hash the cache entries for a set of queries (missing entries hash as None)."""
+    return hash_json([[q, cache.get(q)] for q in sorted(queries)])
+
+
+class Manifest:
+    """Per-document record of stage inputs and outputs."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.stages = {}
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                self.stages = (yaml.safe_load(f) or {}).get('stages', {})
+
+    def changed_inputs(self, stage, inputs):
+        """
+        Names of inputs that differ from the last recorded run.
+
+        Returns None if the stage has never been recorded.
+        """
+        record = self.stages.get(stage)
+        if record is None:
+            return None
+        recorded = record.get('inputs', {})
+        return [name for name, digest in inputs.items() if recorded.get(name) != digest]
+
+    def is_fresh(self, stage, inputs):
+        """True if the inputs match the last run and its outputs are unchanged."""
+        if self.changed_inputs(stage, inputs) != []:
+            return False
+        outputs = self.stages[stage].get('outputs', {})
+        return all(hash_file(self.path.parent / path) == digest for path, digest in outputs.items())
+
+    def record(self, stage, inputs, outputs=()):
+        """Record a completed stage run and save the manifest."""
+        self.stages[stage] = {
+            'inputs': dict(inputs),
+            # Output paths are relative to the manifest, so the document's
+            # directory can be converted from anywhere
+            'outputs': {os.path.relpath(path, self.path.parent): hash_file(path) for path in outputs},
+        }
+        self.save()
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            yaml.dump({'stages': self.stages}, f, default_flow_style=False, sort_keys=False)
@@ -0,0 +1,219 @@
+"""
+Markdown → HTML renderer used by utils.markdown_to_html.
+
+Block level: each line is classified once (header, rule, table row, list
+item, paragraph) and rendered into a shared list of output parts, which the
+caller joins once. List items are nested by indentation, so an indented
+`  * item` under a bullet becomes a sub-list of that bullet, including
+after a blank line.
+
+Inline: one precompiled pattern finds code spans, links, bold and italic
+in a single left-to-right pass over each text span; only the inside of a
+matched span is rendered again. Code spans are escaped and left
+unformatted, and link URLs are never touched by emphasis.
+
+Rendered inline spans are memoized in a bounded LRU keyed by the text and
+INLINE_VERSION: recurring titles, location names and bullets are rendered
+once per process, across every document in a batch.
+"""
+
+import html
+import re
+from functools import lru_cache
+
+# Bump when a change to inline rendering alters its output
+INLINE_VERSION = 1
+INLINE_CACHE_SIZE = 8192
+
+INLINE_PATTERN = re.compile(r'''
+    `(?P<code>[^`]+)`
+  | \[(?P<text>[^\]]+)\]\((?P<url>[^)]+)\)
+  | \*\*(?P<strong>(?:[^*]|\*[^*]+\*)+)\*\*
+  | \*(?P<em>(?:[^*]|\*\*[^*]+\*\*)+)\*(?!\*)
+  | _(?P<em_us>[^_]+)_
+''', re.VERBOSE)
+
+# A list item, matched against the stripped line
+LIST_ITEM_PATTERN = re.compile(r'(?:[-*] |(?P<number>\d+)\.\s*)')
+TABLE_SEPARATOR_PATTERN = re.compile(r'^[\s|:\-]+$')
+
+
+def render_inline(text):
+    """Convert inline markdown (code, bold, italic, links) to HTML."""
+    if not any(c in text for c in '`[*_'):
+        return text
+    return _render_inline_cached(text, INLINE_VERSION)
+
+
+@lru_cache(maxsize=INLINE_CACHE_SIZE)
+def _render_inline_cached(text, version):
+    out = []
+    _render_inline(text, out)
+    return ''.join(out)
+
+
+def clear_inline_cache():
+    _render_inline_cached.cache_clear()
+
+
+def inline_cache_stats():
+    """(hits, misses, entries) for the inline LRU; plain text without markup isn't counted."""
+    info = _render_inline_cached.cache_info()
+    return info.hits, info.misses, info.currsize
+
+
+def _render_inline(text, out):
+    pos = 0
+    for match in INLINE_PATTERN.finditer(text):
+        out.append(text[pos:match.start()])
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == 'code':
+            out.append(f'<code>{html.escape(match.group("code"), quote=False)}</code>')
+        elif kind == 'url':
+            out.append(f'<a href="{match.group("url")}">')
+            _render_inline(match.group('text'), out)
+            out.append('</a>')
+        else:
+            tag = 'strong' if kind == 'strong' else 'em'
+            out.append(f'<{tag}>')
+            _render_inline(match.group(kind), out)
+            out.append(f'</{tag}>')
+    out.append(text[pos:])
+
+
+def table_cells(row):
+    return [cell.strip() for cell in row.split('|') if cell.strip()]
+
+
+def render_table(lines, start, out):
+    """
+    Render the markdown table starting at lines[start] into out.
+
+    Returns the index of the first line after the table, or start if there
+    is no table there (fewer than two rows).
+    """
+    end = start
+    while end < len(lines) and '|' in lines[end]:
+        end += 1
+    rows = [line.strip() for line in lines[start:end]]
+    if len(rows) < 2:
+        return start
+
+    parts = ['<div class="table-wrapper"><table>\n', '<thead><tr>\n']
+    for cell in table_cells(rows[0]):
+        parts.append(f'<th>{render_inline(cell)}</th>\n')
+    parts.append('</tr></thead>\n')
+
+    body = rows[2:] if TABLE_SEPARATOR_PATTERN.match(rows[1]) else rows[1:]
+    if body:
+        parts.append('<tbody>\n')
+        for row in body:
+            parts.append('<tr>\n')
+            for cell in table_cells(row):
+                parts.append(f'<td>{render_inline(cell)}</td>\n')
+            parts.append('</tr>\n')
+        parts.append('</tbody>\n')
+
+    parts.append('</table></div>\n')
+    out.append(''.join(parts))
+    return end
+
+
+def indent_of(line):
+    return len(line.expandtabs(4)) - len(line.expandtabs(4).lstrip())
+
+
+class ListStack:
+    """Open lists, innermost last, each as [indent, tag, item has a sub-list]."""
+
+    def __init__(self, out):
+        self.out = out
+        self.levels = []
+
+    def add_item(self, indent, tag, content):
+        out = self.out
+        levels = self.levels
+        while len(levels) > 1 and levels[-1][0] > indent:
+            self.close_level()
+        if not levels or indent > levels[-1][0]:
+            if levels:
+                levels[-1][2] = True
+            out.append(f'<{tag}>')
+            levels.append([indent, tag, False])
+        else:
+            self.close_item()
+        out.append(f'<li>{render_inline(content)}')
+
+    def close_item(self):
+        if self.levels[-1][2]:
+            self.out.append('</li>')
+            self.levels[-1][2] = False
+        else:
+            self.out[-1] += '</li>'
+
+    def close_level(self):
+        self.close_item()
+        self.out.append(f'</{self.levels.pop()[1]}>')
+
+    def close_all(self):
+        while self.levels:
+            self.close_level()
+
+    def continues_at(self, lines, i):
+        """True if a blank line at lines[i] is followed by a nested item of the open list."""
+        for line in lines[i + 1:]:
+            stripped = line.strip()
+            if stripped:
+                return bool(LIST_ITEM_PATTERN.match(stripped)) and indent_of(line) > self.levels[0][0]
+        return False
+
+
+def render_markdown(md_text, out):
+    """
+    Render markdown blocks into out, one part per block or list line.
+
+    Handles paragraphs, nested lists, rules and tables; headers are skipped
+    (rendered separately). Returns out.
+    """
+    lines = md_text.split('\n')
+    lists = ListStack(out)
+    i = 0
+
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        item = LIST_ITEM_PATTERN.match(stripped)
+
+        if lists.levels and not item:
+            if not stripped and lists.continues_at(lines, i):
+                i += 1
+                continue
+            lists.close_all()
+
+        # Skip headers (handled separately)
+        if line.startswith('#'):
+            i += 1
+            continue
+
+        if stripped == '---':
+            out.append('<hr>')
+            i += 1
+            continue
+
+        if stripped.startswith('|'):
+            next_i = render_table(lines, i, out)
+            if next_i != i:
+                i = next_i
+                continue
+
+        if item:
+            tag = 'ol' if item.group('number') else 'ul'
+            lists.add_item(indent_of(line), tag, stripped[item.end():])
+        elif stripped:
+            out.append(f'<p>{render_inline(line)}</p>')
+
+        i += 1
+
+    lists.close_all()
+    return out
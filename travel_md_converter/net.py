@@ -0,0 +1,158 @@
+"""
+Networking helpers shared by the scraping step.
+
+Provides a per-host token-bucket rate limiter so concurrent workers can
+share a request budget per host instead of sleeping globally, and a shared
+keep-alive session so repeated requests to the same host (thumbnails from
+encrypted-tbn*.gstatic.com) reuse pooled connections instead of paying a
+TCP+TLS handshake each time.
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Connection pooling: POOL_HOSTS distinct hosts are kept, each with up to
+# POOL_SIZE keep-alive connections (raise POOL_SIZE with the worker count).
+POOL_HOSTS = 32
+POOL_SIZE = 8
+
+# Retry 429/5xx with exponential backoff (0.5s, 1s, 2s), honouring Retry-After
+RETRIES = 3
+BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (5, 10)
+
+# Requests per second and burst size per host. Hosts not listed here get
+# DEFAULT_RATE. Google search is throttled hard; thumbnails are cheap.
+HOST_RATES = {
+    'www.google.com': (1.0, 2),
+}
+DEFAULT_RATE = (10.0, 10)
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` acquisitions/sec, bursting to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until it is available."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            # Reserve the token now so waiting callers queue up behind each other
+            self.tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def set_host_rate(host, rate, burst=1):
+    """Override the rate limit for a host (takes effect for new requests)."""
+    with _buckets_lock:
+        HOST_RATES[host] = (rate, burst)
+        _buckets.pop(host, None)
+
+
+def get_bucket(host):
+    """Get (or create) the token bucket for a host."""
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            rate, burst = HOST_RATES.get(host, DEFAULT_RATE)
+            bucket = _buckets[host] = TokenBucket(rate, burst)
+        return bucket
+
+
+def throttle(url):
+    """Block until a request to url's host is allowed by its rate limit."""
+    get_bucket(urlparse(url).netloc).acquire()
+
+
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+
+
+def make_session(pool_size=None, retries=None):
+    """Build a requests.Session with pooled keep-alive connections and retries."""
+    retry = Retry(
+        total=RETRIES if retries is None else retries,
+        backoff_factor=BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_HOSTS,
+        pool_maxsize=pool_size or POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def configure(pool_size=None, retries=None, timeout=None):
+    """
+    Replace the shared session with a new one.
+
+    The old session isn't closed: other threads may still be using it, and
+    its connections are released once they let go of it.
+    """
+    global _session, _session_pool_size, TIMEOUT
+    if timeout is not None:
+        TIMEOUT = timeout
+    with _session_lock:
+        _session = make_session(pool_size, retries)
+        _session_pool_size = pool_size or POOL_SIZE
+
+
+def ensure_pool_size(pool_size):
+    """
+    Make sure the shared session keeps at least pool_size connections per
+    host. The session is only replaced (see configure) when it is smaller,
+    so repeated calls keep reusing its keep-alive connections.
+    """
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is not None and _session_pool_size >= pool_size:
+            return
+        _session = make_session(max(pool_size, POOL_SIZE))
+        _session_pool_size = max(pool_size, POOL_SIZE)
+
+
+def get_session():
+    """Get the shared session, creating it on first use."""
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+            _session_pool_size = POOL_SIZE
+        return _session
+
+
+def get(url, **kwargs):
+    """Rate-limited GET through the shared session."""
+    throttle(url)
+    kwargs.setdefault('timeout', TIMEOUT)
+    return get_session().get(url, **kwargs)
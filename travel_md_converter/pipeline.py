@@ -0,0 +1,554 @@
+"""
+In-process pipeline: Analyze → Scrape → Select → Generate.
+
+Runs all four steps in one interpreter, passing the parsed analysis and the
+open query cache from step to step instead of re-importing libraries and
+re-reading the analysis YAML and cache in four separate processes. The
+analysis YAML is written as a checkpoint after analysis and after
+selection, and the HTML at the end. The step scripts (analyze.py,
+scraper.py, selector.py, generator.py) remain usable on their own.
+
+Each stage records the hashes of its inputs and outputs in a build
+manifest (<name>.manifest.yaml, see manifest.py) and is skipped when they
+are unchanged: editing the markdown re-runs analysis, new or changed cache
+entries re-run selection and generation, and a styles.css or renderer
+change only regenerates the HTML.
+
+convert_many() converts a batch of documents: analyses run concurrently,
+image queries are deduplicated across every document and scraped once,
+selection jobs from all documents share one worker pool, and HTML is
+rendered on a process pool.
+
+While the analysis streams in, each completed section's queries are handed
+to a background scraper (ScrapePrefetcher), so image fetching overlaps
+with the rest of the model's response.
+"""
+
+import multiprocessing.util
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+
+import yaml
+
+import analyze
+import scraper
+import selector
+import generator
+from cache import load_cache, SelectionCache, is_expired
+from manifest import Manifest, hash_file, hash_text, hash_json, hash_cache_entries
+from prompt import ANALYSIS_PROMPT
+from styles import CSS_PATH
+
+
+def print_step(step_name, description):
+    """Print a step banner."""
+    print("\n" + "="*70)
+    print(f"STEP {step_name}: {description}")
+    print("="*70 + "\n")
+
+
+def load_analysis(analysis_file):
+    """Read an analysis YAML file."""
+    with open(analysis_file, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def print_skipped(step_name, description):
+    """Print the banner for a stage whose inputs haven't changed."""
+    print("\n" + "="*70)
+    print(f"STEP {step_name}: {description} - SKIPPED (inputs unchanged)")
+    print("="*70)
+
+
+def analysis_inputs(md_file):
+    return {'markdown': hash_file(md_file), 'prompt': hash_text(ANALYSIS_PROMPT)}
+
+
+def cache_inputs(cache, queries):
+    inputs = {'queries': hash_json(sorted(queries)), 'cache': hash_cache_entries(cache, queries)}
+    # Expired entries make the stage stale until they're refreshed: the
+    # stage isn't recorded while any remain (see convert_with_cache)
+    expired = sorted(q for q in queries if is_expired(cache.get(q)))
+    if expired:
+        inputs['expired'] = hash_json(expired)
+    return inputs
+
+
+def generate_inputs(analysis_file, cache_hash):
+    return {
+        'analysis': hash_file(analysis_file),
+        'cache': cache_hash,
+        'styles': hash_file(CSS_PATH),
+        'renderer': generator.RENDERER_VERSION,
+    }
+
+
+def analysis_is_current(md_file, analysis_file, manifest):
+    """
+    True if the existing analysis file can be reused.
+
+    An analysis file with no manifest record (made by analyze.py or an older
+    run) is trusted and recorded; otherwise the markdown and prompt hashes
+    must match the run that produced it.
+    """
+    if not analysis_file.exists():
+        return False
+    inputs = analysis_inputs(md_file)
+    changed = manifest.changed_inputs('analyze', inputs)
+    if changed is None:
+        manifest.record('analyze', inputs)
+        return True
+    if changed:
+        print(f"\n⚠ {', '.join(changed)} changed since {analysis_file.name} was made")
+        return False
+    return True
+
+
+class ScrapePrefetcher:
+    """
+    Scrapes sections' queries in the background as the analysis streams in.
+    
+    Call it with each completed section; a single worker thread scrapes
+    everything queued since its last batch in one scraper.scrape_query_set()
+    call. close() waits for the queue to drain.
+    """
+    
+    def __init__(self, cache, workers=scraper.DEFAULT_WORKERS):
+        self.cache = cache
+        self.workers = workers
+        self.seen = set()
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def __call__(self, section):
+        queries = set()
+        scraper.collect_queries_from_section(section, queries)
+        with self.lock:
+            queries -= self.seen
+            self.seen |= queries
+        if queries:
+            self.queue.put(queries)
+    
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            # Coalesce whatever else arrived while the last batch ran
+            done = False
+            while True:
+                try:
+                    more = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    done = True
+                    break
+                batch |= more
+            print(f"\n✓ Prefetching images for {len(batch)} queries from the streamed analysis")
+            try:
+                scraper.scrape_query_set(batch, self.cache, workers=self.workers)
+            except Exception as e:
+                print(f"\n⚠ Prefetch scraping failed: {e}")
+            if done:
+                return
+    
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def previous_analysis(md_file, analysis_file, manifest):
+    """
+    The existing analysis to update incrementally (only changed sections are
+    re-analyzed), or None when there is none or the analysis prompt changed.
+    """
+    if not analysis_file.exists():
+        return None
+    if 'prompt' in (manifest.changed_inputs('analyze', analysis_inputs(md_file)) or []):
+        return None
+    return load_analysis(analysis_file)
+
+
+def run_analysis(md_file, analysis_file, manifest, on_section=None):
+    """
+    Step 1: analyze markdown, or load the existing analysis if it's current.
+    
+    on_section receives each section as the response streams in.
+
+    Returns the analysis dict, or None if analysis failed.
+    """
+    if analysis_is_current(md_file, analysis_file, manifest):
+        print("\n" + "="*70)
+        print(f"STEP 1/4: AI Analysis - SKIPPED (using existing {analysis_file.name})")
+        print("="*70)
+        print(f"\n✓ Found existing analysis: {analysis_file}")
+        print("  Delete it to force re-analysis.")
+        return load_analysis(analysis_file)
+
+    print_step("1/4", "AI Analysis (MD → YAML)")
+    try:
+        previous = previous_analysis(md_file, analysis_file, manifest)
+        analysis = analyze.analyze_markdown(md_file.read_text(), previous=previous,
+                                            on_section=on_section)
+    except Exception as e:
+        print(f"\n✗ Error parsing response: {e}")
+        return None
+    if analysis is None:
+        return None
+
+    # Checkpoint: the analysis is the expensive part
+    analyze.save_analysis(analysis, analysis_file)
+    manifest.record('analyze', analysis_inputs(md_file))
+    print(f"\n✓ Saved analysis to: {analysis_file}")
+    analyze.print_summary(analysis)
+    return analysis
+
+
+def run_select(analysis, cache, analysis_file, selections, workers=selector.DEFAULT_WORKERS, batch=False):
+    """Step 3: select images with Gemini Vision, checkpointing the analysis. Returns False on error."""
+    print_step("3/4", "AI Image Selection")
+    try:
+        if selector.select_for_analysis(analysis, cache, batch=batch, workers=workers,
+                                        selections=selections):
+            selector.save_analysis(analysis, analysis_file)
+            print(f"\n✓ Updated: {analysis_file}")
+        return True
+    except Exception as e:
+        print(f"\n⚠ {e}")
+        return False
+
+
+def scrape_and_select(sections, cache, queries, selections, workers=None, batch=False):
+    """
+    Scrape `queries` and select images for `sections`, overlapped: each
+    section's selection is dispatched as soon as its own queries are in the
+    cache (selector.SelectionScheduler), while other queries still scrape.
+    Selections are looked up in and stored to `selections` (a SelectionCache).
+
+    Returns (scraped_ok, selected_ok, number of sections/items selected).
+    """
+    pending = {q for q in queries if cache.needs_scrape(q)}
+    scheduler = selector.SelectionScheduler(
+        sections, cache, pending, batch=batch,
+        workers=workers or selector.DEFAULT_WORKERS, selections=selections,
+    )
+    scraped_ok = selected_ok = True
+    try:
+        scraper.scrape_query_set(queries, cache, workers=workers or scraper.DEFAULT_WORKERS,
+                                 on_query=scheduler.query_done)
+    except Exception as e:
+        print(f"\n✗ Error in scraping: {e}")
+        scraped_ok = False
+    try:
+        selected = scheduler.finish()
+    except Exception as e:
+        print(f"\n⚠ {e}")
+        selected_ok = False
+        selected = 0
+    return scraped_ok, selected_ok, selected
+
+
+def run_scrape_select(analysis, cache, analysis_file, queries, selections, workers=None, batch=False):
+    """Steps 2+3 pipelined, checkpointing the analysis. Returns (scraped_ok, selected_ok)."""
+    print_step("2+3/4", "Image Scraping + AI Image Selection (pipelined)")
+    scraped_ok, selected_ok, selected = scrape_and_select(
+        analysis.get('sections', []), cache, queries, selections, workers=workers, batch=batch)
+    if selected:
+        selector.save_analysis(analysis, analysis_file)
+        print(f"\n✓ Updated: {analysis_file}")
+    return scraped_ok, selected_ok
+
+
+def run_generate(analysis, cache, html_file):
+    """Step 4: render and write the HTML. Returns False on error."""
+    print_step("4/4", "HTML Generation (YAML → HTML)")
+    try:
+        generator.write_html(analysis, cache, html_file, default_title=html_file.stem)
+    except Exception as e:
+        print(f"\n✗ Error in HTML generation: {e}")
+        return False
+
+    print("="*70)
+    print(f"\n✓ Generated: {html_file}")
+    print(f"  Sections: {len(analysis.get('sections', []))}")
+    return True
+
+
+def convert(md_file, workers=None, batch=False):
+    """
+    Convert one markdown file to HTML, running every step in-process.
+
+    Stages whose inputs are unchanged since the last run are skipped.
+    Scraping and selection problems are reported but not fatal (the
+    generator falls back to unselected images). Returns the HTML path, or
+    None if analysis or generation failed.
+    """
+    with load_cache() as cache, SelectionCache(cache.path) as selections:
+        print(f"✓ Loaded cache: {len(cache)} queries")
+        return convert_with_cache(Path(md_file), cache, selections, workers=workers, batch=batch)
+
+
+def convert_with_cache(md_file, cache, selections, workers=None, batch=False):
+    """convert() with the query and selection caches already open."""
+    analysis_file = md_file.with_suffix('.analysis.yaml')
+    html_file = md_file.with_suffix('.html')
+    manifest = Manifest(md_file.with_suffix('.manifest.yaml'))
+
+    prefetch = ScrapePrefetcher(cache, workers=workers or scraper.DEFAULT_WORKERS)
+    try:
+        analysis = run_analysis(md_file, analysis_file, manifest, on_section=prefetch)
+    finally:
+        prefetch.close()
+    if analysis is None:
+        print("\n✗ Analysis failed.")
+        return None
+
+    queries = scraper.collect_analysis_queries(analysis)
+
+    # Steps 2+3: scraping runs while the queries or their cache entries
+    # changed, with each section's selection starting as its queries land
+    if not manifest.is_fresh('scrape', cache_inputs(cache, queries)):
+        scraped_ok, selected_ok = run_scrape_select(analysis, cache, analysis_file, queries, selections,
+                                                    workers=workers, batch=batch)
+        inputs = cache_inputs(cache, queries)
+        if not scraped_ok:
+            print("\n⚠ Scraping had issues, but continuing...")
+        elif all(q in cache for q in queries) and 'expired' not in inputs:
+            # A refresh that found nothing leaves its entry expired: keep
+            # the stage stale so the next run retries it
+            manifest.record('scrape', inputs)
+        if not selected_ok:
+            print("\n⚠ Selection had issues, will use fallback images...")
+    else:
+        print_skipped("2/4", "Image Scraping + Thumbnails")
+        selected_ok = None
+    cache_hash = hash_cache_entries(cache, queries)
+
+    # Step 3 on its own: only while the analysis file differs from what
+    # selection wrote, or the candidates / selection prompt changed
+    inputs = {'cache': cache_hash, 'prompt': selector.PROMPT_VERSION}
+    if selected_ok is None:
+        if manifest.is_fresh('select', inputs):
+            print_skipped("3/4", "AI Image Selection")
+        else:
+            selected_ok = run_select(analysis, cache, analysis_file, selections,
+                                     workers=workers or selector.DEFAULT_WORKERS, batch=batch)
+            if not selected_ok:
+                print("\n⚠ Selection had issues, will use fallback images...")
+    # Sections with nothing to select keep an empty selected_images, so
+    # count_selections never reaches the total: a clean run is what counts
+    if selected_ok:
+        manifest.record('select', inputs, outputs=[analysis_file])
+
+    # Step 4
+    inputs = generate_inputs(analysis_file, cache_hash)
+    if manifest.is_fresh('generate', inputs):
+        print_skipped("4/4", "HTML Generation")
+        print(f"\n✓ Up to date: {html_file}")
+        return html_file
+    if not run_generate(analysis, cache, html_file):
+        print("\n✗ HTML generation failed.")
+        return None
+    manifest.record('generate', inputs, outputs=[html_file])
+
+    return html_file
+
+
+def analyze_file(md_file, analysis_file, on_section=None, manual_fallback=True):
+    """
+    Analyze (or incrementally re-analyze) one markdown file and save its
+    analysis. Returns it, or None on failure.
+
+    With manual_fallback=False a failed Gemini call fails the file instead
+    of prompting for a pasted response (see analyze.get_model_response).
+    """
+    manifest = Manifest(md_file.with_suffix('.manifest.yaml'))
+    try:
+        previous = previous_analysis(md_file, analysis_file, manifest)
+        analysis = analyze.analyze_markdown(md_file.read_text(), previous=previous,
+                                            on_section=on_section,
+                                            manual_fallback=manual_fallback)
+    except Exception as e:
+        print(f"\n✗ {md_file.name}: error parsing response: {e}")
+        return None
+    if analysis is not None:
+        analyze.save_analysis(analysis, analysis_file)
+        manifest.record('analyze', analysis_inputs(md_file))
+        print(f"\n✓ Saved analysis to: {analysis_file}")
+    return analysis
+
+
+_worker_cache = None
+
+
+def _init_generate_worker():
+    """
+    Open the query cache once per generation worker process, and close it
+    (recording its usage) when the worker exits: pool workers skip atexit
+    handlers but run multiprocessing finalizers.
+    """
+    global _worker_cache
+    _worker_cache = load_cache()
+    multiprocessing.util.Finalize(None, _worker_cache.close, exitpriority=10)
+
+
+def _generate_file(analysis, html_file):
+    """Render one document in a worker process and write its HTML."""
+    # Already one document per process: render its sections serially
+    generator.write_html(
+        analysis, _worker_cache, html_file, default_title=Path(html_file).stem,
+        log=lambda *args: None, workers=1
+    )
+    return html_file
+
+
+def generate_documents(docs, cache, processes=None):
+    """
+    Render and write the HTML for each {md_file: analysis}, yielding
+    (md_file, html_file), or (md_file, exception) on failure.
+
+    Documents go to a process pool (started like generator.render_sections'
+    pool, see generator.pool_context) when more than one CPU and document
+    make that worthwhile, otherwise they're rendered in this process.
+    """
+    processes = min(generator.pool_workers(processes), len(docs))
+    if processes < 2:
+        for md_file, analysis in docs.items():
+            html_file = md_file.with_suffix('.html')
+            try:
+                generator.write_html(analysis, cache, html_file, default_title=html_file.stem,
+                                     log=lambda *args: None)
+                result = html_file
+            except Exception as e:
+                result = e
+            yield md_file, result
+        return
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_generate_worker,
+                             mp_context=generator.pool_context()) as pool:
+        futures = {
+            md_file: pool.submit(_generate_file, analysis, md_file.with_suffix('.html'))
+            for md_file, analysis in docs.items()
+        }
+        for md_file, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            yield md_file, result
+
+
+def convert_many(md_files, workers=None, batch=False, processes=None):
+    """
+    Convert several markdown files, sharing work across the whole batch.
+
+    Args:
+        md_files: Markdown files to convert
+        workers: Concurrent network requests (analysis, scraping, selection)
+        batch: Batch several sections per selection request
+        processes: Worker processes for HTML generation (default and at most: CPU count)
+
+    Returns a dict mapping each markdown file to a status string, '✓ <html>'
+    on success or '✗ <reason>' on failure.
+    """
+    with load_cache() as cache, SelectionCache(cache.path) as selections:
+        return convert_many_with_cache([Path(f) for f in md_files], cache, selections,
+                                       workers=workers, batch=batch, processes=processes)
+
+
+def convert_many_with_cache(md_files, cache, selections, workers=None, batch=False, processes=None):
+    """convert_many() with the query and selection caches already open."""
+    status = {}
+    docs = {}  # md_file -> analysis
+
+    # Step 1: analysis - existing files are reused, the rest run concurrently
+    # (serially in manual mode, which reads each response from stdin)
+    print_step("1/4", f"AI Analysis ({len(md_files)} documents)")
+    to_analyze = []
+    for md_file in md_files:
+        analysis_file = md_file.with_suffix('.analysis.yaml')
+        if analysis_is_current(md_file, analysis_file, Manifest(md_file.with_suffix('.manifest.yaml'))):
+            # A hand-edited or truncated file fails this document, not the batch
+            try:
+                docs[md_file] = load_analysis(analysis_file)
+            except (OSError, yaml.YAMLError) as e:
+                reason = ' '.join(str(e).split())
+                status[md_file] = f"✗ unreadable analysis: {reason}"
+                print(f"✗ {md_file.name}: can't read {analysis_file.name}: {reason}")
+                continue
+            print(f"✓ {md_file.name}: using existing {analysis_file.name}")
+        else:
+            to_analyze.append(md_file)
+
+    print(f"✓ Loaded cache: {len(cache)} queries")
+
+    # Streamed sections from every document feed one background scraper.
+    # In automatic mode a failed Gemini call fails the file: pool threads
+    # must not prompt on stdin, and batches may run unattended.
+    automatic = bool(os.environ.get('GEMINI_API_KEY'))
+    analysis_workers = (workers or scraper.DEFAULT_WORKERS) if automatic else 1
+    prefetch = ScrapePrefetcher(cache, workers=workers or scraper.DEFAULT_WORKERS)
+    try:
+        with ThreadPoolExecutor(max_workers=analysis_workers) as pool:
+            futures = [
+                pool.submit(analyze_file, md_file, md_file.with_suffix('.analysis.yaml'), prefetch,
+                            manual_fallback=not automatic)
+                for md_file in to_analyze
+            ]
+            for md_file, future in zip(to_analyze, futures):
+                analysis = future.result()
+                if analysis is None:
+                    status[md_file] = '✗ analysis failed'
+                else:
+                    docs[md_file] = analysis
+    finally:
+        prefetch.close()
+
+    # Steps 2+3: scrape the union of every document's queries once, with
+    # selections from all documents starting as their queries land
+    print_step("2+3/4", "Image Scraping + AI Image Selection (all documents)")
+    all_queries = set()
+    before = {}
+    for md_file, analysis in docs.items():
+        scraper.collect_analysis_queries(analysis, all_queries)
+        before[md_file] = selector.count_selections(analysis.get('sections', []))
+    sections = [section for analysis in docs.values() for section in analysis.get('sections', [])]
+    scraped_ok, selected_ok, _ = scrape_and_select(sections, cache, all_queries, selections,
+                                                   workers=workers, batch=batch)
+    if not scraped_ok:
+        print("\n⚠ Scraping had issues, but continuing...")
+    if not selected_ok:
+        print("\n⚠ Selection had issues, will use fallback images...")
+    for md_file, analysis in docs.items():
+        cached, total = before[md_file]
+        if cached != total:
+            selector.save_analysis(analysis, md_file.with_suffix('.analysis.yaml'))
+
+    # Step 4: render changed documents, on a process pool if worthwhile;
+    # each worker opens the cache once
+    print_step("4/4", "HTML Generation (all documents)")
+    to_generate = {}
+    for md_file, analysis in docs.items():
+        html_file = md_file.with_suffix('.html')
+        queries = scraper.collect_analysis_queries(analysis)
+        inputs = generate_inputs(md_file.with_suffix('.analysis.yaml'), hash_cache_entries(cache, queries))
+        if Manifest(md_file.with_suffix('.manifest.yaml')).is_fresh('generate', inputs):
+            status[md_file] = f"✓ {html_file.name} (up to date)"
+        else:
+            to_generate[md_file] = inputs
+
+    for md_file, result in generate_documents({f: docs[f] for f in to_generate}, cache, processes):
+        if isinstance(result, Exception):
+            status[md_file] = f"✗ generation failed: {result}"
+            continue
+        Manifest(md_file.with_suffix('.manifest.yaml')).record(
+            'generate', to_generate[md_file], outputs=[result])
+        status[md_file] = f"✓ {result.name}"
+
+    return {md_file: status[md_file] for md_file in md_files}
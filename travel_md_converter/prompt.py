@@ -564,9 +564,49 @@ sections:
 """
 
 
+# The static part of the prompt: everything before the document itself.
+# Sent as a (cached) system instruction in automatic mode.
+ANALYSIS_INSTRUCTIONS = ANALYSIS_PROMPT[:ANALYSIS_PROMPT.rindex("## MARKDOWN TO ANALYZE:")]
+
+
 def get_analysis_prompt(md_content: str) -> str:
     """
     Generate the full analysis prompt with the markdown content appended.
     """
     return ANALYSIS_PROMPT + "\n" + md_content
 
+
+EXCERPT_INSTRUCTIONS = """## PARTIAL RE-ANALYSIS
+
+The markdown below is an EXCERPT of a larger document whose other sections
+have already been analyzed. The outline of the whole document is:
+
+{outline}
+
+Analyze ONLY the excerpt. Return the same YAML structure, with `sections:`
+covering just the excerpt's headers, in order. Do not add a hero or footer
+section unless the excerpt contains the document's title or references.
+Include `metadata:` only if the excerpt contains the document's title.
+
+## MARKDOWN TO ANALYZE:
+
+"""
+
+
+def get_excerpt_prompt(excerpt: str, outline: str) -> str:
+    """
+    Generate the analysis prompt for an excerpt of a document, given the
+    outline (header lines) of the whole document for context.
+    """
+    return ANALYSIS_INSTRUCTIONS + EXCERPT_INSTRUCTIONS.format(outline=outline) + "\n" + excerpt
+
+
+def split_prompt(prompt: str):
+    """
+    Split a generated prompt into (static instructions, per-document request).
+    
+    Instructions are None if the prompt doesn't start with ANALYSIS_INSTRUCTIONS.
+    """
+    if prompt.startswith(ANALYSIS_INSTRUCTIONS):
+        return ANALYSIS_INSTRUCTIONS, prompt[len(ANALYSIS_INSTRUCTIONS):]
+    return None, prompt
@@ -8,22 +8,55 @@ Usage:
 Reads analysis file, extracts ALL queries (including nested ones in
 itinerary and subsections), checks cache, scrapes new queries.
 Downloads Google's cached thumbnails (small, fast) for AI evaluation.
-Updates query_cache.yaml with original URL → thumbnail mapping.
+Updates the query cache (see cache.py) with original URL → thumbnail mapping.
+
+Options:
+    --workers N    Scrape N queries concurrently (default: 4, 1 = serial)
+
+Requests are rate limited per host and share a pooled keep-alive session
+with retry/backoff on 429/5xx (see net.py).
+Set SCRAPER_SEARCH_URL to point the scraper at a local stand-in for Google Images.
+
+Thumbnails are downloaded into a temp file, validated while streaming
+(magic bytes, size limits, Content-Length) and renamed into place, so
+images/ never holds a partial download. Downloaded thumbnails are
+normalized (real format sniffed, downsized and re-encoded as JPEG when
+Pillow is installed) on a process pool, and their mime type, byte size and
+dimensions are recorded in the cache entry.
 """
 
 import yaml
-import requests
 import re
-import time
+import json
+import os
 import sys
 import hashlib
+import threading
 from pathlib import Path
 from datetime import datetime
 from urllib.parse import quote_plus
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import net
+from cache import load_cache, IMAGES_DIR
+from thumbnails import normalize_thumbnails, make_pool, sniff_mime
 
-CACHE_FILE = 'query_cache.yaml'
-IMAGES_DIR = Path('images')
 MAX_IMAGES = 6  # Get more candidates for AI to choose from
+DEFAULT_WORKERS = 4
+SEARCH_URL = os.environ.get('SCRAPER_SEARCH_URL', 'https://www.google.com/search')
+
+# Downloads: smaller bodies are error pages, larger ones are abandoned;
+# the first MAGIC_BYTES must look like an image
+MIN_THUMB_BYTES = 500
+MAX_DOWNLOAD_BYTES = 15 * 1024 * 1024
+MAGIC_BYTES = 12
+
+# Result page parsing. Image metadata arrays look like ["url",height,width]
+# with JSON string escapes in the URL (\u003d = '=')
+IMAGE_ARRAY_PATTERN = re.compile(r'\["(https?://[^"\\]*(?:\\.[^"\\]*)*)",\s*(\d+),\s*(\d+)\]')
+THUMB_URL_PATTERN = re.compile(r'(https://encrypted-tbn\d*\.gstatic\.com/images\?q[^"\'>\s]+)')
+THUMB_PREFIX = 'https://encrypted-tbn'
+MIN_ORIGINAL_EDGE = 200
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
 
 # Headers for web scraping
 HEADERS = {
@@ -33,21 +66,6 @@ HEADERS = {
 }
 
 
-def load_cache():
-    """Load existing cache or create empty."""
-    cache_path = Path(CACHE_FILE)
-    if cache_path.exists():
-        with open(cache_path, 'r') as f:
-            return yaml.safe_load(f) or {}
-    return {}
-
-
-def save_cache(cache):
-    """Save cache to disk."""
-    with open(CACHE_FILE, 'w') as f:
-        yaml.dump(cache, f, default_flow_style=False, sort_keys=False)
-
-
 def ensure_images_dir():
     """Create images directory if it doesn't exist."""
     IMAGES_DIR.mkdir(exist_ok=True)
@@ -61,27 +79,58 @@ def url_to_filename(url, query):
 
 
 def download_thumbnail(url, local_path):
-    """Download thumbnail from URL."""
+    """
+    Download thumbnail from URL into local_path, atomically.
+    
+    The body streams into a temporary file next to local_path and is
+    checked as it arrives: the first bytes must be an image (magic
+    numbers), and a body over MAX_DOWNLOAD_BYTES (by Content-Length, or as
+    it streams) is abandoned. Only a complete body of at least
+    MIN_THUMB_BYTES that matches Content-Length is renamed into place, so
+    local_path is either absent or a whole image - never a partial
+    download - and concurrent writers never see each other's temp files.
+    """
+    local_path = Path(local_path)
+    tmp_path = local_path.with_name(f".{local_path.name}.{os.getpid()}.{threading.get_ident()}.part")
     try:
-        response = requests.get(url, headers=HEADERS, timeout=10, stream=True)
-        response.raise_for_status()
+        # Close the response so its connection goes back to the pool
+        with net.get(url, headers=HEADERS, stream=True) as response:
+            response.raise_for_status()
+            
+            content_type = response.headers.get('content-type', '')
+            if 'image' not in content_type and 'octet-stream' not in content_type:
+                return False
+            
+            # Content-Length counts encoded bytes; only compare unencoded bodies
+            expected = response.headers.get('content-length', '')
+            expected = int(expected) if expected.isdigit() and not response.headers.get('content-encoding') else None
+            if expected is not None and not MIN_THUMB_BYTES <= expected <= MAX_DOWNLOAD_BYTES:
+                return False
+            
+            size = 0
+            head = b''
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    if len(head) < MAGIC_BYTES:
+                        head += chunk[:MAGIC_BYTES - len(head)]
+                        if len(head) >= MAGIC_BYTES and sniff_mime(head) is None:
+                            return False
+                    size += len(chunk)
+                    if size > MAX_DOWNLOAD_BYTES:
+                        return False
+                    f.write(chunk)
         
-        content_type = response.headers.get('content-type', '')
-        if 'image' not in content_type and 'octet-stream' not in content_type:
+        if size < MIN_THUMB_BYTES or sniff_mime(head) is None:
             return False
-        
-        with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        if local_path.exists() and local_path.stat().st_size > 500:
-            return True
-        else:
-            local_path.unlink(missing_ok=True)
+        if expected is not None and size != expected:
             return False
+        os.replace(tmp_path, local_path)
+        return True
             
     except Exception:
         return False
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
 
 def collect_queries_from_section(section, queries_set):
@@ -100,90 +149,109 @@ def collect_queries_from_section(section, queries_set):
 
 
 def decode_url(url):
-    """Decode Unicode escapes in URL (e.g., \\u003d → =)."""
-    return url.encode().decode('unicode_escape')
+    """Decode the JSON string escapes in a URL (e.g., \\u003d → =)."""
+    try:
+        return json.loads(f'"{url}"')
+    except ValueError:
+        return url.encode().decode('unicode_escape')
 
 
-def scrape_google_images(query, max_images=6):
+def is_original_candidate(raw_url, height, width):
+    """Cheap filters on a still-encoded original: not Google's own, big enough, an image file."""
+    if 'google.com' in raw_url or 'gstatic.com' in raw_url:
+        return False
+    if height < MIN_ORIGINAL_EDGE or width < MIN_ORIGINAL_EDGE:
+        return False
+    return raw_url.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def parse_image_results(html, max_images=MAX_IMAGES):
     """
-    Scrape Google Images for original URLs and Google's cached thumbnails.
+    Parse a Google Images result page in a single pass.
+    
+    Each result's metadata holds a ["thumbnail", height, width] array
+    immediately followed by ["original", height, width], so a thumbnail is
+    paired with the original that directly follows it rather than by index
+    across two separate scans. Only the URLs that are kept get decoded, and
+    the scan stops once max_images originals are found.
     
-    Returns list of dicts: {original_url, thumbnail_url}
+    Returns list of dicts: {original_url, width, height[, thumbnail_url]}.
+    If no original passes the filters, falls back to the thumbnails as both
+    source and display.
     """
-    url = f'https://www.google.com/search?q={quote_plus(query)}&tbm=isch&hl=en'
+    results = []
+    seen = set()
+    thumbnails = []
+    thumb = None  # (encoded url, end offset) of the last thumbnail array
     
-    try:
-        res = requests.get(url, headers=HEADERS, timeout=10)
-        res.raise_for_status()
-        html = res.text
-        
-        # Get Google's cached thumbnails 
-        # URLs contain Unicode escapes: \u003d = '='
-        # Pattern matches: https://encrypted-tbn0.gstatic.com/images?q\u003dtbn:...
-        thumb_pattern = r'(https://encrypted-tbn\d*\.gstatic\.com/images\?q[^"\'>\s]+)'
-        raw_thumbs = re.findall(thumb_pattern, html)
-        # Decode unicode escapes and dedupe
-        thumbnails = []
-        seen = set()
-        for t in raw_thumbs:
-            decoded = decode_url(t)
-            if decoded not in seen:
-                seen.add(decoded)
-                thumbnails.append(decoded)
-        
-        # Get original image URLs (also have Unicode escapes)
-        # Look for patterns with dimensions: ["url", width, height] or similar
-        orig_pattern = r'\["(https://[^"]+)",\s*(\d+),\s*(\d+)\]'
-        raw_originals = re.findall(orig_pattern, html)
-        
-        # Decode and filter
-        originals = []
-        for raw_url, w, h in raw_originals:
-            url = decode_url(raw_url)
-            # Skip Google's own, small images, and non-image URLs
-            if 'google.com' in url or 'gstatic.com' in url:
-                continue
-            if int(w) < 200 or int(h) < 200:
-                continue
-            if not any(url.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp']):
-                continue
-            originals.append((url, int(w), int(h)))
-        
-        # Pair originals with thumbnails
-        results = []
-        for i, (orig_url, w, h) in enumerate(originals[:max_images]):
-            result = {'original_url': orig_url, 'width': w, 'height': h}
-            if i < len(thumbnails):
-                result['thumbnail_url'] = thumbnails[i]
-            results.append(result)
+    for match in IMAGE_ARRAY_PATTERN.finditer(html):
+        raw_url = match.group(1)
+        if raw_url.startswith(THUMB_PREFIX):
+            thumb = (raw_url, match.end())
+            if len(thumbnails) < max_images and raw_url not in thumbnails:
+                thumbnails.append(raw_url)
+            continue
         
-        # Fallback: if no originals found, use thumbnails as both source and display
-        if not results and thumbnails:
-            for thumb in thumbnails[:max_images]:
-                results.append({
-                    'original_url': thumb,
-                    'thumbnail_url': thumb
-                })
+        # The original belongs to a thumbnail only if nothing separates them but a comma
+        own_thumb = thumb[0] if thumb and match.start() - thumb[1] <= 2 else None
+        thumb = None
+        height, width = int(match.group(2)), int(match.group(3))
+        if not is_original_candidate(raw_url, height, width) or raw_url in seen:
+            continue
+        seen.add(raw_url)
         
+        result = {'original_url': decode_url(raw_url), 'width': width, 'height': height}
+        if own_thumb:
+            result['thumbnail_url'] = decode_url(own_thumb)
+        results.append(result)
+        if len(results) >= max_images:
+            break
+    
+    if results:
         return results
+    
+    # Fallback: thumbnails outside result arrays too
+    if not thumbnails:
+        for raw_url in THUMB_URL_PATTERN.findall(html):
+            if raw_url not in thumbnails:
+                thumbnails.append(raw_url)
+                if len(thumbnails) >= max_images:
+                    break
+    return [{'original_url': decode_url(t), 'thumbnail_url': decode_url(t)} for t in thumbnails]
+
+
+def scrape_google_images(query, max_images=6, log=print):
+    """
+    Scrape Google Images for original URLs and Google's cached thumbnails.
+    
+    Returns list of dicts: {original_url, width, height, thumbnail_url}
+    """
+    url = f'{SEARCH_URL}?q={quote_plus(query)}&tbm=isch&hl=en'
+    
+    try:
+        res = net.get(url, headers=HEADERS)
+        res.raise_for_status()
+        return parse_image_results(res.text, max_images)
         
     except Exception as e:
-        print(f"    ✗ Search error: {e}")
+        log(f"    ✗ Search error: {e}")
         return []
 
 
-def scrape_and_download(query):
+def scrape_and_download(query, log=print):
     """
     Scrape images for a query and save thumbnails locally.
     Returns list of {url, thumbnail} dicts.
+    
+    Progress lines go to `log` so concurrent workers can buffer their output.
     """
-    print(f"  Searching Google Images...")
-    results = scrape_google_images(query, MAX_IMAGES)
+    log(f"  Searching Google Images...")
+    results = scrape_google_images(query, MAX_IMAGES, log=log)
     
     if not results:
         return []
     
-    print(f"  Found {len(results)} images, downloading thumbnails...")
+    log(f"  Found {len(results)} images, downloading thumbnails...")
     
     images = []
     for i, r in enumerate(results):
@@ -194,13 +262,18 @@ def scrape_and_download(query):
         filename = url_to_filename(original_url, query)
         local_path = IMAGES_DIR / filename
         
-        # Skip if already exists
-        if local_path.exists() and local_path.stat().st_size > 500:
+        # Skip if already exists (downloads are renamed into place whole,
+        # so one stat is enough)
+        try:
+            cached = local_path.stat().st_size >= MIN_THUMB_BYTES
+        except OSError:
+            cached = False
+        if cached:
             images.append({
                 'url': original_url,
                 'thumbnail': str(local_path)
             })
-            print(f"    [{i+1}] ✓ cached")
+            log(f"    [{i+1}] ✓ cached")
             continue
         
         saved = False
@@ -209,58 +282,127 @@ def scrape_and_download(query):
         if 'thumbnail_url' in r:
             saved = download_thumbnail(r['thumbnail_url'], local_path)
             if saved:
-                print(f"    [{i+1}] ✓ google thumb")
+                log(f"    [{i+1}] ✓ google thumb")
         
         # Fallback to original (larger, slower)
         if not saved:
             saved = download_thumbnail(original_url, local_path)
             if saved:
-                print(f"    [{i+1}] ✓ original")
+                log(f"    [{i+1}] ✓ original")
             else:
-                print(f"    [{i+1}] ✗ failed")
+                log(f"    [{i+1}] ✗ failed")
         
         if saved:
             images.append({
                 'url': original_url,
                 'thumbnail': str(local_path)
             })
-        
-        time.sleep(0.1)
-    
-    print(f"  → {len(images)} thumbnails saved")
+
+    log(f"  → {len(images)} thumbnails saved")
     return images
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python scraper.py travel.analysis.yaml")
-        sys.exit(1)
+def normalize_images(images, pool=None):
+    """
+    Normalize downloaded thumbnails and record their format and size.
     
-    analysis_file = Path(sys.argv[1])
-    if not analysis_file.exists():
-        print(f"Error: {analysis_file} not found")
-        sys.exit(1)
+    Adds mime, thumb_bytes and thumb_width/thumb_height to each image entry.
+    Thumbnails that turn out not to be images are deleted and dropped.
+    """
+    infos = normalize_thumbnails([img['thumbnail'] for img in images], pool)
+    normalized = []
+    for img, info in zip(images, infos):
+        if info is None:
+            Path(img['thumbnail']).unlink(missing_ok=True)
+            continue
+        img.update(info)
+        normalized.append(img)
+    return normalized
+
+
+def scrape_queries(queries, cache, workers=DEFAULT_WORKERS, on_query=None):
+    """
+    Scrape queries on a bounded worker pool, updating the cache as each completes.
     
-    ensure_images_dir()
+    Each worker buffers its progress lines, which are printed as one block when
+    the query finishes so output from concurrent queries doesn't interleave.
+    Queries that raise are left out of the cache so they are retried next run.
+    Each finished query's thumbnails are normalized on a process pool while
+    the download threads carry on with other queries. on_query(query) is
+    called as each query finishes, whether or not it succeeded.
+    """
+    total = len(queries)
+    normalizer = make_pool()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {}
+            for query in queries:
+                lines = []
+                future = pool.submit(scrape_and_download, query, lines.append)
+                futures[future] = (query, lines)
+            
+            for i, future in enumerate(as_completed(futures), 1):
+                query, lines = futures[future]
+                print(f"\n[{i}/{total}] {query}")
+                for line in lines:
+                    print(line)
+                
+                try:
+                    images = normalize_images(future.result(), normalizer)
+                except Exception as e:
+                    print(f"  ✗ Failed: {e}")
+                else:
+                    if not images and (cache.get(query) or {}).get('images'):
+                        # Refreshing an expired entry found nothing: keep the
+                        # old images (still expired, so retried next run)
+                        print("  ⚠ No images found, keeping the cached ones")
+                    else:
+                        # Single-row write; the rest of the cache is untouched
+                        cache[query] = {
+                            'images': images,
+                            'scraped_at': datetime.now().isoformat()
+                        }
+                if on_query:
+                    on_query(query)
+    finally:
+        if normalizer is not None:
+            normalizer.shutdown()
+
+
+def collect_analysis_queries(analysis, queries_set=None):
+    """Collect every query in an analysis (into queries_set if given)."""
+    if queries_set is None:
+        queries_set = set()
+    for section in analysis.get('sections', []):
+        collect_queries_from_section(section, queries_set)
+    return queries_set
+
+
+def scrape_analysis(analysis, cache, workers=DEFAULT_WORKERS):
+    """
+    Scrape every query in an analysis that the cache doesn't have images for.
     
-    with open(analysis_file, 'r') as f:
-        analysis = yaml.safe_load(f)
+    Returns the number of queries scraped.
+    """
+    return scrape_query_set(collect_analysis_queries(analysis), cache, workers=workers)
+
+
+def scrape_query_set(all_queries, cache, workers=DEFAULT_WORKERS, on_query=None):
+    """
+    Scrape the queries in all_queries that the cache doesn't have images for.
     
-    cache = load_cache()
-    print(f"\n✓ Loaded cache: {len(cache)} queries")
+    on_query(query) is called as each scraped query finishes.
     
-    all_queries = set()
-    for section in analysis.get('sections', []):
-        collect_queries_from_section(section, all_queries)
+    Returns the number of queries scraped.
+    """
+    ensure_images_dir()
     
     print(f"✓ Found {len(all_queries)} unique queries")
     
     # Check which need processing
     queries_to_process = []
     for q in all_queries:
-        if q not in cache:
-            queries_to_process.append(q)
-        elif 'images' not in cache[q]:
+        if cache.needs_scrape(q):
             queries_to_process.append(q)
     
     cached = len(all_queries) - len(queries_to_process)
@@ -269,31 +411,53 @@ def main():
     
     if not queries_to_process:
         print("\n✓ All queries have thumbnails!")
-        return
+        return 0
+    
+    # One keep-alive connection per worker per host; later calls reuse the session
+    net.ensure_pool_size(workers)
     
-    print(f"\nProcessing {len(queries_to_process)} queries...")
+    print(f"\nProcessing {len(queries_to_process)} queries ({workers} workers)...")
     print("="*60)
     
-    for i, query in enumerate(queries_to_process, 1):
-        print(f"\n[{i}/{len(queries_to_process)}] {query}")
-        
-        images = scrape_and_download(query)
-        
-        cache[query] = {
-            'images': images,
-            'scraped_at': datetime.now().isoformat()
-        }
-        
-        save_cache(cache)
-        
-        if i < len(queries_to_process):
-            time.sleep(1.5)  # Rate limit
+    scrape_queries(queries_to_process, cache, workers=workers, on_query=on_query)
     
     total_images = sum(len(c.get('images', [])) for c in cache.values())
     
     print("\n" + "="*60)
     print(f"✓ Done! {len(cache)} queries, {total_images} thumbnails")
     print(f"  Thumbnails: {IMAGES_DIR}/")
+    return len(queries_to_process)
+
+
+def main():
+    workers = DEFAULT_WORKERS
+    args = []
+    argv = iter(sys.argv[1:])
+    for a in argv:
+        if a == '--workers':
+            workers = int(next(argv, DEFAULT_WORKERS))
+        elif a.startswith('--workers='):
+            workers = int(a.split('=', 1)[1])
+        else:
+            args.append(a)
+    
+    if len(args) < 1:
+        print("Usage: python scraper.py travel.analysis.yaml [--workers N]")
+        print("\nOptions:")
+        print(f"  --workers N    Concurrent queries (default: {DEFAULT_WORKERS}, 1 = serial)")
+        sys.exit(1)
+    
+    analysis_file = Path(args[0])
+    if not analysis_file.exists():
+        print(f"Error: {analysis_file} not found")
+        sys.exit(1)
+    
+    with open(analysis_file, 'r') as f:
+        analysis = yaml.safe_load(f)
+    
+    with load_cache() as cache:
+        print(f"\n✓ Loaded cache: {len(cache)} queries")
+        scrape_analysis(analysis, cache, workers=workers)
 
 
 if __name__ == '__main__':
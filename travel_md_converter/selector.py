@@ -3,44 +3,71 @@
 Step B2: Use Gemini Vision to select best images for each section.
 
 Usage:
-    python travel_md_converter/selector.py travel.analysis.yaml
+    python travel_md_converter/selector.py travel.analysis.yaml [--force] [--batch] [--workers N] [--no-cache]
 
 Reads analysis file and image cache, sends thumbnails to Gemini Vision,
 asks AI to pick the best images for each section context.
 Updates analysis.yaml with selected_images field.
+
+With --batch, several sections' candidates are packed into one request and
+the model answers with a JSON object keyed by section number.
+
+Selections run on a pool of --workers threads (default 4) sharing one
+Gemini client; results are written back in document order.
+
+SelectionScheduler lets the pipeline start each section's selection as soon
+as its queries are scraped, overlapping scraping and selection.
+
+Answers are also stored in a content-addressed selection cache (see
+cache.SelectionCache) keyed by title, style, candidate thumbnails and
+PROMPT_VERSION, so --force or a re-analysis only pays for sections whose
+candidates changed. --no-cache bypasses it.
 """
 
 import yaml
 import sys
 import os
-import base64
+import re
+import json
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from cache import load_cache, SelectionCache, selection_key
+import gemini
+from thumbnails import read_thumbnail, cache_stats, sniff_mime, HashIndex
 
-CACHE_FILE = 'query_cache.yaml'
+MODEL = 'gemini-2.0-flash-exp'
 
+# Bump when the selection prompts change, to invalidate cached selections
+PROMPT_VERSION = 1
 
-def load_cache():
-    """Load image cache."""
-    cache_path = Path(CACHE_FILE)
-    if cache_path.exists():
-        with open(cache_path, 'r') as f:
-            return yaml.safe_load(f) or {}
-    return {}
+# Limits for --batch: a batch is closed once adding a section would exceed
+# any of these, and a section that exceeds them alone is sent by itself.
+MAX_BATCH_SECTIONS = 8
+MAX_BATCH_IMAGES = 48
+MAX_BATCH_BYTES = 4 * 1024 * 1024
 
+DEFAULT_WORKERS = 4
 
-def load_image_as_base64(image_path):
-    """Load image file and return base64 encoded data."""
-    try:
-        with open(image_path, 'rb') as f:
-            return base64.b64encode(f.read()).decode('utf-8')
-    except Exception as e:
-        return None
+STYLE_GUIDANCE = {
+    'hero': 'dramatic, wide landscape or cityscape, high quality, would work as full-screen background',
+    'gallery': 'variety of angles, showcase the location, visually interesting',
+    'cards': 'clear subject, good composition, would work as a card thumbnail',
+    'day': 'represents the activity or location for that day, action shots good',
+    'content': 'relevant to the text content, informative',
+    'highlight': 'attention-grabbing, relevant to the highlighted topic',
+}
 
 
 def get_images_for_queries(queries, cache):
-    """Get all images (with thumbnails) for a list of queries, deduped by URL."""
+    """
+    Get all images (with thumbnails) for a list of queries, deduped by URL.
+    
+    Near-duplicates (the same picture hosted on several sites, detected by
+    the dhash recorded at scrape time) are collapsed to the first one seen.
+    """
     images = []
     seen_urls = set()
+    seen_hashes = HashIndex()
     
     for query in queries:
         if query in cache and 'images' in cache[query]:
@@ -52,71 +79,125 @@ def get_images_for_queries(queries, cache):
                 seen_urls.add(url)
                 
                 if img.get('thumbnail') and Path(img['thumbnail']).exists():
+                    phash = img.get('dhash')
+                    if phash:
+                        if seen_hashes.find(phash) is not None:
+                            continue
+                        seen_hashes.add(phash, url)
                     images.append({
                         'url': url,
                         'thumbnail': img['thumbnail'],
+                        'mime': img.get('mime'),
                         'query': query
                     })
     return images
 
 
-def select_images_with_gemini(section_title, section_style, images, num_select=3):
+def make_client():
     """
-    Use Gemini Vision to select the best images for a section.
-    
-    Args:
-        section_title: Title of the section
-        section_style: Style type (hero, gallery, cards, etc.)
-        images: List of {url, thumbnail, query} dicts
-        num_select: Number of images to select
-        
-    Returns:
-        List of selected image URLs (original, not thumbnails)
+    Get the shared Gemini client, or None if google-genai or the API key is missing.
     """
     try:
-        from google import genai
-        from google.genai import types
+        client = gemini.get_client()
     except ImportError:
         print("  ⚠ google-genai not installed, using first images as fallback")
-        return [img['url'] for img in images[:num_select]]
+        return None
     
-    api_key = os.environ.get('GEMINI_API_KEY')
-    if not api_key:
+    if client is None:
         print("  ⚠ No GEMINI_API_KEY, using first images as fallback")
-        return [img['url'] for img in images[:num_select]]
+    return client
+
+
+def load_image_parts(images):
+    """
+    Load thumbnails as Gemini image parts.
     
-    if not images:
-        return []
+    Returns (parts, valid_images), skipping thumbnails that can't be read.
+    Raw bytes come from the shared thumbnail LRU, so candidates that appear
+    in several sections are only read from disk once.
+    """
+    from google.genai import types
     
-    # Prepare image data for Gemini
     image_parts = []
     valid_images = []
-    
-    for i, img in enumerate(images):
-        img_data = load_image_as_base64(img['thumbnail'])
+    for img in images:
+        img_data = read_thumbnail(img['thumbnail'])
         if img_data:
+            # Recorded at scrape time; sniff older entries that predate it
+            mime = img.get('mime') or sniff_mime(img_data) or 'image/jpeg'
             image_parts.append(
                 types.Part.from_bytes(
-                    data=base64.b64decode(img_data),
-                    mime_type='image/jpeg'
+                    data=img_data,
+                    mime_type=mime
                 )
             )
             valid_images.append(img)
+    return image_parts, valid_images
+
+
+def pick_selection(numbers, valid_images, num_select):
+    """
+    Turn 1-based image numbers from the model into selected URLs.
+    
+    Invalid and repeated numbers are ignored; if too few remain, the
+    selection is padded with the remaining images in order.
+    """
+    selected_indices = []
+    for num in numbers:
+        idx = int(num) - 1  # Convert to 0-based
+        if 0 <= idx < len(valid_images) and idx not in selected_indices:
+            selected_indices.append(idx)
+            if len(selected_indices) >= num_select:
+                break
+    
+    # Return original URLs for selected images
+    selected_urls = [valid_images[i]['url'] for i in selected_indices]
+    
+    # If we didn't get enough, pad with remaining images
+    if len(selected_urls) < num_select:
+        for img in valid_images:
+            if img['url'] not in selected_urls:
+                selected_urls.append(img['url'])
+                if len(selected_urls) >= num_select:
+                    break
+    
+    return selected_urls
+
+
+def select_images_with_gemini(section_title, section_style, images, num_select=3, client=None,
+                              raise_errors=False):
+    """
+    Use Gemini Vision to select the best images for a section.
+    
+    Args:
+        section_title: Title of the section
+        section_style: Style type (hero, gallery, cards, etc.)
+        images: List of {url, thumbnail, query} dicts
+        num_select: Number of images to select
+        client: Gemini client (created from GEMINI_API_KEY if not given)
+        raise_errors: Raise API errors instead of falling back to the first images
+    
+    Returns:
+        List of selected image URLs (original, not thumbnails)
+    """
+    if client is None:
+        client = make_client()
+        if client is None:
+            return [img['url'] for img in images[:num_select]]
+    
+    if not images:
+        return []
+    
+    from google.genai import types
+    
+    # Prepare image data for Gemini
+    image_parts, valid_images = load_image_parts(images)
     
     if not valid_images:
         return []
     
     # Build prompt for Gemini
-    style_guidance = {
-        'hero': 'dramatic, wide landscape or cityscape, high quality, would work as full-screen background',
-        'gallery': 'variety of angles, showcase the location, visually interesting',
-        'cards': 'clear subject, good composition, would work as a card thumbnail',
-        'day': 'represents the activity or location for that day, action shots good',
-        'content': 'relevant to the text content, informative',
-        'highlight': 'attention-grabbing, relevant to the highlighted topic',
-    }
-    
-    style_hint = style_guidance.get(section_style, 'high quality, relevant to the content')
+    style_hint = STYLE_GUIDANCE.get(section_style, 'high quality, relevant to the content')
     
     prompt = f"""You are selecting images for a travel document section.
 
@@ -135,19 +216,18 @@ Return ONLY a comma-separated list of image numbers, best first.
 Example: 2, 5, 1
 
 Your selection:"""
-
+    
     try:
-        client = genai.Client(api_key=api_key)
-        
         # Build content with images and prompt
         content_parts = []
         for i, part in enumerate(image_parts):
-            content_parts.append(types.Part.from_text(f"Image {i+1}:"))
+            content_parts.append(types.Part.from_text(text=f"Image {i+1}:"))
             content_parts.append(part)
-        content_parts.append(types.Part.from_text(prompt))
+        content_parts.append(types.Part.from_text(text=prompt))
         
-        response = client.models.generate_content(
-            model='gemini-2.0-flash-exp',
+        response = gemini.generate_content(
+            client,
+            model=MODEL,
             contents=content_parts,
             config=types.GenerateContentConfig(
                 temperature=0.1,  # Low temperature for consistent selection
@@ -156,37 +236,140 @@ Your selection:"""
         )
         
         # Parse response to get image indices
-        response_text = response.text.strip()
-        
-        # Extract numbers from response
-        import re
-        numbers = re.findall(r'\d+', response_text)
-        selected_indices = []
-        for num in numbers:
-            idx = int(num) - 1  # Convert to 0-based
-            if 0 <= idx < len(valid_images) and idx not in selected_indices:
-                selected_indices.append(idx)
-                if len(selected_indices) >= num_select:
-                    break
-        
-        # Return original URLs for selected images
-        selected_urls = [valid_images[i]['url'] for i in selected_indices]
-        
-        # If we didn't get enough, pad with remaining images
-        if len(selected_urls) < num_select:
-            for img in valid_images:
-                if img['url'] not in selected_urls:
-                    selected_urls.append(img['url'])
-                    if len(selected_urls) >= num_select:
-                        break
-        
-        return selected_urls
-        
+        numbers = re.findall(r'\d+', response.text.strip())
+        return pick_selection(numbers, valid_images, num_select)
+    
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"  ⚠ Gemini error: {e}")
         return [img['url'] for img in valid_images[:num_select]]
 
 
+def thumbnail_bytes(images):
+    """Total on-disk size of a list of candidate thumbnails."""
+    total = 0
+    for img in images:
+        try:
+            total += os.path.getsize(img['thumbnail'])
+        except OSError:
+            pass
+    return total
+
+
+def plan_batches(jobs):
+    """
+    Group selection jobs into batches within the MAX_BATCH_* limits.
+    
+    Keeps job order. A job that exceeds the limits on its own ends up in a
+    batch of one, which is sent as a regular per-section request.
+    """
+    batches = []
+    current = []
+    current_images = 0
+    current_bytes = 0
+    
+    for job in jobs:
+        job_images = len(job['images'])
+        job_bytes = thumbnail_bytes(job['images'])
+        if current and (
+            len(current) >= MAX_BATCH_SECTIONS
+            or current_images + job_images > MAX_BATCH_IMAGES
+            or current_bytes + job_bytes > MAX_BATCH_BYTES
+        ):
+            batches.append(current)
+            current, current_images, current_bytes = [], 0, 0
+        current.append(job)
+        current_images += job_images
+        current_bytes += job_bytes
+    
+    if current:
+        batches.append(current)
+    return batches
+
+
+def select_images_batch(jobs, client):
+    """
+    Select images for several sections in a single Gemini request.
+    
+    Each job is a dict with title, style, images and num_select. The model
+    answers with JSON mapping section numbers to image numbers. Returns one
+    list of selected URLs per job, in job order, with None for sections
+    missing from the answer (or for all of them if the answer is unusable).
+    """
+    from google.genai import types
+    
+    content_parts = []
+    section_lines = []
+    valid_per_job = []
+    
+    for n, job in enumerate(jobs, 1):
+        image_parts, valid_images = load_image_parts(job['images'])
+        valid_per_job.append(valid_images)
+        if not valid_images:
+            continue
+        
+        for i, part in enumerate(image_parts):
+            content_parts.append(types.Part.from_text(text=f"Section {n}, image {i+1}:"))
+            content_parts.append(part)
+        
+        style = job['style']
+        style_hint = STYLE_GUIDANCE.get(style, 'high quality, relevant to the content')
+        count = min(job['num_select'], len(valid_images))
+        section_lines.append(
+            f'Section {n}: "{job["title"]}" - style {style} ({style_hint}). '
+            f'{len(valid_images)} candidates; select the {count} best.'
+        )
+    
+    prompt = f"""You are selecting images for several sections of a travel document.
+Each section has its own numbered candidate images shown above.
+
+{chr(10).join(section_lines)}
+
+For each section consider:
+- Relevance to the section title
+- Visual quality (no watermarks, good resolution, good composition)
+- Appropriateness for the section's style
+- No duplicate/similar images
+
+Return ONLY a JSON object mapping each section number to a list of its
+image numbers, best first.
+Example: {{"1": [2, 5, 1], "2": [3, 1]}}"""
+    
+    answer = {}
+    if section_lines:
+        content_parts.append(types.Part.from_text(text=prompt))
+        try:
+            response = gemini.generate_content(
+                client,
+                model=MODEL,
+                contents=content_parts,
+                config=types.GenerateContentConfig(
+                    temperature=0.1,
+                    max_output_tokens=50 * len(jobs),
+                    response_mime_type='application/json',
+                )
+            )
+            answer = json.loads(response.text)
+            if not isinstance(answer, dict):
+                answer = {}
+        except Exception as e:
+            print(f"  ⚠ Gemini batch error: {e}")
+    
+    results = []
+    for n, (job, valid_images) in enumerate(zip(jobs, valid_per_job), 1):
+        numbers = answer.get(str(n))
+        if not valid_images:
+            results.append([])
+        elif isinstance(numbers, list):
+            results.append(pick_selection(
+                [x for x in numbers if isinstance(x, int)], valid_images, job['num_select']
+            ))
+        else:
+            results.append(None)
+    return results
+
+
 def collect_queries_for_section(section):
     """Collect all queries for a section (including nested)."""
     queries = list(section.get('queries', []))
@@ -198,12 +381,42 @@ def collect_queries_for_section(section):
     return queries
 
 
-def process_section(section, cache, depth=0, force=False):
+def add_job(jobs, target, title, style, images, num_select, label, selections=None):
     """
-    Process a section and its subsections to select images.
-    Modifies section in place to add selected_images.
+    Queue a selection job, or fill it straight from the selection cache.
+    
+    Jobs carry a content-addressed `key` so run_selection_jobs can store
+    the answer; with selections=None the cache is bypassed.
+    """
+    key = None
+    if selections is not None:
+        key = selection_key(title, style, num_select, images, PROMPT_VERSION)
+        cached = selections.get(key) if key else None
+        if cached is not None:
+            target['selected_images'] = cached
+            print(f"{label} ✓ reused selection")
+            return
+    
+    jobs.append({
+        'target': target,
+        'title': title,
+        'style': style,
+        'images': images,
+        'num_select': num_select,
+        'label': label,
+        'key': key,
+    })
+
+
+def collect_selection_targets(section, targets, depth=0, force=False):
+    """
+    Walk a section and its subsections, collecting what needs an image selection.
     
-    Skips sections that already have selected_images (cached).
+    Each target is a dict: target (the section or itinerary item to update),
+    title, style, queries, num_select, label and indent (for progress
+    output) and is_item. Sections with nothing to select get an empty selected_images
+    directly; sections that already have selected_images are skipped
+    unless force.
     """
     indent = "  " * depth
     title = section.get('title', 'Untitled')
@@ -218,17 +431,16 @@ def process_section(section, cache, depth=0, force=False):
         queries = collect_queries_for_section(section)
         
         if queries:
-            print(f"{indent}[{style}] {title}")
-            images = get_images_for_queries(queries, cache)
-            
-            if images:
-                print(f"{indent}  Found {len(images)} candidate images")
-                selected = select_images_with_gemini(title, style, images, num_select=3)
-                section['selected_images'] = selected
-                print(f"{indent}  → Selected {len(selected)} images")
-            else:
-                print(f"{indent}  No thumbnails available")
-                section['selected_images'] = []
+            targets.append({
+                'target': section,
+                'title': title,
+                'style': style,
+                'queries': queries,
+                'num_select': 3,
+                'label': f"{indent}[{style}] {title}",
+                'indent': indent,
+                'is_item': False,
+            })
         else:
             section['selected_images'] = []
     else:
@@ -246,25 +458,218 @@ def process_section(section, cache, depth=0, force=False):
             continue
         
         if item_queries:
-            images = get_images_for_queries(item_queries, cache)
-            if images:
-                print(f"{indent}  Day: {item_title}")
-                selected = select_images_with_gemini(
-                    f"{title} - {item_title}", 
-                    'day', 
-                    images, 
-                    num_select=2
-                )
-                item['selected_images'] = selected
-                print(f"{indent}    → Selected {len(selected)} images")
-            else:
-                item['selected_images'] = []
+            targets.append({
+                'target': item,
+                'title': f"{title} - {item_title}",
+                'style': 'day',
+                'queries': item_queries,
+                'num_select': 2,
+                'label': f"{indent}  Day: {item_title}",
+                'indent': indent,
+                'is_item': True,
+            })
         else:
             item['selected_images'] = []
     
     # Process subsections recursively
     for subsection in section.get('subsections', []):
-        process_section(subsection, cache, depth + 1, force=force)
+        collect_selection_targets(subsection, targets, depth + 1, force=force)
+    
+    return targets
+
+
+def add_target_job(target, cache, jobs, selections=None):
+    """Look up a target's candidates and queue its job (or fill it directly)."""
+    images = get_images_for_queries(target['queries'], cache)
+    if images:
+        add_job(jobs, target['target'], target['title'], target['style'], images,
+                target['num_select'], f"{target['label']} ({len(images)} candidates)", selections)
+        return
+    if not target['is_item']:
+        print(target['label'])
+        print(f"{target['indent']}  No thumbnails available")
+    target['target']['selected_images'] = []
+
+
+def collect_selection_jobs(section, cache, jobs, depth=0, force=False, selections=None):
+    """
+    Walk a section and its subsections, collecting image selection jobs.
+    
+    Each job is a dict: target (the section or itinerary item to update),
+    title, style, images, num_select, label (for progress output) and key.
+    Sections with nothing to select get an empty selected_images directly;
+    sections that already have selected_images are skipped unless force.
+    Sections whose candidates match a cached selection are filled from
+    `selections` (a SelectionCache) without a job.
+    """
+    for target in collect_selection_targets(section, [], depth, force=force):
+        add_target_job(target, cache, jobs, selections)
+    return jobs
+
+
+def run_single_job(job, client):
+    """
+    Run one job as a per-section request.
+    
+    Returns (selected_urls, answered); answered is False when the API failed
+    and the first images were used instead, so the result isn't cached.
+    """
+    try:
+        return select_images_with_gemini(
+            job['title'], job['style'], job['images'], job['num_select'],
+            client=client, raise_errors=True
+        ), True
+    except Exception as e:
+        print(f"  ⚠ Gemini error: {e}")
+        return [img['url'] for img in job['images'][:job['num_select']]], False
+
+
+def run_selection_batch(batch_jobs, client):
+    """
+    Run one batch of jobs; returns one (selected_urls, answered) per job.
+    
+    Sections a batched request didn't answer are retried one at a time.
+    """
+    if len(batch_jobs) == 1:
+        return [run_single_job(batch_jobs[0], client)]
+    
+    results = []
+    for job, selected in zip(batch_jobs, select_images_batch(batch_jobs, client)):
+        if selected is None:
+            results.append(run_single_job(job, client))
+        else:
+            results.append((selected, True))
+    return results
+
+
+def fallback_selection(jobs):
+    """Without a client, use each job's first images."""
+    for job in jobs:
+        job['target']['selected_images'] = [img['url'] for img in job['images'][:job['num_select']]]
+
+
+def apply_results(batch_jobs, results, selections=None):
+    """Write one batch's results into its targets, caching answered selections."""
+    if len(batch_jobs) > 1:
+        print(f"\n  Batch of {len(batch_jobs)} sections")
+    for job, (selected, answered) in zip(batch_jobs, results):
+        job['target']['selected_images'] = selected
+        if answered and selections is not None and job.get('key'):
+            selections.put(job['key'], selected)
+        print(f"{job['label']} → Selected {len(selected)} images")
+
+
+def run_selection_jobs(jobs, batch=False, workers=DEFAULT_WORKERS, selections=None):
+    """
+    Run selection jobs and write selected_images back into their targets.
+    
+    With batch=True, jobs are grouped by plan_batches and each group of two
+    or more is sent as one request. Requests run concurrently on `workers`
+    threads; results are written back (and reported) in job order, so the
+    analysis tree is updated deterministically. Answered selections are
+    stored in `selections` (a SelectionCache) when given.
+    """
+    client = make_client()
+    
+    if client is None:
+        fallback_selection(jobs)
+        return
+    
+    batches = plan_batches(jobs) if batch else [[job] for job in jobs]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(run_selection_batch, batch_jobs, client) for batch_jobs in batches]
+        
+        for batch_jobs, future in zip(batches, futures):
+            apply_results(batch_jobs, future.result(), selections)
+
+
+class SelectionScheduler:
+    """
+    Starts each selection as soon as the queries it needs are scraped.
+    
+    Sections and itinerary items are mapped to their queries
+    (collect_queries_for_section); those waiting on a query in `pending`
+    are held back until query_done() has been called for all of them, then
+    their jobs go to the worker pool while other queries are still being
+    scraped. finish() dispatches anything still waiting (e.g. on a failed
+    query), waits, and writes results back in dispatch order.
+    """
+    
+    def __init__(self, sections, cache, pending, force=False, batch=False,
+                 workers=DEFAULT_WORKERS, selections=None):
+        self.cache = cache
+        self.batch = batch
+        self.selections = selections
+        self.client = make_client()
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.dispatched = []  # (batch_jobs, future)
+        self.jobs = 0
+        
+        self.targets = []
+        for section in sections:
+            collect_selection_targets(section, self.targets, force=force)
+        
+        self.outstanding = []  # per target: queries not scraped yet
+        self.waiting = {}  # query -> indexes of targets waiting on it
+        ready = []
+        for i, target in enumerate(self.targets):
+            needs = {q for q in target['queries'] if q in pending}
+            self.outstanding.append(needs)
+            for q in needs:
+                self.waiting.setdefault(q, []).append(i)
+            if not needs:
+                ready.append(target)
+        self._dispatch(ready)
+    
+    def query_done(self, query):
+        """Record that a query finished scraping (successfully or not)."""
+        ready = []
+        for i in self.waiting.pop(query, []):
+            self.outstanding[i].discard(query)
+            if not self.outstanding[i]:
+                ready.append(self.targets[i])
+        self._dispatch(ready)
+    
+    def _dispatch(self, targets):
+        jobs = []
+        for target in targets:
+            add_target_job(target, self.cache, jobs, self.selections)
+        self.jobs += len(jobs)
+        if self.client is None:
+            fallback_selection(jobs)
+            return
+        batches = plan_batches(jobs) if self.batch else [[job] for job in jobs]
+        for batch_jobs in batches:
+            future = self.pool.submit(run_selection_batch, batch_jobs, self.client)
+            self.dispatched.append((batch_jobs, future))
+    
+    def finish(self):
+        """Dispatch targets still waiting, wait for every job, and write results back. Returns the number of targets."""
+        leftover = [t for t, needs in zip(self.targets, self.outstanding) if needs]
+        for needs in self.outstanding:
+            needs.clear()
+        self.waiting.clear()
+        self._dispatch(leftover)
+        
+        try:
+            for batch_jobs, future in self.dispatched:
+                apply_results(batch_jobs, future.result(), self.selections)
+        finally:
+            self.pool.shutdown()
+        return len(self.targets)
+
+
+def process_section(section, cache, depth=0, force=False, batch=False, workers=DEFAULT_WORKERS,
+                    selections=None):
+    """
+    Process a section and its subsections to select images.
+    Modifies section in place to add selected_images.
+    
+    Skips sections that already have selected_images (cached), and checks
+    the content-addressed selection cache before calling the API.
+    """
+    jobs = collect_selection_jobs(section, cache, [], depth, force=force, selections=selections)
+    run_selection_jobs(jobs, batch=batch, workers=workers, selections=selections)
 
 
 def count_selections(sections):
@@ -287,15 +692,81 @@ def count_selections(sections):
     return cached, total
 
 
+def select_for_analysis(analysis, cache, force=False, batch=False, workers=DEFAULT_WORKERS,
+                        selections=None):
+    """
+    Select images for every section of an analysis, updating it in place.
+    
+    Returns True if the analysis was updated (and needs saving), False if
+    every section already had selections. Raises RuntimeError if the cache
+    has no thumbnails at all.
+    """
+    # Check for thumbnails
+    total_thumbnails = sum(
+        len([img for img in c.get('images', []) if img.get('thumbnail')])
+        for c in cache.values()
+    )
+    print(f"✓ Found {total_thumbnails} thumbnails available")
+    
+    if total_thumbnails == 0:
+        raise RuntimeError("No thumbnails found! Run scraper.py first.")
+    
+    # Check existing selections
+    cached, total = count_selections(analysis.get('sections', []))
+    print(f"✓ Selections: {cached}/{total} already cached")
+    
+    if cached == total and not force:
+        print("\n✓ All sections already have selections! Use --force to re-select.")
+        return False
+    
+    if force:
+        print("\n⚠ Force mode: re-selecting all images")
+    
+    # Collect every section's selection job, then run them (batched or not)
+    print(f"\nSelecting best images...")
+    print("="*70)
+    
+    jobs = []
+    for section in analysis.get('sections', []):
+        collect_selection_jobs(section, cache, jobs, force=force, selections=selections)
+    
+    print(f"\n{len(jobs)} selections to make ({workers} workers)")
+    run_selection_jobs(jobs, batch=batch, workers=workers, selections=selections)
+    
+    hits, misses, _ = cache_stats()
+    print(f"\n  Thumbnail reads: {misses} from disk, {hits} from memory")
+    return True
+
+
+def save_analysis(analysis, analysis_file):
+    """Write the analysis YAML with its selections."""
+    with open(analysis_file, 'w') as f:
+        yaml.dump(analysis, f, default_flow_style=False, sort_keys=False, allow_unicode=True)
+
+
 def main():
     # Parse args
     force = '--force' in sys.argv
-    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    batch = '--batch' in sys.argv
+    use_selection_cache = '--no-cache' not in sys.argv
+    workers = DEFAULT_WORKERS
+    args = []
+    argv = iter(sys.argv[1:])
+    for a in argv:
+        if a == '--workers':
+            workers = int(next(argv, DEFAULT_WORKERS))
+        elif a.startswith('--workers='):
+            workers = int(a.split('=', 1)[1])
+        elif not a.startswith('--'):
+            args.append(a)
     
     if len(args) < 1:
-        print("Usage: python selector.py travel.analysis.yaml [--force]")
+        print("Usage: python selector.py travel.analysis.yaml [--force] [--batch] [--workers N] [--no-cache]")
         print("\nOptions:")
-        print("  --force    Re-select all images (ignore cache)")
+        print("  --force        Re-select all images (ignore selections in the YAML)")
+        print("  --no-cache     Don't reuse selections from the selection cache")
+        print("  --batch        Select images for several sections per request")
+        print(f"  --workers N    Concurrent requests (default: {DEFAULT_WORKERS}, 1 = serial)")
         sys.exit(1)
     
     analysis_file = Path(args[0])
@@ -312,38 +783,26 @@ def main():
     cache = load_cache()
     print(f"✓ Loaded cache: {len(cache)} queries")
     
-    # Check for thumbnails
-    total_thumbnails = sum(
-        len([img for img in c.get('images', []) if img.get('thumbnail')])
-        for c in cache.values()
-    )
-    print(f"✓ Found {total_thumbnails} thumbnails available")
+    selections = SelectionCache() if use_selection_cache else None
+    if selections is not None:
+        print(f"✓ Selection cache: {len(selections)} selections")
     
-    if total_thumbnails == 0:
-        print("\n⚠ No thumbnails found! Run scraper.py first.")
+    try:
+        updated = select_for_analysis(analysis, cache, force=force, batch=batch,
+                                      workers=workers, selections=selections)
+    except RuntimeError as e:
+        print(f"\n⚠ {e}")
         sys.exit(1)
+    finally:
+        cache.close()
+        if selections is not None:
+            selections.close()
     
-    # Check existing selections
-    cached, total = count_selections(analysis.get('sections', []))
-    print(f"✓ Selections: {cached}/{total} already cached")
-    
-    if cached == total and not force:
-        print("\n✓ All sections already have selections! Use --force to re-select.")
+    if not updated:
         return
     
-    if force:
-        print("\n⚠ Force mode: re-selecting all images")
-    
-    # Process each section
-    print(f"\nSelecting best images...")
-    print("="*70)
-    
-    for section in analysis.get('sections', []):
-        process_section(section, cache, force=force)
-    
     # Save updated analysis
-    with open(analysis_file, 'w') as f:
-        yaml.dump(analysis, f, default_flow_style=False, sort_keys=False, allow_unicode=True)
+    save_analysis(analysis, analysis_file)
     
     print("\n" + "="*70)
     print(f"✓ Updated: {analysis_file}")
@@ -351,6 +810,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
-
-
@@ -3,17 +3,19 @@ HTML rendering functions for different section types.
 CSS is loaded from styles.css for better maintainability.
 """
 
+import functools
 import re
 import html as html_module
 from pathlib import Path
 from utils import markdown_to_html, process_inline_markdown, extract_first_sentence
 
+CSS_PATH = Path(__file__).parent / 'styles.css'
+
 
 def get_css():
     """Load CSS from external file for better maintainability."""
-    css_path = Path(__file__).parent / 'styles.css'
-    if css_path.exists():
-        return css_path.read_text()
+    if CSS_PATH.exists():
+        return CSS_PATH.read_text()
     # Fallback - return empty string if file not found
     return "/* styles.css not found */"
 
@@ -48,7 +50,46 @@ def safe_img_url(url):
     return html_module.escape(clean_url(url))
 
 
-def render_hero(title, content, images):
+def emits(render):
+    """
+    Let a render function write into a shared list of HTML parts.
+    
+    The decorated function appends its HTML to `out`. Called with out=...
+    it writes into the caller's list and returns None; called without, it
+    returns the HTML as a string, as before. Nested renderers pass the same
+    list down, so a page is joined once instead of concatenated per level.
+    """
+    @functools.wraps(render)
+    def wrapper(*args, out=None, **kwargs):
+        if out is not None:
+            render(*args, out=out, **kwargs)
+            return None
+        parts = []
+        render(*args, out=parts, **kwargs)
+        return ''.join(parts)
+    return wrapper
+
+
+@emits
+def image_tags(urls, indent='', out=None):
+    """Append one <img> line per URL."""
+    for url in urls:
+        out.append(f'{indent}<img src="{safe_img_url(url)}" alt="" onerror="this.style.display=\'none\'">\n')
+
+
+def cache_image(queries, cache, alt):
+    """<img> for the first cached URL of the first query that has one, or ''."""
+    if queries and cache:
+        for q in queries:
+            if q in cache:
+                urls = cache[q].get('urls', [])
+                if urls:
+                    return f'<img src="{safe_img_url(urls[0])}" alt="{html_module.escape(alt)}" onerror="this.style.display=\'none\'">'
+    return ''
+
+
+@emits
+def render_hero(title, content, images, out=None):
     """Render hero section with dramatic full-screen impact."""
     lines = content.strip().split('\n') if content.strip() else []
     
@@ -84,7 +125,7 @@ def render_hero(title, content, images):
     # Clean title markers
     main_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', main_title)
     
-    return f"""
+    out.append(f"""
 <section class="hero">
     {bg_html}
     <div class="hero-content">
@@ -98,10 +139,11 @@ def render_hero(title, content, images):
         </svg>
     </div>
 </section>
-"""
+""")
 
 
-def render_cards(title, content, images):
+@emits
+def render_cards(title, content, images, out=None):
     """Render cards grid with smart content extraction."""
     lines = content.strip().split('\n') if content.strip() else []
     cards = []
@@ -112,12 +154,14 @@ def render_cards(title, content, images):
         if line.startswith('### '):
             if current_card:
                 cards.append(current_card)
-            current_card = {'title': line[4:].strip(), 'text': ''}
+            current_card = {'title': line[4:].strip(), 'text': []}
         elif line.strip() and current_card:
-            current_card['text'] += line.strip() + ' '
+            current_card['text'].append(line.strip() + ' ')
     
     if current_card:
         cards.append(current_card)
+    for card in cards:
+        card['text'] = ''.join(card['text'])
     
     # If no ### found, try bullet points
     if not cards:
@@ -142,7 +186,7 @@ def render_cards(title, content, images):
     
     # Build cards HTML
     clean_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', title)
-    cards_html = f'<section class="container cards-section"><h2>{process_inline_markdown(clean_title)}</h2><div class="cards-grid">\n'
+    out.append(f'<section class="container cards-section"><h2>{process_inline_markdown(clean_title)}</h2><div class="cards-grid">\n')
     
     for i, card in enumerate(cards):
         img_html = ''
@@ -150,17 +194,16 @@ def render_cards(title, content, images):
             img_html = f'<img src="{safe_img_url(images[i])}" alt="{html_module.escape(card["title"])}" onerror="this.style.display=\'none\'">'
         
         card_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', card['title'])
-        cards_html += f"""<div class="card">
+        out.append(f"""<div class="card">
     {img_html}
     <div class="card-content">
         <h4>{process_inline_markdown(card_title)}</h4>
         <p>{process_inline_markdown(card['text'].strip()[:200])}</p>
     </div>
 </div>
-"""
-    
-    cards_html += '</div></section>\n'
-    return cards_html
+""")
+
+    out.append('</div></section>\n')
 
 
 def extract_day_or_module_number(title):
@@ -188,7 +231,8 @@ def extract_day_or_module_number(title):
     return '•', ''
 
 
-def render_day_section(title, content, images, day_num=None):
+@emits
+def render_day_section(title, content, images, day_num=None, out=None):
     """Render day/activity section with number badge."""
     # Extract day/module number from title
     num, label = extract_day_or_module_number(title)
@@ -203,15 +247,7 @@ def render_day_section(title, content, images, day_num=None):
     clean_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', title)
     clean_title = re.sub(r'^\d+\.\d+\s+', '', clean_title)  # Remove section numbers
     
-    # Build images HTML
-    images_html = ''
-    if images:
-        images_html = '<div class="day-images">\n'
-        for url in images[:3]:
-            images_html += f'    <img src="{safe_img_url(url)}" alt="" onerror="this.style.display=\'none\'">\n'
-        images_html += '</div>\n'
-    
-    return f"""
+    out.append(f"""
 <div class="day-section container-wide">
     <div class="day-badge">
         <div class="day-number">
@@ -222,124 +258,131 @@ def render_day_section(title, content, images, day_num=None):
     <div class="day-content">
         <h3 class="day-title">{process_inline_markdown(clean_title)}</h3>
         <div class="day-description">
-            {content_html}
+            """)
+    out.append(content_html)
+    out.append("""
         </div>
-        {images_html}
+        """)
+    if images:
+        out.append('<div class="day-images">\n')
+        image_tags(images[:3], '    ', out=out)
+        out.append('</div>\n')
+    out.append("""
     </div>
 </div>
-"""
+""")
 
 
-def render_gallery(title, content, images):
+@emits
+def render_gallery(title, content, images, out=None):
     """Render image gallery with large featured image."""
     clean_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', title)
     
-    gallery_html = f'<section class="container-wide gallery-section"><h2>{process_inline_markdown(clean_title)}</h2>'
+    out.append(f'<section class="container-wide gallery-section"><h2>{process_inline_markdown(clean_title)}</h2>')
     
     if images:
-        gallery_html += '<div class="gallery-grid">\n'
-        for url in images[:4]:  # Max 4 images for nice grid
-            gallery_html += f'    <img src="{safe_img_url(url)}" alt="" onerror="this.style.display=\'none\'">\n'
-        gallery_html += '</div>\n'
+        out.append('<div class="gallery-grid">\n')
+        image_tags(images[:4], '    ', out=out)  # Max 4 images for nice grid
+        out.append('</div>\n')
     
     # Add content if any
     if content and content.strip():
-        content_html = markdown_to_html(content)
-        gallery_html += f'<div class="container">{content_html}</div>'
+        out.append(f'<div class="container">{markdown_to_html(content)}</div>')
     
-    gallery_html += '</section>\n'
-    return gallery_html
+    out.append('</section>\n')
 
 
-def render_highlight(title, content, images):
+@emits
+def render_highlight(title, content, images, out=None):
     """Render highlight/callout box."""
     content_html = markdown_to_html(content) if content else ''
     clean_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', title)
     
-    return f"""
+    out.append(f"""
 <div class="highlight-section container">
     <div class="highlight-box">
         <h3>{process_inline_markdown(clean_title)}</h3>
         {content_html}
     </div>
 </div>
-"""
+""")
 
 
-def render_content(title, content, images):
+@emits
+def render_content(title, content, images, out=None):
     """Render standard content section."""
     content_html = markdown_to_html(content) if content else ''
     clean_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', title)
     
-    # Add images in a grid if available
-    images_html = ''
-    if images:
-        images_html = '<div class="content-images">\n'
-        for url in images[:2]:
-            images_html += f'<img src="{safe_img_url(url)}" alt="" onerror="this.style.display=\'none\'">\n'
-        images_html += '</div>\n'
-    
-    return f"""
+    out.append(f"""
 <section class="container content-section">
     <h2>{process_inline_markdown(clean_title)}</h2>
-    {images_html}
+    """)
+    # Add images in a grid if available
+    if images:
+        out.append('<div class="content-images">\n')
+        image_tags(images[:2], out=out)
+        out.append('</div>\n')
+    out.append(f"""
     {content_html}
 </section>
-"""
+""")
 
 
-def render_footer(title, content, images):
+@emits
+def render_footer(title, content, images, out=None):
     """Render footer section."""
     content_html = markdown_to_html(content) if content else ''
     
-    return f"""
+    out.append(f"""
 <footer>
     <div class="container">
         <h2>Journey Complete</h2>
         {content_html}
     </div>
 </footer>
-"""
+""")
 
 
-def render_table(table_data):
+@emits
+def render_table(table_data, out=None):
     """Render a table from structured data."""
     if not table_data:
-        return ''
+        return
     
     headers = table_data.get('headers', [])
     rows = table_data.get('rows', [])
     
     if not headers and not rows:
-        return ''
+        return
     
-    html = '<div class="table-wrapper"><table>\n'
+    out.append('<div class="table-wrapper"><table>\n')
     
     if headers:
-        html += '<thead><tr>\n'
+        out.append('<thead><tr>\n')
         for h in headers:
-            html += f'<th>{h}</th>\n'
-        html += '</tr></thead>\n'
+            out.append(f'<th>{h}</th>\n')
+        out.append('</tr></thead>\n')
     
     if rows:
-        html += '<tbody>\n'
+        out.append('<tbody>\n')
         for row in rows:
-            html += '<tr>\n'
+            out.append('<tr>\n')
             for cell in row:
-                html += f'<td>{cell}</td>\n'
-            html += '</tr>\n'
-        html += '</tbody>\n'
+                out.append(f'<td>{cell}</td>\n')
+            out.append('</tr>\n')
+        out.append('</tbody>\n')
     
-    html += '</table></div>\n'
-    return html
+    out.append('</table></div>\n')
 
 
-def render_itinerary_cards(itinerary, cache=None):
+@emits
+def render_itinerary_cards(itinerary, cache=None, out=None):
     """Render itinerary items as cards."""
     if not itinerary:
-        return ''
+        return
     
-    html = '<div class="cards-grid">\n'
+    out.append('<div class="cards-grid">\n')
     
     for item in itinerary:
         day = item.get('day', '')
@@ -350,55 +393,48 @@ def render_itinerary_cards(itinerary, cache=None):
         item_content = item.get('content', '')
         highlights = item.get('highlights', [])
         activities = item.get('activities', [])
-        queries = item.get('queries', [])
         
         # Get image for this item
-        img_html = ''
-        if queries and cache:
-            for q in queries:
-                if q in cache:
-                    urls = cache[q].get('urls', [])
-                    if urls:
-                        img_html = f'<img src="{safe_img_url(urls[0])}" alt="{html_module.escape(item_title)}" onerror="this.style.display=\'none\'">'
-                        break
+        img_html = cache_image(item.get('queries', []), cache, item_title)
         
-        # Build card content
-        card_content = ''
+        out.append(f'''<div class="card">
+    {img_html}
+    <div class="card-content">
+        <div class="card-day-badge">Day {day}</div>
+        <h4>{item_title}</h4>
+        ''')
+        
+        # Card content
         if location:
-            card_content += f'<p class="card-meta">📍 {location}</p>'
+            out.append(f'<p class="card-meta">📍 {location}</p>')
         if distance:
-            card_content += f'<p class="card-meta">🚴 {distance}</p>'
+            out.append(f'<p class="card-meta">🚴 {distance}</p>')
         if terrain:
-            card_content += f'<p class="card-meta">🛤️ {terrain}</p>'
+            out.append(f'<p class="card-meta">🛤️ {terrain}</p>')
         if item_content:
-            card_content += f'<p>{item_content[:200]}</p>'
+            out.append(f'<p>{item_content[:200]}</p>')
         
         # Highlights or activities
         items_list = highlights or activities
         if items_list:
-            card_content += '<ul class="card-highlights">'
+            out.append('<ul class="card-highlights">')
             for h in items_list[:4]:
-                card_content += f'<li>{h}</li>'
-            card_content += '</ul>'
+                out.append(f'<li>{h}</li>')
+            out.append('</ul>')
         
-        html += f'''<div class="card">
-    {img_html}
-    <div class="card-content">
-        <div class="card-day-badge">Day {day}</div>
-        <h4>{item_title}</h4>
-        {card_content}
+        out.append('''
     </div>
 </div>
-'''
-    
-    html += '</div>\n'
-    return html
+''')
+
+    out.append('</div>\n')
 
 
-def render_meta_bar(meta):
+@emits
+def render_meta_bar(meta, out=None):
     """Render section metadata (duration, location, theme) as a styled bar."""
     if not meta:
-        return ''
+        return
     
     items = []
     if meta.get('Duration'):
@@ -412,65 +448,57 @@ def render_meta_bar(meta):
         theme = meta.get('Theme') or meta.get('theme') or meta.get('focus')
         items.append(f'<span class="meta-item">🎯 {theme}</span>')
     
-    if not items:
-        return ''
-    
-    return f'<div class="section-meta-bar">{" ".join(items)}</div>\n'
+    if items:
+        out.append(f'<div class="section-meta-bar">{" ".join(items)}</div>\n')
 
 
-def render_cards_from_data(cards, cache=None):
+@emits
+def render_cards_from_data(cards, cache=None, out=None):
     """Render cards from a cards array in YAML."""
     if not cards:
-        return ''
+        return
     
-    html = '<div class="cards-grid">\n'
+    out.append('<div class="cards-grid">\n')
     
     for card in cards:
         card_title = card.get('title', '')
         card_content = card.get('content', '')
-        card_queries = card.get('queries', [])
         card_bullets = card.get('bullets', [])
         
         # Get image for this card
-        img_html = ''
-        if card_queries and cache:
-            for q in card_queries:
-                if q in cache:
-                    urls = cache[q].get('urls', [])
-                    if urls:
-                        img_html = f'<img src="{safe_img_url(urls[0])}" alt="{html_module.escape(card_title)}" onerror="this.style.display=\'none\'">'
-                        break
+        img_html = cache_image(card.get('queries', []), cache, card_title)
+        
+        out.append(f'''<div class="card">
+    {img_html}
+    <div class="card-content">
+        <h4>{process_inline_markdown(card_title)}</h4>
+        ''')
         
-        # Build card content
-        content_html = ''
+        # Card content
         if card_content:
-            content_html = f'<p>{process_inline_markdown(card_content[:300])}</p>'
+            out.append(f'<p>{process_inline_markdown(card_content[:300])}</p>')
         
         if card_bullets:
-            content_html += '<ul class="card-highlights">'
+            out.append('<ul class="card-highlights">')
             for b in card_bullets[:5]:
-                content_html += f'<li>{process_inline_markdown(b)}</li>'
-            content_html += '</ul>'
+                out.append(f'<li>{process_inline_markdown(b)}</li>')
+            out.append('</ul>')
         
-        html += f'''<div class="card">
-    {img_html}
-    <div class="card-content">
-        <h4>{process_inline_markdown(card_title)}</h4>
-        {content_html}
+        out.append('''
     </div>
 </div>
-'''
-    
-    html += '</div>\n'
-    return html
+''')
+
+    out.append('</div>\n')
 
 
-def render_itinerary_full(itinerary, cache=None):
+@emits
+def render_itinerary_full(itinerary, cache=None, out=None):
     """Render full itinerary items as cards."""
     if not itinerary:
-        return ''
+        return
     
-    html = '<div class="cards-grid itinerary-cards">\n'
+    out.append('<div class="cards-grid itinerary-cards">\n')
     
     for item in itinerary:
         day = item.get('day', '')
@@ -483,20 +511,16 @@ def render_itinerary_full(itinerary, cache=None):
         details = item.get('details', [])
         highlights = item.get('highlights', [])
         dietary_note = item.get('dietary_note', '')
-        queries = item.get('queries', [])
         
         # Get image for this card
-        card_img = ''
-        if queries and cache:
-            for q in queries:
-                if q in cache:
-                    urls = cache[q].get('urls', [])
-                    if urls:
-                        card_img = f'<img src="{safe_img_url(urls[0])}" alt="{html_module.escape(item_title)}" onerror="this.style.display=\'none\'">'
-                        break
+        card_img = cache_image(item.get('queries', []), cache, item_title)
         
-        # Build card content
-        content_html = ''
+        out.append(f'''<div class="card day-card">
+    <div class="day-badge-inline">Day {day}</div>
+    {card_img}
+    <div class="card-content">
+        <h4>{process_inline_markdown(item_title)}</h4>
+        ''')
         
         # Meta info
         meta_items = []
@@ -508,43 +532,38 @@ def render_itinerary_full(itinerary, cache=None):
             meta_items.append(f'🛤️ {terrain}')
         
         if meta_items:
-            content_html += f'<div class="card-meta">{" · ".join(meta_items)}</div>\n'
+            out.append(f'<div class="card-meta">{" · ".join(meta_items)}</div>\n')
         
         if item_content:
             # Truncate long content for card display
             truncated = item_content[:250] + '...' if len(item_content) > 250 else item_content
-            content_html += f'<p>{process_inline_markdown(truncated)}</p>\n'
+            out.append(f'<p>{process_inline_markdown(truncated)}</p>\n')
         
         # Activities or details list (show first few)
         list_items = activities or details or highlights
         if list_items:
-            content_html += '<ul class="card-highlights">\n'
+            out.append('<ul class="card-highlights">\n')
             for li in list_items[:4]:  # Max 4 items
-                content_html += f'<li>{process_inline_markdown(li)}</li>\n'
+                out.append(f'<li>{process_inline_markdown(li)}</li>\n')
             if len(list_items) > 4:
-                content_html += f'<li class="more-items">+{len(list_items) - 4} more...</li>\n'
-            content_html += '</ul>\n'
+                out.append(f'<li class="more-items">+{len(list_items) - 4} more...</li>\n')
+            out.append('</ul>\n')
         
         if dietary_note:
             # Truncate dietary note for card
             truncated_note = dietary_note[:150] + '...' if len(dietary_note) > 150 else dietary_note
-            content_html += f'<div class="card-dietary-note">🍽️ {process_inline_markdown(truncated_note)}</div>\n'
+            out.append(f'<div class="card-dietary-note">🍽️ {process_inline_markdown(truncated_note)}</div>\n')
         
-        html += f'''<div class="card day-card">
-    <div class="day-badge-inline">Day {day}</div>
-    {card_img}
-    <div class="card-content">
-        <h4>{process_inline_markdown(item_title)}</h4>
-        {content_html}
+        out.append('''
     </div>
 </div>
-'''
-    
-    html += '</div>\n'
-    return html
+''')
+
+    out.append('</div>\n')
 
 
-def render_section(style, title, content, images, section_data=None, cache=None):
+@emits
+def render_section(style, title, content, images, section_data=None, cache=None, out=None):
     """
     Render a section based on its style.
     
@@ -555,9 +574,10 @@ def render_section(style, title, content, images, section_data=None, cache=None)
         images: List of image URLs
         section_data: Full section dict for advanced rendering (itinerary, table, etc.)
         cache: Image cache for nested lookups
+        out: List of HTML parts to append to (see emits)
     
     Returns:
-        HTML string
+        HTML string, or None when writing into `out`
     """
     section_data = section_data or {}
     meta = section_data.get('meta', {})
@@ -565,73 +585,69 @@ def render_section(style, title, content, images, section_data=None, cache=None)
     itinerary = section_data.get('itinerary', [])
     
     if style == 'hero':
-        return render_hero(title, content, images)
+        render_hero(title, content, images, out=out)
     
     elif style == 'cards':
         clean_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', title)
-        base_html = f'<section class="container cards-section"><h2>{process_inline_markdown(clean_title)}</h2>\n'
+        out.append(f'<section class="container cards-section"><h2>{process_inline_markdown(clean_title)}</h2>\n')
         if content:
-            base_html += f'<p class="section-intro">{process_inline_markdown(content)}</p>\n'
+            out.append(f'<p class="section-intro">{process_inline_markdown(content)}</p>\n')
         
         # Check if we have cards data
         if cards:
-            base_html += render_cards_from_data(cards, cache)
+            render_cards_from_data(cards, cache, out=out)
         # Or itinerary data to render as cards
         elif itinerary:
-            base_html += render_itinerary_cards(itinerary, cache)
+            render_itinerary_cards(itinerary, cache, out=out)
         else:
             # Fall back to parsing content
-            base_html += '<div class="cards-grid"></div>\n'
+            out.append('<div class="cards-grid"></div>\n')
         
-        base_html += '</section>\n'
-        return base_html
+        out.append('</section>\n')
     
     elif style == 'day-section':
         # Check if we have itinerary items to render
         if itinerary:
             clean_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', title)
-            html = f'<section class="container"><h2>{process_inline_markdown(clean_title)}</h2>\n'
+            out.append(f'<section class="container"><h2>{process_inline_markdown(clean_title)}</h2>\n')
             if content:
-                html += f'<p class="section-intro">{process_inline_markdown(content)}</p>\n'
-            html += '</section>\n'
-            html += render_itinerary_full(itinerary, cache)
-            return html
-        return render_day_section(title, content, images)
+                out.append(f'<p class="section-intro">{process_inline_markdown(content)}</p>\n')
+            out.append('</section>\n')
+            render_itinerary_full(itinerary, cache, out=out)
+        else:
+            render_day_section(title, content, images, out=out)
     
     elif style == 'gallery':
         clean_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', title)
-        html = f'<section class="container-wide gallery-section"><h2>{process_inline_markdown(clean_title)}</h2>'
+        out.append(f'<section class="container-wide gallery-section"><h2>{process_inline_markdown(clean_title)}</h2>')
         
         # Add meta bar if present
-        html += render_meta_bar(meta)
+        render_meta_bar(meta, out=out)
         
         if images:
-            html += '<div class="gallery-grid">\n'
-            for url in images[:4]:
-                html += f'    <img src="{safe_img_url(url)}" alt="" onerror="this.style.display=\'none\'">\n'
-            html += '</div>\n'
+            out.append('<div class="gallery-grid">\n')
+            image_tags(images[:4], '    ', out=out)
+            out.append('</div>\n')
         
         if content:
-            html += f'<div class="container"><p>{process_inline_markdown(content)}</p></div>'
+            out.append(f'<div class="container"><p>{process_inline_markdown(content)}</p></div>')
         
-        html += '</section>\n'
-        return html
+        out.append('</section>\n')
     
     elif style == 'highlight':
-        return render_highlight(title, content, images)
+        render_highlight(title, content, images, out=out)
     
     elif style == 'table':
         table_data = section_data.get('table')
         clean_title = re.sub(r'\*\*([^*]+)\*\*', r'\1', title)
-        table_html = f'<section class="container content-section"><h2>{process_inline_markdown(clean_title)}</h2>\n'
+        out.append(f'<section class="container content-section"><h2>{process_inline_markdown(clean_title)}</h2>\n')
         if content:
-            table_html += f'<p>{process_inline_markdown(content)}</p>\n'
-        table_html += render_table(table_data)
-        table_html += '</section>\n'
-        return table_html
+            out.append(f'<p>{process_inline_markdown(content)}</p>\n')
+        render_table(table_data, out=out)
+        out.append('</section>\n')
     
     elif style == 'footer':
-        return render_footer(title, content, images)
+        render_footer(title, content, images, out=out)
     
     else:  # default to 'content'
-        return render_content(title, content, images)
+        render_content(title, content, images, out=out)
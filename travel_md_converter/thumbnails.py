@@ -0,0 +1,262 @@
+"""
+Thumbnail handling shared by the scraping and selection steps.
+
+Normalization (after download): sniff the real image format, downsize to
+MAX_EDGE and re-encode as JPEG, so every thumbnail sent to Gemini Vision is
+small and uniform, and compute a 64-bit perceptual hash (dHash) used to
+collapse near-duplicate candidates. Resizing and hashing need Pillow;
+without it thumbnails are only sniffed. Batches are spread over a process
+pool.
+
+Loading (at selection): thumbnails are read as raw bytes (no base64 round
+trip) through an in-process LRU bounded by total bytes, so candidates
+shared by many sections are read from disk once per run. Entries are
+validated against the file's size and mtime, so a re-downloaded thumbnail
+is picked up.
+"""
+
+import io
+import os
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+# Normalized thumbnails: longest edge in pixels and JPEG quality
+MAX_EDGE = 384
+JPEG_QUALITY = 80
+
+# Below this many images, normalize in-process rather than starting a pool
+MIN_POOL_BATCH = 4
+
+# dHashes at most this many bits apart are treated as the same picture
+NEAR_DUPLICATE_DISTANCE = 6
+
+MAGIC_NUMBERS = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+]
+
+
+def sniff_mime(data):
+    """Detect an image's MIME type from its magic bytes. None if not an image."""
+    for magic, mime in MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:12] in (b'ftypavif', b'ftypheic'):
+        return 'image/avif' if data[8:12] == b'avif' else 'image/heic'
+    return None
+
+
+def dhash(img):
+    """
+    64-bit difference hash of a PIL image, as 16 hex digits.
+
+    Shrinks to 9x8 greyscale and records whether each pixel is brighter
+    than its right-hand neighbour, so it survives rescaling, recompression
+    and small colour shifts.
+    """
+    small = img.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return f'{value:016x}'
+
+
+class HashIndex:
+    """
+    Index of 64-bit hashes for near-duplicate lookup.
+
+    Each hash is split into max_distance + 1 bands. Two hashes within
+    max_distance bits must agree exactly on at least one band, so a lookup
+    only compares against hashes sharing a band instead of every entry.
+    """
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = 64 // bands
+        self.bands = [(i * width, 64 if i == bands - 1 else (i + 1) * width) for i in range(bands)]
+        self.buckets = [{} for _ in self.bands]
+        self.items = []
+
+    def _band_keys(self, value):
+        return [(value >> start) & ((1 << (end - start)) - 1) for start, end in self.bands]
+
+    def find(self, hex_hash):
+        """Return the first indexed item within max_distance, or None."""
+        value = int(hex_hash, 16)
+        seen = set()
+        for buckets, key in zip(self.buckets, self._band_keys(value)):
+            for idx in buckets.get(key, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                other, item = self.items[idx]
+                if (value ^ other).bit_count() <= self.max_distance:
+                    return item
+        return None
+
+    def add(self, hex_hash, item):
+        value = int(hex_hash, 16)
+        idx = len(self.items)
+        self.items.append((value, item))
+        for buckets, key in zip(self.buckets, self._band_keys(value)):
+            buckets.setdefault(key, []).append(idx)
+
+
+def normalize_thumbnail(path):
+    """
+    Normalize one thumbnail in place.
+
+    With Pillow, images larger than MAX_EDGE or not already JPEG are
+    downsized and re-encoded as JPEG (written atomically). Returns a dict
+    of mime, thumb_bytes and (with Pillow) thumb_width/thumb_height and
+    dhash, or None if the file isn't a readable image.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    mime = sniff_mime(data)
+    if mime is None:
+        return None
+    if Image is None:
+        return {'mime': mime, 'thumb_bytes': len(data)}
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            if mime != 'image/jpeg' or max(img.size) > MAX_EDGE:
+                img.thumbnail((MAX_EDGE, MAX_EDGE))
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                out = io.BytesIO()
+                img.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+                data = out.getvalue()
+                mime = 'image/jpeg'
+                tmp_path = f"{path}.tmp{os.getpid()}"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            width, height = img.size
+            phash = dhash(img)
+    except Exception:
+        # Undecodable - keep the original bytes, just record what we know
+        return {'mime': mime, 'thumb_bytes': len(data)}
+
+    return {
+        'mime': mime,
+        'thumb_bytes': len(data),
+        'thumb_width': width,
+        'thumb_height': height,
+        'dhash': phash,
+    }
+
+
+def normalize_thumbnails(paths, pool=None):
+    """
+    Normalize many thumbnails; returns one info dict (or None) per path.
+
+    Uses `pool` (a ProcessPoolExecutor) when given and the batch is large
+    enough to be worth it.
+    """
+    paths = [str(p) for p in paths]
+    if pool is not None and Image is not None and len(paths) >= MIN_POOL_BATCH:
+        return list(pool.map(normalize_thumbnail, paths))
+    return [normalize_thumbnail(p) for p in paths]
+
+
+def make_pool(workers=None):
+    """
+    Process pool for normalization, or None if Pillow isn't installed.
+
+    Uses spawn rather than fork: the scraper's download threads are running
+    when the pool starts its workers.
+    """
+    if Image is None:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class ThumbnailCache:
+    """Thread-safe LRU of file bytes, bounded by total size."""
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> (size, mtime_ns, data)
+        self._lock = threading.Lock()
+
+    def read(self, path):
+        """Return the file's bytes, or None if it can't be read."""
+        path = str(path)
+        try:
+            st = Path(path).stat()
+        except OSError:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old:
+                self.total_bytes -= len(old[2])
+            if len(data) <= self.max_bytes:
+                self._entries[path] = (st.st_size, st.st_mtime_ns, data)
+                self.total_bytes += len(data)
+                while self.total_bytes > self.max_bytes:
+                    _, (_, _, evicted) = self._entries.popitem(last=False)
+                    self.total_bytes -= len(evicted)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+_cache = ThumbnailCache()
+
+
+def read_thumbnail(path):
+    """Read a thumbnail's bytes through the shared LRU. None if unreadable."""
+    return _cache.read(path)
+
+
+def cache_stats():
+    """(hits, misses, bytes held) for the shared thumbnail cache."""
+    return _cache.hits, _cache.misses, _cache.total_bytes
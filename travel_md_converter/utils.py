@@ -5,6 +5,8 @@ Utility functions for markdown parsing and HTML generation.
 import re
 from typing import List, Dict, Tuple
 
+from mdrender import render_inline, render_markdown, render_table
+
 
 def slugify(text):
     """Convert text to URL-safe slug."""
@@ -30,15 +32,8 @@ def normalize_title(text):
 
 
 def process_inline_markdown(text):
-    """Convert inline markdown (bold, italic, links) to HTML."""
-    # Bold
-    text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', text)
-    # Italic
-    text = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', text)
-    text = re.sub(r'_([^_]+)_', r'<em>\1</em>', text)
-    # Links
-    text = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', text)
-    return text
+    """Convert inline markdown (code, bold, italic, links) to HTML."""
+    return render_inline(text)
 
 
 def parse_table(lines: List[str], start_idx: int) -> Tuple[str, int]:
@@ -46,114 +41,17 @@ def parse_table(lines: List[str], start_idx: int) -> Tuple[str, int]:
     Parse a markdown table starting at the given index.
     Returns (html_string, next_line_index).
     """
-    table_lines = []
-    i = start_idx
-    
-    # Collect all table lines
-    while i < len(lines) and '|' in lines[i]:
-        table_lines.append(lines[i].strip())
-        i += 1
-    
-    if len(table_lines) < 2:
-        return '', start_idx
-    
-    html = '<div class="table-wrapper"><table>\n'
-    
-    # Parse header row
-    header_cells = [cell.strip() for cell in table_lines[0].split('|') if cell.strip()]
-    html += '<thead><tr>\n'
-    for cell in header_cells:
-        html += f'<th>{process_inline_markdown(cell)}</th>\n'
-    html += '</tr></thead>\n'
-    
-    # Skip separator row (line with :---: patterns)
-    data_start = 1
-    if len(table_lines) > 1 and re.match(r'^[\s|:\-]+$', table_lines[1]):
-        data_start = 2
-    
-    # Parse data rows
-    if data_start < len(table_lines):
-        html += '<tbody>\n'
-        for row in table_lines[data_start:]:
-            cells = [cell.strip() for cell in row.split('|') if cell.strip()]
-            html += '<tr>\n'
-            for cell in cells:
-                html += f'<td>{process_inline_markdown(cell)}</td>\n'
-            html += '</tr>\n'
-        html += '</tbody>\n'
-    
-    html += '</table></div>\n'
-    return html, i
+    out = []
+    next_idx = render_table(lines, start_idx, out)
+    return ''.join(out), next_idx
 
 
 def markdown_to_html(md_text):
     """
     Convert basic markdown to HTML.
-    Handles: paragraphs, lists, bold, italic, links, tables.
+    Handles: paragraphs, nested lists, bold, italic, code, links, tables.
     """
-    lines = md_text.split('\n')
-    html_parts = []
-    i = 0
-    in_list = False
-    list_type = None
-    
-    while i < len(lines):
-        line = lines[i]
-        
-        # Close list if needed
-        if in_list and not (line.strip().startswith('- ') or line.strip().startswith('* ') or re.match(r'^\d+\.', line.strip())):
-            html_parts.append(f'</{list_type}>')
-            in_list = False
-            list_type = None
-        
-        # Skip headers (handled separately)
-        if line.startswith('#'):
-            i += 1
-            continue
-        
-        # Horizontal rule
-        if line.strip() == '---':
-            html_parts.append('<hr>')
-            i += 1
-            continue
-        
-        # Table detection (line starts with | or has | separators)
-        if '|' in line and line.strip().startswith('|'):
-            table_html, next_i = parse_table(lines, i)
-            if table_html:
-                html_parts.append(table_html)
-                i = next_i
-                continue
-        
-        # Unordered list
-        if line.strip().startswith('- ') or line.strip().startswith('* '):
-            if not in_list:
-                html_parts.append('<ul>')
-                in_list = True
-                list_type = 'ul'
-            content = line.strip()[2:]
-            html_parts.append(f'<li>{process_inline_markdown(content)}</li>')
-        
-        # Ordered list
-        elif re.match(r'^\d+\.', line.strip()):
-            if not in_list:
-                html_parts.append('<ol>')
-                in_list = True
-                list_type = 'ol'
-            content = re.sub(r'^\d+\.\s*', '', line.strip())
-            html_parts.append(f'<li>{process_inline_markdown(content)}</li>')
-        
-        # Paragraph
-        elif line.strip():
-            html_parts.append(f'<p>{process_inline_markdown(line)}</p>')
-        
-        i += 1
-    
-    # Close any open list
-    if in_list:
-        html_parts.append(f'</{list_type}>')
-    
-    return '\n'.join(html_parts)
+    return '\n'.join(render_markdown(md_text, []))
 
 
 def parse_markdown_sections(md_content: str, sections_info: List[Dict]) -> Dict[str, str]: